@@ -1,11 +1,14 @@
 """Configuración del entorno de Alembic."""
 from logging.config import fileConfig
 
+from dotenv import load_dotenv
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
 
+load_dotenv()
+
 from app.models.models import Base
 from app.core.config import Config
 
@@ -0,0 +1,64 @@
+"""lz4 TOAST compression for transaction payloads
+
+Revision ID: a1d7e4c9b3f6
+Revises: f8c3a7e1d5b2
+Create Date: 2025-10-27 16:05:48.219374
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1d7e4c9b3f6'
+down_revision = 'f8c3a7e1d5b2'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+TABLES = ('transactions', 'transactions_archive')
+PAYLOAD_COLUMNS = ('payload_in', 'result_payload')
+
+# Tamaño de fila a partir del cual PostgreSQL comprime las columnas largas
+# (por defecto ~2 kB): los payloads medianos también se comprimen
+TOAST_TUPLE_TARGET = 1024
+
+
+def upgrade() -> None:
+    # En otros motores la compresión la hace CompressedJSON al escribir y las
+    # filas existentes, en texto JSON, se siguen leyendo sin cambios
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    
+    for table in TABLES:
+        op.execute(f'ALTER TABLE {table} SET (toast_tuple_target = {TOAST_TUPLE_TARGET})')
+    
+    # lz4 (PostgreSQL 14+ compilado con lz4) comprime y descomprime mucho más
+    # rápido que pglz. Solo aplica a los valores que se escriban desde ahora;
+    # los ya guardados con pglz se leen igual
+    if bind.dialect.server_version_info < (14,):
+        logger.warning('PostgreSQL < 14: los payloads siguen comprimiéndose con pglz')
+        return
+    try:
+        with bind.begin_nested():
+            for table in TABLES:
+                for column in PAYLOAD_COLUMNS:
+                    op.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET COMPRESSION lz4')
+    except sa.exc.DBAPIError:
+        logger.warning('El servidor no soporta lz4: los payloads siguen comprimiéndose con pglz')
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    
+    for table in TABLES:
+        if bind.dialect.server_version_info >= (14,):
+            for column in PAYLOAD_COLUMNS:
+                op.execute(f'ALTER TABLE {table} ALTER COLUMN {column} SET COMPRESSION DEFAULT')
+        op.execute(f'ALTER TABLE {table} RESET (toast_tuple_target)')
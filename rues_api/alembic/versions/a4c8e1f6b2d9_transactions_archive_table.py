@@ -0,0 +1,51 @@
+"""Transactions archive table
+
+Revision ID: a4c8e1f6b2d9
+Revises: f3b7d2e8a1c5
+Create Date: 2025-10-13 16:08:31.704512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e1f6b2d9'
+down_revision = 'f3b7d2e8a1c5'
+branch_labels = None
+depends_on = None
+
+
+def _json_payload():
+    return sa.JSON(none_as_null=True).with_variant(postgresql.JSONB(none_as_null=True), 'postgresql')
+
+
+def upgrade() -> None:
+    # Transacciones finalizadas fuera de la tabla caliente (conservan su id)
+    op.create_table('transactions_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('company_id', sa.Integer(), nullable=True),
+        sa.Column('nit', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('payload_in', _json_payload(), nullable=True),
+        sa.Column('result_payload', _json_payload(), nullable=True),
+        sa.Column('error_code', sa.String(), nullable=True),
+        sa.Column('error_msg', sa.String(), nullable=True),
+        sa.Column('runner_id', sa.String(), nullable=True),
+        sa.Column('idempotency_key', sa.String(), nullable=True),
+        sa.Column('client_id', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_transactions_archive_nit'), 'transactions_archive', ['nit'], unique=False)
+    op.create_index('ix_transactions_archive_client_idempotency_key', 'transactions_archive', ['client_id', 'idempotency_key'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_archive_client_idempotency_key', table_name='transactions_archive')
+    op.drop_index(op.f('ix_transactions_archive_nit'), table_name='transactions_archive')
+    op.drop_table('transactions_archive')
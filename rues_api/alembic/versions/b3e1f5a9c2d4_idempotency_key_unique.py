@@ -0,0 +1,34 @@
+"""Idempotency-Key unique per client
+
+Revision ID: b3e1f5a9c2d4
+Revises: 7f0764d3b08e
+Create Date: 2025-10-02 10:12:45.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e1f5a9c2d4'
+down_revision = '7f0764d3b08e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Cliente (dueño de la API Key) que creó la transacción
+    op.add_column('transactions', sa.Column('client_id', sa.String(), nullable=True))
+    
+    # Las filas existentes quedan con client_id NULL y no entran en conflicto
+    op.create_index(
+        'uq_transactions_client_idempotency_key',
+        'transactions',
+        ['client_id', 'idempotency_key'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_transactions_client_idempotency_key', table_name='transactions')
+    op.drop_column('transactions', 'client_id')
@@ -0,0 +1,28 @@
+"""Request hash for Idempotency-Key replays
+
+Revision ID: b5e2d8f4a7c1
+Revises: a1d7e4c9b3f6
+Create Date: 2025-10-30 11:18:52.640517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e2d8f4a7c1'
+down_revision = 'a1d7e4c9b3f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Columna nullable sin default: no reescribe la tabla. Las transacciones
+    # existentes quedan sin hash y sus reintentos se aceptan como antes
+    for table in ('transactions', 'transactions_archive'):
+        op.add_column(table, sa.Column('request_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    for table in ('transactions', 'transactions_archive'):
+        op.drop_column(table, 'request_hash')
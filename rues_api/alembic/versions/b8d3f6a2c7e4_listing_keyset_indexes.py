@@ -0,0 +1,27 @@
+"""Listing keyset indexes
+
+Revision ID: b8d3f6a2c7e4
+Revises: a4c8e1f6b2d9
+Create Date: 2025-10-14 10:21:46.380157
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3f6a2c7e4'
+down_revision = 'a4c8e1f6b2d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Paginación por keyset (created_at, id) del listado y la exportación
+    op.create_index('ix_transactions_created_at_id', 'transactions', ['created_at', 'id'], unique=False)
+    op.create_index('ix_transactions_archive_created_at_id', 'transactions_archive', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_archive_created_at_id', table_name='transactions_archive')
+    op.drop_index('ix_transactions_created_at_id', table_name='transactions')
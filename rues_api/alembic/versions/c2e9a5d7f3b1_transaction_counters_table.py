@@ -0,0 +1,38 @@
+"""Transaction counters table
+
+Revision ID: c2e9a5d7f3b1
+Revises: b8d3f6a2c7e4
+Create Date: 2025-10-15 12:37:09.551827
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e9a5d7f3b1'
+down_revision = 'b8d3f6a2c7e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Contadores incrementales por estado, repartidos en shards
+    op.create_table('transaction_counters',
+        sa.Column('nit', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('nit', 'status', 'shard')
+    )
+    
+    # Backfill del total por estado con las transacciones existentes
+    op.execute(
+        "INSERT INTO transaction_counters (nit, status, shard, count) "
+        "SELECT '', status, 0, COUNT(*) FROM transactions "
+        "WHERE status IS NOT NULL GROUP BY status"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('transaction_counters')
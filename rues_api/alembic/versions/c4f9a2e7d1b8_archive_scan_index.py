@@ -0,0 +1,52 @@
+"""Partial index for the archive scan
+
+Revision ID: c4f9a2e7d1b8
+Revises: b5e2d8f4a7c1
+Create Date: 2025-11-03 11:18:52.640917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f9a2e7d1b8'
+down_revision = 'b5e2d8f4a7c1'
+branch_labels = None
+depends_on = None
+
+FINISHED = sa.text("status IN ('PROCESADO', 'ERROR', 'FALLIDO')")
+
+
+def upgrade() -> None:
+    # Índice parcial (updated_at, id) solo con las finalizadas: el archivado
+    # lo recorre en orden sin pasar por las filas en curso y se detiene en el corte
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY no bloquea escrituras, pero no puede ir en una transacción
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_transactions_finished_updated_at',
+                'transactions',
+                ['updated_at', 'id'],
+                postgresql_where=FINISHED,
+                postgresql_concurrently=True
+            )
+    else:
+        op.create_index(
+            'ix_transactions_finished_updated_at',
+            'transactions',
+            ['updated_at', 'id'],
+            sqlite_where=FINISHED
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                'ix_transactions_finished_updated_at',
+                table_name='transactions',
+                postgresql_concurrently=True
+            )
+    else:
+        op.drop_index('ix_transactions_finished_updated_at', table_name='transactions')
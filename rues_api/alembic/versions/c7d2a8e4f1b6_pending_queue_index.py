@@ -0,0 +1,42 @@
+"""Partial index for the pending queue
+
+Revision ID: c7d2a8e4f1b6
+Revises: b3e1f5a9c2d4
+Create Date: 2025-10-03 09:41:17.502931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2a8e4f1b6'
+down_revision = 'b3e1f5a9c2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Índice parcial (created_at, id) solo con las filas PENDIENTE: el claim
+    # lo recorre en orden sin tocar las transacciones ya terminadas
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY no bloquea escrituras, pero no puede ir en una transacción
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_transactions_pending_queue',
+                'transactions',
+                ['created_at', 'id'],
+                postgresql_where=sa.text("status = 'PENDIENTE'"),
+                postgresql_concurrently=True
+            )
+    else:
+        op.create_index(
+            'ix_transactions_pending_queue',
+            'transactions',
+            ['created_at', 'id'],
+            sqlite_where=sa.text("status = 'PENDIENTE'")
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_pending_queue', table_name='transactions')
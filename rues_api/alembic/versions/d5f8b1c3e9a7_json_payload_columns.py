@@ -0,0 +1,50 @@
+"""JSONB payload columns
+
+Revision ID: d5f8b1c3e9a7
+Revises: c7d2a8e4f1b6
+Create Date: 2025-10-06 15:27:03.846115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f8b1c3e9a7'
+down_revision = 'c7d2a8e4f1b6'
+branch_labels = None
+depends_on = None
+
+PAYLOAD_COLUMNS = ('payload_in', 'result_payload')
+
+
+def upgrade() -> None:
+    # En SQLite el tipo JSON se guarda como texto: las filas existentes ya
+    # contienen JSON serializado y no requieren cambios
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    
+    # El USING convierte (backfill) el texto JSON existente a JSONB
+    for column_name in PAYLOAD_COLUMNS:
+        op.alter_column(
+            'transactions',
+            column_name,
+            type_=postgresql.JSONB(),
+            existing_type=sa.Text(),
+            postgresql_using=f'{column_name}::jsonb'
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    
+    for column_name in PAYLOAD_COLUMNS:
+        op.alter_column(
+            'transactions',
+            column_name,
+            type_=sa.Text(),
+            existing_type=postgresql.JSONB(),
+            postgresql_using=f'{column_name}::text'
+        )
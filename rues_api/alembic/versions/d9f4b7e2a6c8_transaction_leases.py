@@ -0,0 +1,59 @@
+"""Transaction leases
+
+Revision ID: d9f4b7e2a6c8
+Revises: c2e9a5d7f3b1
+Create Date: 2025-10-16 14:52:38.126740
+
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9f4b7e2a6c8'
+down_revision = 'c2e9a5d7f3b1'
+branch_labels = None
+depends_on = None
+
+# Lease inicial de las transacciones que ya estaban en PROCESANDO
+BACKFILL_LEASE = timedelta(minutes=5)
+
+
+def upgrade() -> None:
+    op.add_column('transactions', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.add_column('transactions_archive', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    
+    # Índice parcial con las filas PROCESANDO: el reaper encuentra los leases
+    # vencidos sin recorrer las transacciones terminadas
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY no bloquea escrituras, pero no puede ir en una transacción
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_transactions_processing_lease',
+                'transactions',
+                ['lease_expires_at'],
+                postgresql_where=sa.text("status = 'PROCESANDO'"),
+                postgresql_concurrently=True
+            )
+    else:
+        op.create_index(
+            'ix_transactions_processing_lease',
+            'transactions',
+            ['lease_expires_at'],
+            sqlite_where=sa.text("status = 'PROCESANDO'")
+        )
+    
+    # Las transacciones reclamadas antes de esta migración reciben un lease
+    # para que el reaper también las recupere si su runner ya no existe
+    op.get_bind().execute(
+        sa.text("UPDATE transactions SET lease_expires_at = :expires_at WHERE status = 'PROCESANDO'"),
+        {"expires_at": datetime.now() + BACKFILL_LEASE}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_processing_lease', table_name='transactions')
+    op.drop_column('transactions_archive', 'lease_expires_at')
+    op.drop_column('transactions', 'lease_expires_at')
@@ -0,0 +1,33 @@
+"""API keys table
+
+Revision ID: e2a6c9d4b8f1
+Revises: d5f8b1c3e9a7
+Create Date: 2025-10-09 11:05:52.630418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a6c9d4b8f1'
+down_revision = 'd5f8b1c3e9a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # API Keys temporales compartidas entre procesos (solo el hash SHA-256)
+    op.create_table('api_keys',
+        sa.Column('key_hash', sa.String(length=64), nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key_hash')
+    )
+    op.create_index(op.f('ix_api_keys_expires_at'), 'api_keys', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_api_keys_expires_at'), table_name='api_keys')
+    op.drop_table('api_keys')
@@ -0,0 +1,59 @@
+"""Transaction priority and fair scheduling indexes
+
+Revision ID: e6a1c4f9d2b7
+Revises: d9f4b7e2a6c8
+Create Date: 2025-10-20 10:14:05.481932
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a1c4f9d2b7'
+down_revision = 'd9f4b7e2a6c8'
+branch_labels = None
+depends_on = None
+
+# (nombre, columnas, estado de las filas indexadas)
+INDEXES = (
+    ('ix_transactions_pending_priority', [sa.text('priority DESC'), 'created_at', 'id'], 'PENDIENTE'),
+    ('ix_transactions_pending_nit', ['nit', sa.text('priority DESC'), 'created_at', 'id'], 'PENDIENTE'),
+    ('ix_transactions_processing_nit', ['nit'], 'PROCESANDO'),
+)
+
+
+def upgrade() -> None:
+    # Con un default constante PostgreSQL 11+ no reescribe la tabla
+    for table in ('transactions', 'transactions_archive'):
+        op.add_column(
+            table,
+            sa.Column('priority', sa.SmallInteger(), nullable=False, server_default=sa.text('0'))
+        )
+    
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY no bloquea escrituras, pero no puede ir en una transacción
+        with op.get_context().autocommit_block():
+            for name, columns, status in INDEXES:
+                op.create_index(
+                    name,
+                    'transactions',
+                    columns,
+                    postgresql_where=sa.text(f"status = '{status}'"),
+                    postgresql_concurrently=True
+                )
+    else:
+        for name, columns, status in INDEXES:
+            op.create_index(
+                name,
+                'transactions',
+                columns,
+                sqlite_where=sa.text(f"status = '{status}'")
+            )
+
+
+def downgrade() -> None:
+    for name, _, _ in INDEXES:
+        op.drop_index(name, table_name='transactions')
+    op.drop_column('transactions_archive', 'priority')
+    op.drop_column('transactions', 'priority')
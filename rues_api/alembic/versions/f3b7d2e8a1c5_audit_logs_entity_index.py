@@ -0,0 +1,25 @@
+"""Audit logs entity index
+
+Revision ID: f3b7d2e8a1c5
+Revises: e2a6c9d4b8f1
+Create Date: 2025-10-10 09:42:17.215903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7d2e8a1c5'
+down_revision = 'e2a6c9d4b8f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Consulta del historial de una transacción
+    op.create_index('ix_audit_logs_entity', 'audit_logs', ['entity', 'entity_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audit_logs_entity', table_name='audit_logs')
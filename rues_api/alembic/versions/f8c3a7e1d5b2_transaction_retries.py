@@ -0,0 +1,86 @@
+"""Transaction retries: attempts, next_attempt_at and due-time queue indexes
+
+Revision ID: f8c3a7e1d5b2
+Revises: e6a1c4f9d2b7
+Create Date: 2025-10-24 09:41:27.305118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8c3a7e1d5b2'
+down_revision = 'e6a1c4f9d2b7'
+branch_labels = None
+depends_on = None
+
+# Índices de pendientes: (nombre, columnas nuevas, columnas anteriores)
+INDEXES = (
+    ('ix_transactions_pending_queue', ['next_attempt_at', 'id'], ['created_at', 'id']),
+    (
+        'ix_transactions_pending_priority',
+        [sa.text('priority DESC'), 'next_attempt_at', 'id'],
+        [sa.text('priority DESC'), 'created_at', 'id'],
+    ),
+    (
+        'ix_transactions_pending_nit',
+        ['nit', sa.text('priority DESC'), 'next_attempt_at', 'id'],
+        ['nit', sa.text('priority DESC'), 'created_at', 'id'],
+    ),
+)
+
+
+def _rebuild_indexes(new_columns: bool) -> None:
+    """Reemplaza los índices de pendientes por su versión nueva o anterior."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # Se crea el reemplazo con otro nombre antes de borrar el original
+        # para que el claim nunca se quede sin índice
+        with op.get_context().autocommit_block():
+            for name, columns, old_columns in INDEXES:
+                op.create_index(
+                    f'{name}_new',
+                    'transactions',
+                    columns if new_columns else old_columns,
+                    postgresql_where=sa.text("status = 'PENDIENTE'"),
+                    postgresql_concurrently=True
+                )
+                op.drop_index(name, table_name='transactions', postgresql_concurrently=True)
+                op.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+    else:
+        for name, columns, old_columns in INDEXES:
+            op.drop_index(name, table_name='transactions')
+            op.create_index(
+                name,
+                'transactions',
+                columns if new_columns else old_columns,
+                sqlite_where=sa.text("status = 'PENDIENTE'")
+            )
+
+
+def upgrade() -> None:
+    # Con un default no volátil PostgreSQL 11+ no reescribe la tabla; las
+    # pendientes existentes comparten next_attempt_at y conservan el orden
+    # de llegada por id
+    for table in ('transactions', 'transactions_archive'):
+        op.add_column(
+            table,
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default=sa.text('0'))
+        )
+    op.add_column(
+        'transactions',
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False, server_default=sa.func.now())
+    )
+    op.add_column('transactions_archive', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    
+    _rebuild_indexes(new_columns=True)
+
+
+def downgrade() -> None:
+    _rebuild_indexes(new_columns=False)
+    
+    # Las que quedaron en FALLIDO vuelven a ERROR, el estado terminal anterior
+    for table in ('transactions', 'transactions_archive'):
+        op.execute(f"UPDATE {table} SET status = 'ERROR' WHERE status = 'FALLIDO'")
+        op.drop_column(table, 'next_attempt_at')
+        op.drop_column(table, 'attempts')
@@ -2,7 +2,11 @@
 from flask import Flask
 
 from app.api.v1 import api_v1
+from app.cli import register_commands
+from app.core import metrics, profiling
 from app.core.errors import register_error_handlers
+from app.db import session
+from app.services import archive_service, lease_service, stats_service
 
 
 def create_app() -> Flask:
@@ -15,4 +19,18 @@ def create_app() -> Flask:
     # Registrar manejadores de error
     register_error_handlers(app)
     
+    # Métricas y perfilado: se registran antes que la sesión para que lo
+    # medido incluya el commit de la petición
+    metrics.init_app(app, queue_depth=stats_service.queue_depth)
+    profiling.init_app(app)
+    
+    # Sesión de base de datos por petición
+    session.init_app(app)
+    
+    # Comandos de mantenimiento y tareas periódicas
+    register_commands(app)
+    archive_service.init_app(app)
+    lease_service.init_app(app)
+    stats_service.init_app(app)
+    
     return app
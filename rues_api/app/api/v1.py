@@ -1,14 +1,57 @@
 """API versión 1."""
-from flask import Blueprint, request, jsonify
+import base64
+import json
+from datetime import datetime
+from typing import Optional
 
-from app.services.transactions_service import TransactionsService
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+
+from app.services import stats_service
+from app.services.serializers import csv_chunks, ndjson_chunks
+from app.services.transactions_service import IdempotencyKeyMismatchError, TransactionsService
 from app.core.auth import require_api_key, issue_api_key
 from app.core.config import Config
+from app.db.pool import pool_status
+from app.db.session import get_session
+from app.models.models import TransactionStatus
+from app.repositories.transactions_repo import LeaseConflictError
 
 api_v1 = Blueprint("api_v1", __name__)
 transactions_service = TransactionsService()
 
 
+# Estados que un runner puede reportar en update-status
+VALID_UPDATE_STATUSES = ("PENDIENTE", "PROCESADO", "ERROR")
+
+
+def _request_runner_id(data: Optional[dict] = None) -> tuple[Optional[str], Optional[str]]:
+    """Lee el runner de ``runner_id`` en el cuerpo, la query o ``X-Runner-Id``; devuelve (runner, error)."""
+    if data is not None and "runner_id" in data:
+        runner_id = data["runner_id"]
+    else:
+        runner_id = request.args.get("runner_id") or request.headers.get("X-Runner-Id")
+    if runner_id is not None and (not isinstance(runner_id, str) or not runner_id.strip()):
+        return None, "Campo 'runner_id' debe ser un string no vacío"
+    return runner_id, None
+
+
+def _validate_process_payload(payload) -> Optional[str]:
+    """Valida un payload de process-data; devuelve el mensaje de error o None."""
+    if not payload or not isinstance(payload, dict) or "nit" not in payload:
+        return "Campo 'nit' es requerido"
+    
+    # Validación más robusta del NIT
+    nit = payload.get("nit")
+    if not isinstance(nit, str) or len(nit.strip()) < 5:
+        return "NIT debe ser string de al menos 5 caracteres"
+    
+    priority = payload.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool) or not 0 <= priority <= Config.PRIORITY_MAX:
+        return f"Campo 'priority' debe ser entero entre 0 y {Config.PRIORITY_MAX}"
+    
+    return None
+
+
 @api_v1.route("/process-data", methods=["POST"])
 @require_api_key
 def process_data():
@@ -17,18 +60,58 @@ def process_data():
         return jsonify({"error": "Content-Type debe ser application/json"}), 400
     
     payload = request.get_json()
-    if not payload or "nit" not in payload:
-        return jsonify({"error": "Campo 'nit' es requerido"}), 422
-    
-    # Validación más robusta del NIT
-    nit = payload.get("nit")
-    if not isinstance(nit, str) or len(nit.strip()) < 5:
-        return jsonify({"error": "NIT debe ser string de al menos 5 caracteres"}), 422
+    error = _validate_process_payload(payload)
+    if error:
+        return jsonify({"error": error}), 422
     
     idempotency_key = request.headers.get("Idempotency-Key")
     
-    transaction = transactions_service.create_transaction(payload, idempotency_key)
-    return jsonify(transaction), 201
+    try:
+        transaction, replayed = transactions_service.create_transaction(
+            payload, idempotency_key, g.api_client
+        )
+    except IdempotencyKeyMismatchError as e:
+        return jsonify({"error": str(e)}), 422
+    response = jsonify(transaction)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response, 201
+
+
+@api_v1.route("/process-data/batch", methods=["POST"])
+@require_api_key
+def process_data_batch():
+    """Crea en bloque transacciones pendientes a partir de un arreglo de payloads."""
+    if not request.is_json:
+        return jsonify({"error": "Content-Type debe ser application/json"}), 400
+    
+    payloads = request.get_json()
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({"error": "Se requiere un arreglo JSON no vacío"}), 422
+    
+    if len(payloads) > Config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"El lote admite máximo {Config.BATCH_MAX_ITEMS} elementos"}), 422
+    
+    results = [None] * len(payloads)
+    valid_indexes = []
+    for index, payload in enumerate(payloads):
+        error = _validate_process_payload(payload)
+        if error:
+            results[index] = {"index": index, "status": 422, "error": error}
+        else:
+            valid_indexes.append(index)
+    
+    transactions = transactions_service.create_transactions_batch(
+        [payloads[index] for index in valid_indexes]
+    )
+    for index, transaction in zip(valid_indexes, transactions):
+        results[index] = {"index": index, "status": 201, "transaction": transaction}
+    
+    return jsonify({
+        "created": len(transactions),
+        "failed": len(payloads) - len(transactions),
+        "results": results,
+    }), 200
 
 
 @api_v1.route("/update-status", methods=["POST"])
@@ -59,9 +142,15 @@ def update_status():
     if "status" not in data:
         return jsonify({"error": "Campo 'status' es requerido"}), 422
     
-    valid_statuses = {"PENDIENTE", "PROCESADO", "ERROR"}
-    if data["status"] not in valid_statuses:
-        return jsonify({"error": f"Status debe ser uno de: {', '.join(valid_statuses)}"}), 422
+    if data["status"] not in VALID_UPDATE_STATUSES:
+        return jsonify({"error": f"Status debe ser uno de: {', '.join(VALID_UPDATE_STATUSES)}"}), 422
+    
+    if data.get("retryable") is not None and not isinstance(data["retryable"], bool):
+        return jsonify({"error": "Campo 'retryable' debe ser booleano"}), 422
+    
+    runner_id, error = _request_runner_id(data)
+    if error:
+        return jsonify({"error": error}), 422
     
     selector = {}
     if "id" in data:
@@ -69,21 +158,266 @@ def update_status():
     if "nit" in data:
         selector["nit"] = data["nit"]
     
-    update_data = {"status": data["status"]}
+    update_data = {"status": data["status"], "runner_id": runner_id}
     if "error_code" in data:
         update_data["error_code"] = data["error_code"]
     if "error_msg" in data:
         update_data["error_msg"] = data["error_msg"]
     if "result_payload" in data:
         update_data["result_payload"] = data["result_payload"]
+    if "retryable" in data:
+        update_data["retryable"] = data["retryable"]
     
     try:
         transaction = transactions_service.update_status(selector, update_data)
         return jsonify(transaction), 200
+    except LeaseConflictError as e:
+        return jsonify({"error": str(e)}), 409
     except ValueError as e:
         return jsonify({"error": str(e)}), 404
 
 
+def _validate_status_item(item) -> Optional[str]:
+    """Valida un elemento de update-status/batch; devuelve el mensaje de error o None."""
+    if not isinstance(item, dict):
+        return "Cada elemento debe ser un objeto JSON"
+    
+    if not isinstance(item.get("id"), int) or isinstance(item["id"], bool) or item["id"] <= 0:
+        return "Campo 'id' debe ser entero positivo"
+    
+    if item.get("status") not in VALID_UPDATE_STATUSES:
+        return f"Status debe ser uno de: {', '.join(VALID_UPDATE_STATUSES)}"
+    
+    runner_id = item.get("runner_id")
+    if runner_id is not None and (not isinstance(runner_id, str) or not runner_id.strip()):
+        return "Campo 'runner_id' debe ser un string no vacío"
+    
+    if item.get("retryable") is not None and not isinstance(item["retryable"], bool):
+        return "Campo 'retryable' debe ser booleano"
+    
+    return None
+
+
+@api_v1.route("/update-status/batch", methods=["POST"])
+@require_api_key
+def update_status_batch():
+    """Actualiza en bloque el estado de transacciones identificadas por id."""
+    if not request.is_json:
+        return jsonify({"error": "Content-Type debe ser application/json"}), 400
+    
+    items = request.get_json()
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Se requiere un arreglo JSON no vacío"}), 422
+    
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"El lote admite máximo {Config.BATCH_MAX_ITEMS} elementos"}), 422
+    
+    default_runner_id, error = _request_runner_id()
+    if error:
+        return jsonify({"error": error}), 422
+    
+    errors = {}
+    valid_items = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        error = _validate_status_item(item)
+        if not error and item["id"] in seen_ids:
+            # Con el mismo id repetido el resultado dependería del orden de
+            # aplicación: se aplica el primero y se rechazan los demás
+            error = "id duplicado en el lote"
+        if error:
+            errors[index] = error
+        else:
+            seen_ids.add(item["id"])
+            valid_items.append({"runner_id": default_runner_id, **item})
+    
+    updated, rejected_ids = transactions_service.update_status_batch(valid_items)
+    
+    results = []
+    for index, item in enumerate(items):
+        if index in errors:
+            results.append({"index": index, "status": 422, "error": errors[index]})
+        elif item["id"] in updated:
+            results.append({
+                "index": index, "id": item["id"], "status": 200,
+                "transaction_status": updated[item["id"]]
+            })
+        elif item["id"] in rejected_ids:
+            results.append({"index": index, "id": item["id"], "status": 409, "error": "Lease del runner vencido o no asignado"})
+        else:
+            results.append({"index": index, "id": item["id"], "status": 404, "error": "Transacción no encontrada"})
+    
+    return jsonify({
+        "updated": sum(1 for result in results if result["status"] == 200),
+        "failed": sum(1 for result in results if result["status"] != 200),
+        "results": results,
+    }), 200
+
+
+def _parse_listing_filters() -> tuple[dict, Optional[str]]:
+    """Lee los filtros del listado y la exportación; devuelve (filtros, error)."""
+    filters = {
+        "nit": request.args.get("nit"),
+        "status": request.args.get("status"),
+        "include_archived": request.args.get("include_archived", "").lower() in ("1", "true"),
+    }
+    
+    valid_statuses = [status.value for status in TransactionStatus]
+    if filters["status"] is not None and filters["status"] not in valid_statuses:
+        return filters, f"Status debe ser uno de: {', '.join(valid_statuses)}"
+    
+    for name in ("created_from", "created_to"):
+        value = request.args.get(name)
+        if value is None:
+            filters[name] = None
+            continue
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return filters, f"Campo '{name}' debe ser una fecha ISO 8601"
+        # Las columnas guardan hora local sin zona
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        filters[name] = parsed
+    
+    return filters, None
+
+
+def _encode_cursor(after: tuple[datetime, int]) -> str:
+    """Codifica la posición ``(created_at, id)`` como cursor opaco."""
+    raw = json.dumps([after[0].isoformat(), after[1]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Optional[tuple[datetime, int]]:
+    """Decodifica un cursor de ``_encode_cursor``; None si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, transaction_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except (ValueError, TypeError):
+        return None
+
+
+@api_v1.route("/transactions", methods=["GET"])
+@require_api_key
+def list_transactions():
+    """Lista transacciones con filtros y paginación por cursor.
+    
+    Las páginas siguen el orden ``(created_at, id)``; ``next_cursor`` es la
+    posición de la última fila devuelta y es None en la última página.
+    """
+    filters, error = _parse_listing_filters()
+    if error:
+        return jsonify({"error": error}), 422
+    
+    limit = request.args.get("limit", type=int) if "limit" in request.args else Config.LIST_DEFAULT_LIMIT
+    if limit is None or not 1 <= limit <= Config.LIST_MAX_LIMIT:
+        return jsonify({"error": f"Campo 'limit' debe ser entero entre 1 y {Config.LIST_MAX_LIMIT}"}), 422
+    
+    after = None
+    if "cursor" in request.args:
+        after = _decode_cursor(request.args["cursor"])
+        if after is None:
+            return jsonify({"error": "Campo 'cursor' no es válido"}), 422
+    
+    items, next_after = transactions_service.list_transactions(filters, after, limit)
+    return jsonify({
+        "items": items,
+        "next_cursor": _encode_cursor(next_after) if next_after else None,
+    }), 200
+
+
+@api_v1.route("/transactions/export", methods=["GET"])
+@require_api_key
+def export_transactions():
+    """Exporta en streaming todas las transacciones del filtro en NDJSON o CSV."""
+    filters, error = _parse_listing_filters()
+    if error:
+        return jsonify({"error": error}), 422
+    
+    export_format = request.args.get("format", "ndjson")
+    if export_format == "ndjson":
+        chunks, mimetype = ndjson_chunks, "application/x-ndjson"
+    elif export_format == "csv":
+        chunks, mimetype = csv_chunks, "text/csv"
+    else:
+        return jsonify({"error": "Campo 'format' debe ser ndjson o csv"}), 422
+    
+    rows = transactions_service.export_transactions(filters)
+    response = Response(stream_with_context(chunks(rows)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=transactions.{export_format}"
+    return response
+
+
+def _conditional_transaction_response(etag: Optional[str], transaction: Optional[dict]):
+    """Respuesta de una consulta de estado: 404, 304 con ``If-None-Match`` vigente o 200."""
+    if etag is None:
+        return jsonify({"error": "Transacción no encontrada"}), 404
+    response = Response(status=304) if transaction is None else jsonify(transaction)
+    response.set_etag(etag)
+    # El cliente puede guardar la respuesta, pero debe revalidarla en cada consulta
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@api_v1.route("/transactions/<int:transaction_id>", methods=["GET"])
+@require_api_key
+def get_transaction(transaction_id: int):
+    """Estado de una transacción, con ETag y respuestas condicionales."""
+    is_current = request.if_none_match.contains_weak if request.if_none_match else None
+    return _conditional_transaction_response(
+        *transactions_service.get_transaction(transaction_id, is_current)
+    )
+
+
+@api_v1.route("/transactions/by-idempotency-key/<idempotency_key>", methods=["GET"])
+@require_api_key
+def get_transaction_by_idempotency_key(idempotency_key: str):
+    """Estado de la transacción creada por el cliente con una Idempotency-Key."""
+    is_current = request.if_none_match.contains_weak if request.if_none_match else None
+    return _conditional_transaction_response(
+        *transactions_service.get_transaction_by_idempotency_key(
+            g.api_client, idempotency_key, is_current
+        )
+    )
+
+
+@api_v1.route("/transactions/<int:transaction_id>/heartbeat", methods=["POST"])
+@require_api_key
+def heartbeat(transaction_id: int):
+    """Extiende el lease de una transacción reclamada por el runner."""
+    data = request.get_json(silent=True) if request.is_json else None
+    runner_id, error = _request_runner_id(data if isinstance(data, dict) else None)
+    if error:
+        return jsonify({"error": error}), 422
+    
+    lease = transactions_service.heartbeat(transaction_id, runner_id)
+    if lease is None:
+        return jsonify({"error": "Lease del runner vencido o no asignado"}), 409
+    return jsonify(lease), 200
+
+
+@api_v1.route("/transactions/<int:transaction_id>/history", methods=["GET"])
+@require_api_key
+def transaction_history(transaction_id: int):
+    """Historial de cambios de estado de una transacción."""
+    events = transactions_service.get_history(transaction_id)
+    if events is None:
+        return jsonify({"error": "Transacción no encontrada"}), 404
+    return jsonify({"transaction_id": transaction_id, "events": events}), 200
+
+
+@api_v1.route("/stats", methods=["GET"])
+@require_api_key
+def stats():
+    """Número de transacciones por estado, en total o de un NIT."""
+    nit = request.args.get("nit")
+    if nit is not None and not nit.strip():
+        return jsonify({"error": "Campo 'nit' no puede estar vacío"}), 422
+    return jsonify(stats_service.get_stats(nit)), 200
+
+
 @api_v1.route("/auth/login", methods=["POST"])
 def login():
     """Endpoint de autenticación."""
@@ -110,21 +444,41 @@ def health():
     return jsonify({"status": "ok"}), 200
 
 
+@api_v1.route("/admin/pool", methods=["GET"])
+@require_api_key
+def pool_stats():
+    """Estado del pool de conexiones de este proceso."""
+    return jsonify(pool_status(get_session().get_bind().pool)), 200
+
+
 @api_v1.route("/next", methods=["GET"])
 @require_api_key
 def next_transaction():
-    """Obtiene la siguiente transacción pendiente y la marca como procesando."""
-    transaction = transactions_service.fetch_next_pending()
+    """Reclama transacciones pendientes y las marca como procesando.
     
-    if transaction is None:
-        return "", 204
+    Sin ``limit`` devuelve un único objeto; con ``limit`` devuelve un arreglo
+    con hasta ``limit`` transacciones reclamadas en un solo round trip. Con
+    ``wait`` la petición espera hasta esa cantidad de segundos a que llegue
+    trabajo antes de responder 204.
+    """
+    runner_id = request.args.get("runner_id") or request.headers.get("X-Runner-Id")
+    if runner_id is not None and not runner_id.strip():
+        return jsonify({"error": "Campo 'runner_id' no puede estar vacío"}), 422
     
-    # Marcar como PROCESANDO
-    try:
-        updated_transaction = transactions_service.update_status(
-            {"id": transaction["id"]}, 
-            {"status": "PROCESANDO"}
-        )
-        return jsonify(updated_transaction), 200
-    except ValueError:
+    batch_mode = "limit" in request.args
+    limit = request.args.get("limit", type=int) if batch_mode else 1
+    if limit is None or not 1 <= limit <= Config.NEXT_MAX_LIMIT:
+        return jsonify({"error": f"Campo 'limit' debe ser entero entre 1 y {Config.NEXT_MAX_LIMIT}"}), 422
+    
+    wait = request.args.get("wait", type=float) if "wait" in request.args else 0.0
+    if wait is None or not 0 <= wait <= Config.NEXT_MAX_WAIT_SECONDS:
+        return jsonify({"error": f"Campo 'wait' debe estar entre 0 y {Config.NEXT_MAX_WAIT_SECONDS} segundos"}), 422
+    
+    transactions = transactions_service.fetch_next_pending(runner_id, limit, wait)
+    
+    if not transactions:
         return "", 204
+    
+    if batch_mode:
+        return jsonify(transactions), 200
+    return jsonify(transactions[0]), 200
@@ -0,0 +1,55 @@
+"""Comandos de línea de comandos (flask --app wsgi <comando>)."""
+from datetime import timedelta
+
+import click
+from flask import Flask
+
+from app.core.config import Config
+from app.services.archive_service import archive_finished_transactions
+from app.services.lease_service import reap_expired_leases
+from app.services.stats_service import reconcile_counters
+
+
+@click.command("archive-transactions")
+@click.option(
+    "--older-than-days", type=float, default=lambda: Config.ARCHIVE_AFTER_DAYS,
+    show_default="ARCHIVE_AFTER_DAYS", help="Antigüedad mínima desde la última actualización."
+)
+@click.option(
+    "--chunk-size", type=click.IntRange(min=1), default=lambda: Config.ARCHIVE_CHUNK_SIZE,
+    show_default="ARCHIVE_CHUNK_SIZE", help="Filas movidas por transacción."
+)
+@click.option("--max-chunks", type=click.IntRange(min=1), default=None, help="Detenerse tras N bloques.")
+@click.option(
+    "--pause-seconds", type=float, default=lambda: Config.ARCHIVE_CHUNK_PAUSE_SECONDS,
+    show_default="ARCHIVE_CHUNK_PAUSE_SECONDS", help="Pausa entre bloques."
+)
+def archive_transactions_command(older_than_days, chunk_size, max_chunks, pause_seconds):
+    """Mueve las transacciones PROCESADO/ERROR antiguas a transactions_archive."""
+    moved = archive_finished_transactions(
+        timedelta(days=older_than_days), chunk_size, max_chunks, pause_seconds
+    )
+    click.echo(f"{moved} transacciones archivadas")
+
+
+@click.command("reconcile-stats")
+def reconcile_stats_command():
+    """Recalcula los contadores de transacciones por estado."""
+    drift = reconcile_counters()
+    if drift:
+        click.echo(f"Contadores corregidos: {drift}")
+    else:
+        click.echo("Contadores correctos")
+
+
+@click.command("reap-leases")
+def reap_leases_command():
+    """Devuelve a PENDIENTE las transacciones con el lease vencido."""
+    click.echo(f"{reap_expired_leases()} transacciones reencoladas")
+
+
+def register_commands(app: Flask) -> None:
+    """Registra los comandos de la aplicación en ``flask``."""
+    app.cli.add_command(archive_transactions_command)
+    app.cli.add_command(reap_leases_command)
+    app.cli.add_command(reconcile_stats_command)
@@ -2,21 +2,26 @@
 import uuid
 from datetime import datetime, timedelta
 from functools import wraps
-from typing import Dict
+from typing import Optional
 
-from flask import request, jsonify
+from flask import g, request, jsonify
 
+from app.core.cache import TTLCache
 from app.core.config import Config
+from app.core.token_store import get_token_store
 
-# Almacén en memoria para API Keys temporales
-_ISSUED_KEYS: Dict[str, datetime] = {}
+# Cliente asociado a la API Key estática
+STATIC_KEY_CLIENT = "static"
+
+# Validaciones recientes por key: evita consultar el almacén en cada petición
+_validated = TTLCache(Config.AUTH_CACHE_SIZE, Config.AUTH_CACHE_TTL_SECONDS)
 
 
 def issue_api_key(username: str) -> dict:
     """Genera una API Key temporal."""
     api_key = str(uuid.uuid4())
     expires_at = datetime.now() + timedelta(minutes=Config.API_KEY_TTL_MINUTES)
-    _ISSUED_KEYS[api_key] = expires_at
+    get_token_store().issue(api_key, username, expires_at)
     
     return {
         "api_key": api_key,
@@ -24,33 +29,54 @@ def issue_api_key(username: str) -> dict:
     }
 
 
-def is_valid_api_key(key: str) -> bool:
-    """Valida si una API Key es válida."""
+def get_api_key_client(key: str) -> Optional[str]:
+    """Devuelve el cliente dueño de una API Key válida, o None si no es válida."""
     # Verificar si es la API Key estática
-    if key == Config.API_KEY:
-        return True
+    if Config.API_KEY and key == Config.API_KEY:
+        return STATIC_KEY_CLIENT
     
-    # Verificar si es una API Key temporal
-    if key in _ISSUED_KEYS:
-        expires_at = _ISSUED_KEYS[key]
+    # Verificar si es una API Key temporal validada hace poco
+    cached = _validated.get(key)
+    if cached is not None:
+        username, expires_at = cached
         if datetime.now() < expires_at:
-            return True
-        else:
-            # Eliminar clave expirada
-            del _ISSUED_KEYS[key]
-            return False
+            return username
+        _validated.pop(key)
+        return None
     
-    return False
+    entry = get_token_store().lookup(key)
+    if entry is None:
+        return None
+    
+    username, expires_at = entry
+    remaining = (expires_at - datetime.now()).total_seconds()
+    _validated.set(key, entry, min(Config.AUTH_CACHE_TTL_SECONDS, max(remaining, 0)))
+    return username
+
+
+def clear_auth_cache() -> None:
+    """Vacía la caché local de validaciones de API Keys."""
+    _validated.clear()
+
+
+def is_valid_api_key(key: str) -> bool:
+    """Valida si una API Key es válida."""
+    return get_api_key_client(key) is not None
 
 
 def require_api_key(f):
-    """Decorador que requiere API Key válida en header X-API-Key."""
+    """Decorador que requiere API Key válida en header X-API-Key.
+    
+    Deja en ``g.api_client`` el cliente dueño de la key.
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         api_key = request.headers.get('X-API-Key')
+        client = get_api_key_client(api_key) if api_key else None
         
-        if not api_key or not is_valid_api_key(api_key):
+        if client is None:
             return jsonify({"error": "Unauthorized"}), 401
         
+        g.api_client = client
         return f(*args, **kwargs)
     return decorated_function
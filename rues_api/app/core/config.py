@@ -1,8 +1,9 @@
-"""Configuración de la aplicación."""
-import os
-from dotenv import load_dotenv
+"""Configuración de la aplicación.
 
-load_dotenv()
+Solo lee variables de entorno. El archivo .env lo cargan los puntos de
+entrada (run.py, wsgi.py, alembic) antes de importar la aplicación.
+"""
+import os
 
 
 class Config:
@@ -14,3 +15,60 @@ class Config:
     ADMIN_USER = os.getenv("ADMIN_USER", "admin")
     ADMIN_PASS = os.getenv("ADMIN_PASS", "admin")
     API_KEY_TTL_MINUTES = int(os.getenv("API_KEY_TTL_MINUTES", "60"))
+    NEXT_MAX_LIMIT = int(os.getenv("NEXT_MAX_LIMIT", "100"))
+    NEXT_MAX_WAIT_SECONDS = float(os.getenv("NEXT_MAX_WAIT_SECONDS", "30"))
+    NEXT_MAX_WAITERS = int(os.getenv("NEXT_MAX_WAITERS", "0"))
+    CLAIM_SCHEDULING = os.getenv("CLAIM_SCHEDULING", "fifo")
+    CLAIM_MAX_IN_FLIGHT_PER_NIT = int(os.getenv("CLAIM_MAX_IN_FLIGHT_PER_NIT", "0"))
+    CLAIM_FAIR_MAX_NITS = int(os.getenv("CLAIM_FAIR_MAX_NITS", "64"))
+    PRIORITY_MAX = int(os.getenv("PRIORITY_MAX", "9"))
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "0"))
+    RETRY_BACKOFF_BASE_SECONDS = float(os.getenv("RETRY_BACKOFF_BASE_SECONDS", "30"))
+    RETRY_BACKOFF_MAX_SECONDS = float(os.getenv("RETRY_BACKOFF_MAX_SECONDS", "3600"))
+    RETRY_JITTER = float(os.getenv("RETRY_JITTER", "0.5"))
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+    PAYLOAD_COMPRESSION = os.getenv("PAYLOAD_COMPRESSION", "auto")
+    PAYLOAD_COMPRESSION_MIN_BYTES = int(os.getenv("PAYLOAD_COMPRESSION_MIN_BYTES", "1024"))
+    COMPANY_CACHE_SIZE = int(os.getenv("COMPANY_CACHE_SIZE", "10000"))
+    COMPANY_CACHE_TTL_SECONDS = float(os.getenv("COMPANY_CACHE_TTL_SECONDS", "300"))
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    IDEMPOTENCY_CACHE_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_CACHE_TTL_SECONDS", "600"))
+    STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", "10000"))
+    STATUS_CACHE_TTL_SECONDS = float(os.getenv("STATUS_CACHE_TTL_SECONDS", "2"))
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+    DB_POOL_SLOW_CHECKOUT_MS = float(os.getenv("DB_POOL_SLOW_CHECKOUT_MS", "100"))
+    DB_POOL_LOG_INTERVAL_SECONDS = float(os.getenv("DB_POOL_LOG_INTERVAL_SECONDS", "0"))
+    TOKEN_STORE = os.getenv("TOKEN_STORE", "memory")
+    TOKEN_STORE_MAX_KEYS = int(os.getenv("TOKEN_STORE_MAX_KEYS", "100000"))
+    TOKEN_SWEEP_INTERVAL_SECONDS = float(os.getenv("TOKEN_SWEEP_INTERVAL_SECONDS", "60"))
+    AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+    AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+    AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "1") == "1"
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1"))
+    AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+    AUDIT_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_SECONDS", "0.05"))
+    ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+    ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "1000"))
+    ARCHIVE_CHUNK_PAUSE_SECONDS = float(os.getenv("ARCHIVE_CHUNK_PAUSE_SECONDS", "0.1"))
+    ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))
+    LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "50"))
+    LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "500"))
+    EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+    STATS_COUNTER_SHARDS = int(os.getenv("STATS_COUNTER_SHARDS", "16"))
+    STATS_PER_NIT = os.getenv("STATS_PER_NIT", "0") == "1"
+    STATS_RECONCILE_INTERVAL_SECONDS = float(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+    LEASE_SECONDS = float(os.getenv("LEASE_SECONDS", "300"))
+    LEASE_REAPER_INTERVAL_SECONDS = float(os.getenv("LEASE_REAPER_INTERVAL_SECONDS", "30"))
+    LEASE_REAPER_BATCH_SIZE = int(os.getenv("LEASE_REAPER_BATCH_SIZE", "1000"))
+    METRICS_DIR = os.getenv("METRICS_DIR", "")
+    METRICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "5"))
+    PROFILE_QUERIES = os.getenv("PROFILE_QUERIES", "0")
+    PROFILE_SLOW_QUERY_MS = float(os.getenv("PROFILE_SLOW_QUERY_MS", "100"))
+    PROFILE_REPEAT_THRESHOLD = int(os.getenv("PROFILE_REPEAT_THRESHOLD", "5"))
+    PROFILE_SERVER_TIMING = os.getenv("PROFILE_SERVER_TIMING", "0") == "1"
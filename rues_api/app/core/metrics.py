@@ -0,0 +1,313 @@
+"""Métricas en formato de texto de Prometheus.
+
+Cada proceso acumula sus contadores e histogramas en memoria. Con
+``METRICS_DIR`` cada worker vuelca periódicamente una instantánea JSON en
+ese directorio y ``/metrics`` suma las de todos los procesos, de modo que el
+resultado no depende del worker que atienda el scrape.
+"""
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+from flask import Flask, Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import Config
+from app.core.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores de los buckets de cada histograma
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# Nombre -> (tipo, ayuda, buckets)
+METRICS = {
+    "rues_http_requests_total": (
+        "counter", "Peticiones atendidas por ruta, método y código de estado.", None
+    ),
+    "rues_http_errors_total": (
+        "counter", "Peticiones con código de estado 4xx o 5xx por ruta y código.", None
+    ),
+    "rues_http_request_duration_seconds": (
+        "histogram", "Latencia de las peticiones por ruta.", LATENCY_BUCKETS
+    ),
+    "rues_db_queries_per_request": (
+        "histogram", "Sentencias SQL ejecutadas por petición.", QUERY_COUNT_BUCKETS
+    ),
+    "rues_db_time_per_request_seconds": (
+        "histogram", "Tiempo total en la base de datos por petición.", DB_TIME_BUCKETS
+    ),
+    "rues_db_queries_total": (
+        "counter", "Sentencias SQL ejecutadas, dentro o fuera de peticiones.", None
+    ),
+    "rues_db_query_seconds_total": (
+        "counter", "Tiempo total en sentencias SQL.", None
+    ),
+    "rues_transactions_created_total": (
+        "counter", "Transacciones creadas (ingesta).", None
+    ),
+    "rues_transactions_claimed_total": (
+        "counter", "Transacciones reclamadas por runners.", None
+    ),
+    "rues_long_poll_rejected_total": (
+        "counter", "Peticiones de /next?wait atendidas sin espera por NEXT_MAX_WAITERS.", None
+    ),
+    "rues_queue_depth": (
+        "gauge", "Transacciones por estado según los contadores incrementales.", None
+    ),
+}
+
+
+class MetricsRegistry:
+    """Contadores e histogramas del proceso, seguros entre hilos.
+    
+    Las etiquetas se pasan como tupla de pares ``(nombre, valor)`` en un
+    orden fijo por métrica.
+    """
+    
+    def __init__(self) -> None:
+        self._counters: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, name: str, labels: tuple = (), amount: float = 1) -> None:
+        """Incrementa un contador."""
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, labels: tuple = ()) -> None:
+        """Registra una observación en un histograma."""
+        buckets = METRICS[name][2]
+        index = bisect.bisect_left(buckets, value)
+        key = (name, labels)
+        with self._lock:
+            # Conteo por bucket (no acumulado), +Inf, suma y total
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+    
+    def snapshot(self) -> dict:
+        """Devuelve una copia serializable en JSON."""
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, list(labels), list(state)] for (name, labels), state in self._histograms.items()],
+            }
+    
+    def clear(self) -> None:
+        """Reinicia todas las métricas."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+registry = MetricsRegistry()
+
+# Sentencias y tiempo en la base de datos de la petición en curso
+_request_db = contextvars.ContextVar("rues_request_db", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.rues_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "rues_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    registry.inc("rues_db_queries_total")
+    registry.inc("rues_db_query_seconds_total", amount=elapsed)
+    stats = _request_db.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+def _label_key(labels: Iterable) -> tuple:
+    return tuple(tuple(pair) for pair in labels)
+
+
+def merge_snapshots(snapshots: Iterable[dict]) -> dict:
+    """Suma las instantáneas de varios procesos."""
+    counters: dict[tuple, float] = {}
+    histograms: dict[tuple, list] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get("counters", []):
+            key = (name, _label_key(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, state in snapshot.get("histograms", []):
+            key = (name, _label_key(labels))
+            if key in histograms and len(histograms[key]) == len(state):
+                histograms[key] = [total + value for total, value in zip(histograms[key], state)]
+            else:
+                histograms[key] = list(state)
+    return {"counters": counters, "histograms": histograms}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged: dict, gauges: Optional[dict] = None) -> str:
+    """Genera el formato de texto de Prometheus a partir de ``merge_snapshots``."""
+    gauges = gauges or {}
+    by_name: dict[str, list] = {}
+    for (name, labels), value in list(merged["counters"].items()) + list(gauges.items()):
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), state in merged["histograms"].items():
+        by_name.setdefault(name, []).append((labels, state))
+    
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        samples = by_name.get(name)
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(samples, key=lambda sample: sample[0]):
+            if kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(Config.METRICS_DIR, f"{pid}.json")
+
+
+def write_snapshot() -> None:
+    """Vuelca la instantánea de este proceso en ``METRICS_DIR`` de forma atómica."""
+    if not Config.METRICS_DIR:
+        return
+    os.makedirs(Config.METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as handle:
+        json.dump(registry.snapshot(), handle)
+    os.replace(temporary, path)
+
+
+def collect_snapshots() -> list[dict]:
+    """Devuelve las instantáneas de todos los procesos (o solo la propia sin ``METRICS_DIR``)."""
+    if not Config.METRICS_DIR:
+        return [registry.snapshot()]
+    
+    write_snapshot()
+    snapshots = []
+    for filename in os.listdir(Config.METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(Config.METRICS_DIR, filename)) as handle:
+                snapshots.append(json.load(handle))
+        except (OSError, ValueError):
+            logger.warning("Instantánea de métricas ilegible: %s", filename)
+    return snapshots
+
+
+def clear_snapshots() -> None:
+    """Borra las instantáneas de ``METRICS_DIR``; se llama al arrancar el servidor."""
+    if not Config.METRICS_DIR or not os.path.isdir(Config.METRICS_DIR):
+        return
+    for filename in os.listdir(Config.METRICS_DIR):
+        if filename.endswith((".json", ".tmp")):
+            os.remove(os.path.join(Config.METRICS_DIR, filename))
+
+
+def _write_snapshot_on_exit() -> None:
+    try:
+        write_snapshot()
+    except OSError:
+        logger.exception("No se pudo guardar la instantánea final de métricas")
+
+
+_snapshot_writer = PeriodicTask(
+    "rues-metrics-writer", Config.METRICS_FLUSH_INTERVAL_SECONDS, write_snapshot
+)
+atexit.register(_write_snapshot_on_exit)
+
+
+def init_app(app: Flask, queue_depth=None) -> None:
+    """Instrumenta las peticiones del blueprint ``api_v1`` y registra ``/metrics``.
+    
+    ``queue_depth`` es una función sin argumentos que devuelve los contadores
+    por estado; se consulta una vez por scrape.
+    """
+    
+    @app.before_request
+    def start_request_metrics():
+        if request.blueprint != "api_v1":
+            return
+        if Config.METRICS_DIR:
+            _snapshot_writer.ensure_started()
+        request.environ["rues.started"] = time.perf_counter()
+        request.environ["rues.db"] = stats = [0, 0.0]
+        _request_db.set(stats)
+    
+    @app.after_request
+    def record_request_metrics(response):
+        started = request.environ.get("rues.started")
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = (("route", request.endpoint),)
+        status = str(response.status_code)
+        
+        registry.inc("rues_http_requests_total", route + (("method", request.method), ("status", status)))
+        if response.status_code >= 400:
+            registry.inc("rues_http_errors_total", route + (("status", status),))
+        registry.observe("rues_http_request_duration_seconds", elapsed, route)
+        
+        queries, db_seconds = request.environ["rues.db"]
+        registry.observe("rues_db_queries_per_request", queries, route)
+        registry.observe("rues_db_time_per_request_seconds", db_seconds, route)
+        _request_db.set(None)
+        return response
+    
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """Métricas de todos los procesos en formato de Prometheus."""
+        gauges = {}
+        if queue_depth is not None:
+            try:
+                for status, count in queue_depth().items():
+                    gauges[("rues_queue_depth", (("status", status),))] = count
+            except Exception:
+                logger.exception("No se pudo leer la profundidad de la cola")
+        
+        body = render(merge_snapshots(collect_snapshots()), gauges)
+        return Response(body, mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,38 @@
+"""Tareas periódicas en segundo plano."""
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Hilo que ejecuta ``func`` cada ``interval_seconds``.
+    
+    El hilo se inicia con ``ensure_started`` en el primer uso, después de
+    cualquier fork del servidor. Un error en una ejecución se registra en el
+    log y no detiene las siguientes.
+    """
+    
+    def __init__(self, name: str, interval_seconds: float, func: Callable[[], None]) -> None:
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def ensure_started(self) -> None:
+        """Inicia el hilo si no está corriendo."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+    
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                self.func()
+            except Exception:
+                logger.exception("Error en la tarea periódica %s", self.name)
@@ -0,0 +1,184 @@
+"""Perfilado opcional de las consultas SQL de cada petición.
+
+Con ``PROFILE_QUERIES=1`` (todas las peticiones) o ``PROFILE_QUERIES=header``
+(solo las que envían ``X-Profile-Queries: 1``) se registra cada sentencia de
+la petición: se loguean las que superan ``PROFILE_SLOW_QUERY_MS``, se avisa
+de sentencias idénticas repetidas (N+1) y, con ``PROFILE_SERVER_TIMING``, se
+añade el desglose en la cabecera ``Server-Timing``. Desactivado, cada
+sentencia solo paga la lectura de una ContextVar.
+"""
+import contextvars
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Optional
+
+from flask import Flask, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import Config
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Queries"
+
+# Perfil de la petición en curso, o None si no se perfila
+_request_profile = contextvars.ContextVar("rues_request_profile", default=None)
+
+# Directorio de ``app``: el origen de una sentencia es el primer frame dentro
+# de la aplicación que no sea este módulo
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+
+
+class QueryProfile:
+    """Sentencias ejecutadas en una petición."""
+    
+    def __init__(self, route: Optional[str]) -> None:
+        self.route = route
+        self.started = time.perf_counter()
+        # (sentencia, segundos, forma de los parámetros, origen)
+        self.queries: list[tuple[str, float, str, str]] = []
+    
+    @property
+    def db_seconds(self) -> float:
+        return sum(query[1] for query in self.queries)
+    
+    def repeated(self, threshold: int) -> list[tuple[str, int, float, str]]:
+        """Sentencias idénticas ejecutadas al menos ``threshold`` veces: (sentencia, veces, segundos, origen)."""
+        groups = defaultdict(lambda: [0, 0.0, ""])
+        for statement, elapsed, _, origin in self.queries:
+            group = groups[statement]
+            group[0] += 1
+            group[1] += elapsed
+            group[2] = group[2] or origin
+        return sorted(
+            ((statement, count, seconds, origin) for statement, (count, seconds, origin) in groups.items() if count >= threshold),
+            key=lambda item: -item[1]
+        )
+    
+    def by_origin(self) -> list[tuple[str, int, float]]:
+        """Tiempo por función de origen, de mayor a menor: (origen, sentencias, segundos)."""
+        groups = defaultdict(lambda: [0, 0.0])
+        for _, elapsed, _, origin in self.queries:
+            groups[origin][0] += 1
+            groups[origin][1] += elapsed
+        return sorted(
+            ((origin, count, seconds) for origin, (count, seconds) in groups.items()),
+            key=lambda item: -item[2]
+        )
+
+
+def parameters_shape(parameters, executemany: bool = False) -> str:
+    """Describe los parámetros por nombre y tipo, sin sus valores."""
+    if executemany and isinstance(parameters, (list, tuple)):
+        first = parameters[0] if parameters else None
+        return f"{len(parameters)} x {parameters_shape(first)}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def _statement_origin() -> str:
+    """Primer frame de la aplicación fuera de este módulo, como ``modulo.funcion:linea``."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and filename != _THIS_FILE:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+
+def _compact(statement: str, limit: int = 500) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _request_profile.get() is not None:
+        context.rues_profile_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _request_profile.get()
+    if profile is None:
+        return
+    started = getattr(context, "rues_profile_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    shape = parameters_shape(parameters, executemany)
+    origin = _statement_origin()
+    profile.queries.append((statement, elapsed, shape, origin))
+    
+    if elapsed * 1000 >= Config.PROFILE_SLOW_QUERY_MS:
+        logger.warning(
+            "Consulta lenta (%.1f ms) en %s desde %s: %s | parámetros: %s",
+            elapsed * 1000, profile.route, origin, _compact(statement), shape
+        )
+
+
+def _profiling_requested() -> bool:
+    mode = Config.PROFILE_QUERIES
+    if mode == "1":
+        return True
+    return mode == "header" and request.headers.get(PROFILE_HEADER) == "1"
+
+
+def _server_timing(profile: QueryProfile, total_seconds: float) -> str:
+    db_ms = profile.db_seconds * 1000
+    entries = [
+        f'db;dur={db_ms:.3f};desc="{len(profile.queries)} consultas"',
+        f"app;dur={max(total_seconds * 1000 - db_ms, 0.0):.3f}",
+    ]
+    # Las tres funciones que más tiempo pasaron en la base de datos
+    for position, (origin, count, seconds) in enumerate(profile.by_origin()[:3], start=1):
+        entries.append(f'sql{position};dur={seconds * 1000:.3f};desc="{origin} x{count}"')
+    entries.append(f"total;dur={total_seconds * 1000:.3f}")
+    return ", ".join(entries)
+
+
+def init_app(app: Flask) -> None:
+    """Registra el perfilado en las peticiones del blueprint ``api_v1``."""
+    
+    @app.before_request
+    def start_query_profile():
+        if request.blueprint != "api_v1" or not _profiling_requested():
+            return
+        profile = QueryProfile(request.endpoint)
+        request.environ["rues.profile"] = profile
+        _request_profile.set(profile)
+    
+    @app.after_request
+    def finish_query_profile(response):
+        profile = request.environ.get("rues.profile")
+        if profile is None:
+            return response
+        total_seconds = time.perf_counter() - profile.started
+        
+        for statement, count, seconds, origin in profile.repeated(Config.PROFILE_REPEAT_THRESHOLD):
+            logger.warning(
+                "Posible N+1 en %s: %d ejecuciones (%.1f ms) de la misma sentencia desde %s: %s",
+                profile.route, count, seconds * 1000, origin, _compact(statement)
+            )
+        logger.debug(
+            "Perfil de %s: %d consultas, %.1f ms en la base de datos de %.1f ms",
+            profile.route, len(profile.queries), profile.db_seconds * 1000, total_seconds * 1000
+        )
+        if Config.PROFILE_SERVER_TIMING:
+            response.headers["Server-Timing"] = _server_timing(profile, total_seconds)
+        return response
+    
+    @app.teardown_request
+    def clear_query_profile(exception=None):
+        if request.environ.pop("rues.profile", None) is not None:
+            _request_profile.set(None)
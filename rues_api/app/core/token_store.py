@@ -0,0 +1,192 @@
+"""Almacenes de API Keys temporales."""
+import hashlib
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, select
+
+import app.db.session as db_session
+from app.core.config import Config
+from app.models.models import ApiKey
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryTokenStore:
+    """Almacén en memoria del proceso con barrido periódico y tamaño máximo.
+    
+    Solo es válido con un único proceso: las keys emitidas por un worker no
+    existen en los demás.
+    """
+    
+    def __init__(self, max_keys: int, sweep_interval_seconds: float) -> None:
+        self.max_keys = max_keys
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._keys: dict[str, Tuple[str, datetime]] = {}
+        # (expiración, key) para encontrar la próxima a expirar sin recorrer
+        # todas; las entradas de keys ya eliminadas se descartan al salir
+        self._expiries: list[Tuple[datetime, str]] = []
+        self._lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+    
+    def issue(self, api_key: str, username: str, expires_at: datetime) -> None:
+        """Guarda una key; si se alcanza el máximo descarta la más próxima a expirar."""
+        self._ensure_sweeper()
+        with self._lock:
+            if len(self._keys) >= self.max_keys:
+                self._sweep_locked()
+            while len(self._keys) >= self.max_keys and self._expiries:
+                self._pop_soonest()
+            self._keys[api_key] = (username, expires_at)
+            heapq.heappush(self._expiries, (expires_at, api_key))
+            # Sin compactar, keys reemitidas o borradas al consultarlas dejarían
+            # entradas obsoletas acumulándose en el heap
+            if len(self._expiries) > 2 * len(self._keys) + 64:
+                self._expiries = [(entry[1], key) for key, entry in self._keys.items()]
+                heapq.heapify(self._expiries)
+    
+    def lookup(self, api_key: str) -> Optional[Tuple[str, datetime]]:
+        """Devuelve (usuario, expiración) de una key vigente, o None."""
+        with self._lock:
+            entry = self._keys.get(api_key)
+            if entry is None:
+                return None
+            if datetime.now() >= entry[1]:
+                del self._keys[api_key]
+                return None
+            return entry
+    
+    def sweep(self) -> int:
+        """Elimina las keys expiradas; devuelve cuántas eliminó."""
+        with self._lock:
+            return self._sweep_locked()
+    
+    def _pop_soonest(self) -> bool:
+        """Elimina la key más próxima a expirar; False si la entrada del heap estaba obsoleta."""
+        expires_at, key = heapq.heappop(self._expiries)
+        entry = self._keys.get(key)
+        if entry is None or entry[1] != expires_at:
+            return False
+        del self._keys[key]
+        return True
+    
+    def _sweep_locked(self) -> int:
+        now = datetime.now()
+        removed = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            removed += self._pop_soonest()
+        return removed
+    
+    def _ensure_sweeper(self) -> None:
+        # El hilo se inicia en el primer uso, después de cualquier fork
+        if self.sweep_interval_seconds <= 0:
+            return
+        with self._lock:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._sweeper = threading.Thread(
+                    target=self._sweep_forever, name="rues-token-sweeper", daemon=True
+                )
+                self._sweeper.start()
+    
+    def _sweep_forever(self) -> None:
+        while True:
+            time.sleep(self.sweep_interval_seconds)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error barriendo API Keys expiradas")
+
+
+class DatabaseTokenStore:
+    """Almacén en la tabla ``api_keys``, compartido por todos los procesos.
+    
+    Solo se guarda el SHA-256 de cada key. Cada operación usa su propia
+    sesión corta, independiente de la unidad de trabajo de la petición.
+    """
+    
+    def __init__(self, sweep_interval_seconds: float) -> None:
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._last_sweep = float("-inf")
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _hash(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+    
+    def issue(self, api_key: str, username: str, expires_at: datetime) -> None:
+        """Guarda una key; aprovecha para barrer las expiradas periódicamente."""
+        session = db_session.SessionLocal()
+        try:
+            session.add(ApiKey(
+                key_hash=self._hash(api_key), username=username, expires_at=expires_at
+            ))
+            session.commit()
+        finally:
+            session.close()
+        self._maybe_sweep()
+    
+    def lookup(self, api_key: str) -> Optional[Tuple[str, datetime]]:
+        """Devuelve (usuario, expiración) de una key vigente, o None."""
+        session = db_session.SessionLocal()
+        try:
+            row = session.execute(
+                select(ApiKey.username, ApiKey.expires_at).where(
+                    ApiKey.key_hash == self._hash(api_key),
+                    ApiKey.expires_at > datetime.now()
+                )
+            ).first()
+            return tuple(row) if row is not None else None
+        finally:
+            session.close()
+    
+    def sweep(self) -> int:
+        """Elimina las keys expiradas; devuelve cuántas eliminó."""
+        session = db_session.SessionLocal()
+        try:
+            result = session.execute(
+                delete(ApiKey).where(ApiKey.expires_at <= datetime.now())
+            )
+            session.commit()
+            return result.rowcount
+        finally:
+            session.close()
+    
+    def _maybe_sweep(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval_seconds:
+                return
+            self._last_sweep = now
+        try:
+            self.sweep()
+        except Exception:
+            logger.exception("Error barriendo API Keys expiradas")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store():
+    """Devuelve el almacén de API Keys configurado en ``TOKEN_STORE``."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if Config.TOKEN_STORE == "database":
+                _store = DatabaseTokenStore(Config.TOKEN_SWEEP_INTERVAL_SECONDS)
+            else:
+                _store = MemoryTokenStore(
+                    Config.TOKEN_STORE_MAX_KEYS, Config.TOKEN_SWEEP_INTERVAL_SECONDS
+                )
+        return _store
+
+
+def reset_token_store() -> None:
+    """Descarta el almacén actual; el siguiente uso crea uno nuevo."""
+    global _store
+    with _store_lock:
+        _store = None
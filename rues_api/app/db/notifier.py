@@ -0,0 +1,132 @@
+"""Avisos de nuevas transacciones para el long-polling de /next."""
+import logging
+import select
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy.engine import Engine
+
+from app.core.config import Config
+from app.db.session import get_engine
+
+logger = logging.getLogger(__name__)
+
+# Canal de LISTEN/NOTIFY usado en PostgreSQL
+NOTIFY_CHANNEL = "rues_transactions"
+
+# Intervalo máximo de select() sobre la conexión LISTEN
+LISTEN_POLL_SECONDS = 5.0
+
+# Pausa antes de reconectar el listener tras un error
+LISTEN_RETRY_SECONDS = 1.0
+
+
+class InProcessNotifier:
+    """Notificador en memoria basado en una variable de condición.
+    
+    Cada aviso incrementa una generación; quien espera compara contra la
+    generación leída antes de consultar la cola, así no se pierden avisos
+    que lleguen entre la consulta y la espera.
+    """
+    
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._generation = 0
+    
+    def generation(self) -> int:
+        """Devuelve la generación actual de avisos."""
+        with self._condition:
+            return self._generation
+    
+    def notify(self) -> None:
+        """Despierta a todos los que esperan trabajo en este proceso."""
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+    
+    def wait(self, generation: int, timeout: float) -> bool:
+        """Espera un aviso posterior a ``generation``; False si vence el timeout."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._generation != generation, timeout
+            )
+
+
+class PostgresNotifier(InProcessNotifier):
+    """Notificador que además escucha NOTIFY de PostgreSQL.
+    
+    Un hilo en segundo plano mantiene una conexión dedicada (fuera del pool)
+    con ``LISTEN`` y despierta a los waiters locales cuando otro proceso
+    inserta transacciones. El hilo se inicia en la primera espera, después
+    de cualquier fork del servidor.
+    """
+    
+    def __init__(self, engine: Engine) -> None:
+        super().__init__()
+        self._engine = engine
+        self._listener: Optional[threading.Thread] = None
+        self._listener_lock = threading.Lock()
+    
+    def wait(self, generation: int, timeout: float) -> bool:
+        """Espera un aviso local o de PostgreSQL posterior a ``generation``."""
+        self._ensure_listener()
+        return super().wait(generation, timeout)
+    
+    def _ensure_listener(self) -> None:
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, name="rues-notify-listener", daemon=True
+                )
+                self._listener.start()
+    
+    def _connect(self):
+        cargs, cparams = self._engine.dialect.create_connect_args(self._engine.url)
+        connection = self._engine.dialect.connect(*cargs, **cparams)
+        connection.autocommit = True
+        return connection
+    
+    def _listen(self) -> None:
+        while True:
+            connection = None
+            try:
+                connection = self._connect()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Pudieron perderse avisos mientras no había listener
+                self.notify()
+                
+                while True:
+                    readable, _, _ = select.select([connection], [], [], LISTEN_POLL_SECONDS)
+                    if not readable:
+                        continue
+                    connection.poll()
+                    if connection.notifies:
+                        connection.notifies.clear()
+                        self.notify()
+            except Exception:
+                logger.exception("Error en el listener de %s; reconectando", NOTIFY_CHANNEL)
+                time.sleep(LISTEN_RETRY_SECONDS)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+_notifier: Optional[InProcessNotifier] = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier() -> InProcessNotifier:
+    """Devuelve el notificador del proceso según el motor configurado."""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            if (Config.DB_DSN or "").startswith("postgresql"):
+                _notifier = PostgresNotifier(get_engine())
+            else:
+                _notifier = InProcessNotifier()
+        return _notifier
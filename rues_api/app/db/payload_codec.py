@@ -0,0 +1,146 @@
+"""Almacenamiento comprimido de los payloads JSON de las transacciones.
+
+En PostgreSQL los payloads son JSONB y los comprime el propio motor (TOAST,
+con lz4 si el servidor lo soporta), de modo que siguen siendo consultables
+con operadores JSONB. En los motores que guardan el JSON como texto plano,
+``CompressedJSON`` comprime los valores que superan
+``PAYLOAD_COMPRESSION_MIN_BYTES`` y los guarda como binario con un byte
+marcador del códec. Los valores pequeños y las filas anteriores siguen
+siendo texto JSON y se leen igual. Al leer se entrega un ``LazyPayload``
+que solo se descomprime y decodifica al serializarlo.
+"""
+import functools
+import json
+import logging
+import zlib
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator, UserDefinedType
+
+from app.core.config import Config
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependencia opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Primer byte de un payload comprimido. El texto JSON nunca empieza por un
+# byte de control, así que cualquier otro valor es JSON sin comprimir
+MARKER_ZLIB = b"\x01"
+MARKER_ZSTD = b"\x02"
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_codec(codec: str) -> Optional[str]:
+    """Códec efectivo para ``PAYLOAD_COMPRESSION``; se resuelve y avisa una sola vez."""
+    if codec == "none":
+        return None
+    if codec in ("auto", "zstd") and zstandard is not None:
+        return "zstd"
+    if codec == "zstd":
+        logger.warning("PAYLOAD_COMPRESSION=zstd sin el paquete zstandard; se usa zlib")
+    return "zlib"
+
+
+def _codec() -> Optional[str]:
+    """Códec configurado: zstd si está instalado y se pidió (o en auto), zlib o None."""
+    return _resolve_codec(Config.PAYLOAD_COMPRESSION)
+
+
+def encode_payload(data: bytes) -> bytes:
+    """Comprime ``data`` con el códec configurado y antepone su marcador."""
+    codec = _codec()
+    if codec == "zstd":
+        return MARKER_ZSTD + zstandard.ZstdCompressor().compress(data)
+    if codec == "zlib":
+        return MARKER_ZLIB + zlib.compress(data)
+    return data
+
+
+def decode_payload(blob: bytes) -> bytes:
+    """Devuelve el JSON original de un valor guardado por ``encode_payload``."""
+    marker = blob[:1]
+    if marker == MARKER_ZLIB:
+        return zlib.decompress(blob[1:])
+    if marker == MARKER_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Payload comprimido con zstd: instale el paquete zstandard para leerlo")
+        return zstandard.ZstdDecompressor().decompress(blob[1:])
+    return blob
+
+
+def _decode_stored(raw):
+    if isinstance(raw, (bytes, memoryview)):
+        raw = decode_payload(bytes(raw))
+    return json.loads(raw)
+
+
+class LazyPayload:
+    """Payload tal como está guardado; se decodifica en el primer ``load()``."""
+    
+    __slots__ = ("raw", "_value", "_loaded")
+    
+    def __init__(self, raw) -> None:
+        self.raw = raw
+        self._value = None
+        self._loaded = False
+    
+    def load(self):
+        if not self._loaded:
+            self._value = _decode_stored(self.raw)
+            self._loaded = True
+        return self._value
+    
+    def __eq__(self, other) -> bool:
+        return self.load() == payload_value(other)
+    
+    __hash__ = None
+
+
+def payload_value(value):
+    """Valor JSON de un payload, decodificando un ``LazyPayload`` si hace falta."""
+    return value.load() if isinstance(value, LazyPayload) else value
+
+
+class _StoredJSON(UserDefinedType):
+    """Columna declarada como JSON que entrega los valores sin procesar."""
+    
+    cache_ok = True
+    
+    def get_col_spec(self, **kw) -> str:
+        return "JSON"
+
+
+class CompressedJSON(TypeDecorator):
+    """JSONB en PostgreSQL; en otros motores, JSON comprimido por encima del umbral.
+    
+    None se guarda como NULL.
+    """
+    
+    impl = _StoredJSON
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(JSONB(none_as_null=True))
+        return dialect.type_descriptor(_StoredJSON())
+    
+    def process_bind_param(self, value, dialect):
+        if dialect.name == "postgresql" or value is None:
+            return value
+        if isinstance(value, LazyPayload):
+            return value.raw
+        text = json.dumps(value)
+        data = text.encode("utf-8")
+        if _codec() is None or len(data) < Config.PAYLOAD_COMPRESSION_MIN_BYTES:
+            return text
+        return encode_payload(data)
+    
+    def process_result_value(self, value, dialect):
+        if dialect.name == "postgresql" or value is None:
+            return value
+        # SQLite convierte a número un escalar JSON numérico guardado como texto
+        return LazyPayload(value) if isinstance(value, (str, bytes, memoryview)) else value
@@ -0,0 +1,130 @@
+"""Pool de conexiones instrumentado."""
+import logging
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool, QueuePool
+
+from app.core.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Contadores acumulados de espera por conexiones del pool."""
+    
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._last_log = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def record_checkout(self, waited: float) -> bool:
+        """Registra un checkout; devuelve True si toca registrar las stats en el log."""
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            if waited * 1000 >= Config.DB_POOL_SLOW_CHECKOUT_MS:
+                self.slow_checkouts += 1
+            
+            interval = Config.DB_POOL_LOG_INTERVAL_SECONDS
+            now = time.monotonic()
+            if interval > 0 and now - self._last_log >= interval:
+                self._last_log = now
+                return True
+            return False
+    
+    def record_timeout(self, waited: float) -> None:
+        """Registra un checkout que agotó ``pool_timeout``."""
+        with self._lock:
+            self.timeouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+    
+    def snapshot(self) -> dict:
+        """Devuelve una copia de los contadores."""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "wait_ms_total": round(self.wait_seconds_total * 1000, 3),
+                "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada petición por una conexión."""
+    
+    def __init__(self, *args, max_overflow: int = 10, **kwargs) -> None:
+        super().__init__(*args, max_overflow=max_overflow, **kwargs)
+        # QueuePool no expone max_overflow públicamente
+        self.max_overflow = max_overflow
+        self.stats = PoolStats()
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            waited = time.perf_counter() - started
+            self.stats.record_timeout(waited)
+            logger.error(
+                "Timeout esperando conexión del pool tras %.0f ms: %s",
+                waited * 1000, pool_status(self)
+            )
+            raise
+        
+        waited = time.perf_counter() - started
+        if self.stats.record_checkout(waited):
+            logger.info("Estado del pool de conexiones: %s", pool_status(self))
+        if waited * 1000 >= Config.DB_POOL_SLOW_CHECKOUT_MS:
+            logger.warning(
+                "Checkout lento del pool: %.0f ms esperando conexión (%s)",
+                waited * 1000, self.status()
+            )
+        return connection
+
+
+def pool_status(pool: Pool) -> dict:
+    """Devuelve el estado actual del pool y sus contadores acumulados."""
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": getattr(pool, "max_overflow", Config.DB_MAX_OVERFLOW),
+            "timeout_seconds": pool.timeout(),
+        })
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update(stats.snapshot())
+    return status
+
+
+def engine_options(dsn: str) -> dict:
+    """Opciones de ``create_engine`` para el pool según la configuración."""
+    if dsn.startswith("sqlite"):
+        return {}
+    
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT,
+        "pool_recycle": Config.DB_POOL_RECYCLE,
+        "pool_pre_ping": Config.DB_POOL_PRE_PING,
+    }
+    if Config.DB_STATEMENT_TIMEOUT_MS > 0 and dsn.startswith("postgresql"):
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={Config.DB_STATEMENT_TIMEOUT_MS}"
+        }
+    return options
@@ -1,8 +1,106 @@
 """Sesión de base de datos."""
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import threading
+from typing import Callable, Optional
+
+from flask import Flask, g
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
 
 from app.core.config import Config
+from app.db.pool import engine_options
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """Devuelve el engine del proceso, creándolo en el primer uso.
+    
+    Importar la aplicación no abre conexiones: el engine nace en el proceso
+    que lo usa, después de cualquier fork del servidor.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(Config.DB_DSN, **engine_options(Config.DB_DSN))
+    return _engine
+
+
+def dispose_engine() -> None:
+    """Descarta las conexiones heredadas tras un fork sin cerrar las del padre."""
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+
+class _LazyEngineSession(Session):
+    """Sesión que usa el engine perezoso cuando no se le asignó uno explícito."""
+    
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            return get_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+# expire_on_commit=False: los objetos siguen legibles tras el commit sin
+# recargarse, lo que permite serializarlos sin SELECT adicionales
+SessionLocal = sessionmaker(
+    class_=_LazyEngineSession, autocommit=False, autoflush=False, expire_on_commit=False
+)
+
+# Clave en session.info con los callbacks a ejecutar tras el commit
+_COMMIT_CALLBACKS_KEY = "after_commit_callbacks"
+
+
+def get_session() -> Session:
+    """Devuelve la sesión de la petición actual, abriéndola en el primer uso.
+    
+    Todos los servicios y repositorios de una misma petición comparten esta
+    sesión (unidad de trabajo). Se hace commit al terminar la petición con
+    éxito y rollback en cualquier otro caso.
+    """
+    session = g.get("db_session")
+    if session is None:
+        session = g.db_session = SessionLocal()
+    return session
+
+
+def on_commit(session: Session, callback: Callable[[], None]) -> None:
+    """Ejecuta ``callback`` solo si la transacción actual de ``session`` hace commit."""
+    session.info.setdefault(_COMMIT_CALLBACKS_KEY, []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_callbacks(session: Session) -> None:
+    for callback in session.info.pop(_COMMIT_CALLBACKS_KEY, []):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_commit_callbacks(session: Session) -> None:
+    session.info.pop(_COMMIT_CALLBACKS_KEY, None)
+
 
-engine = create_engine(Config.DB_DSN)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def init_app(app: Flask) -> None:
+    """Registra el ciclo de vida de la sesión por petición en la aplicación."""
+    
+    @app.after_request
+    def commit_session(response):
+        # El commit ocurre antes de enviar la respuesta: si falla, el cliente
+        # recibe un error en lugar de una confirmación falsa
+        session = g.get("db_session")
+        if session is not None:
+            if response.status_code < 400:
+                session.commit()
+            else:
+                session.rollback()
+        return response
+    
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        session = g.pop("db_session", None)
+        if session is not None:
+            if exception is not None:
+                session.rollback()
+            session.close()
@@ -3,19 +3,29 @@ from datetime import datetime
 from enum import Enum
 
 from sqlalchemy import (
+    BigInteger,
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
+    SmallInteger,
     String,
     Text,
     func,
+    text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from app.db.payload_codec import CompressedJSON
+
 Base = declarative_base()
 
+# JSONB en PostgreSQL, JSON (texto, comprimido si es grande) en otros motores;
+# None se guarda como NULL
+JSONPayload = CompressedJSON()
+
 
 class TransactionStatus(Enum):
     """Estados de transacción."""
@@ -23,6 +33,7 @@ class TransactionStatus(Enum):
     PROCESANDO = "PROCESANDO"
     PROCESADO = "PROCESADO"
     ERROR = "ERROR"
+    FALLIDO = "FALLIDO"  # Reintentos agotados (dead-letter)
 
 
 class Company(Base):
@@ -46,17 +57,147 @@ class Transaction(Base):
     company_id = Column(Integer, ForeignKey("companies.id"))
     nit = Column(String, index=True)
     status = Column(String)  # Enum como string
-    payload_in = Column(Text)
-    result_payload = Column(Text)
+    payload_in = Column(JSONPayload)
+    result_payload = Column(JSONPayload)
     error_code = Column(String, nullable=True)
     error_msg = Column(String, nullable=True)
     runner_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
     idempotency_key = Column(String, nullable=True)
-    created_at = Column(DateTime, default=func.now())
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # SHA-256 del cuerpo recibido con la Idempotency-Key, para detectar reusos con otro cuerpo
+    request_hash = Column(String(64), nullable=True)
+    client_id = Column(String, nullable=True)
+    priority = Column(SmallInteger, nullable=False, default=0, server_default=text("0"))
+    # Reclamos recibidos y momento desde el que la transacción PENDIENTE se puede reclamar
+    attempts = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    # Las fechas de la transacción salen del reloj de la aplicación, el mismo
+    # del claim, el backoff, los leases y los filtros del listado; el default
+    # del servidor de next_attempt_at solo cubre las filas previas a la columna
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.now, server_default=func.now())
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
     # Relación con empresa
     company = relationship("Company", back_populates="transactions")
+    
+    # Traer con RETURNING en el mismo INSERT/UPDATE lo que genere la base,
+    # en vez de un SELECT al leerlo
+    __mapper_args__ = {"eager_defaults": True}
+    
+    __table_args__ = (
+        # Cola FIFO de pendientes por vencimiento (llegada o reintento): sirve
+        # el filtro y el ORDER BY del claim
+        Index(
+            "ix_transactions_pending_queue",
+            "next_attempt_at",
+            "id",
+            postgresql_where=text("status = 'PENDIENTE'"),
+            sqlite_where=text("status = 'PENDIENTE'"),
+        ),
+        # Cola por prioridad del modo de reclamo "priority"
+        Index(
+            "ix_transactions_pending_priority",
+            text("priority DESC"),
+            "next_attempt_at",
+            "id",
+            postgresql_where=text("status = 'PENDIENTE'"),
+            sqlite_where=text("status = 'PENDIENTE'"),
+        ),
+        # Modo "fair": recorrido de los NITs con trabajo y cabeza de cada cola por NIT
+        Index(
+            "ix_transactions_pending_nit",
+            "nit",
+            text("priority DESC"),
+            "next_attempt_at",
+            "id",
+            postgresql_where=text("status = 'PENDIENTE'"),
+            sqlite_where=text("status = 'PENDIENTE'"),
+        ),
+        # Modo "fair": transacciones en curso por NIT para el límite por NIT
+        Index(
+            "ix_transactions_processing_nit",
+            "nit",
+            postgresql_where=text("status = 'PROCESANDO'"),
+            sqlite_where=text("status = 'PROCESANDO'"),
+        ),
+        # Leases vencidos que el reaper devuelve a la cola
+        Index(
+            "ix_transactions_processing_lease",
+            "lease_expires_at",
+            postgresql_where=text("status = 'PROCESANDO'"),
+            sqlite_where=text("status = 'PROCESANDO'"),
+        ),
+        # Recorrido del archivado por (updated_at, id) sobre las finalizadas
+        Index(
+            "ix_transactions_finished_updated_at",
+            "updated_at",
+            "id",
+            postgresql_where=text("status IN ('PROCESADO', 'ERROR', 'FALLIDO')"),
+            sqlite_where=text("status IN ('PROCESADO', 'ERROR', 'FALLIDO')"),
+        ),
+        # Paginación por keyset del listado y la exportación
+        Index("ix_transactions_created_at_id", "created_at", "id"),
+        # Una Idempotency-Key identifica una sola transacción por cliente
+        Index(
+            "uq_transactions_client_idempotency_key",
+            "client_id",
+            "idempotency_key",
+            unique=True,
+        ),
+    )
+
+
+class TransactionArchive(Base):
+    """Transacciones finalizadas movidas fuera de la tabla caliente.
+    
+    Mismas columnas que ``transactions`` más ``archived_at``; las filas
+    conservan su id original.
+    """
+    __tablename__ = "transactions_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    company_id = Column(Integer, ForeignKey("companies.id"))
+    nit = Column(String, index=True)
+    status = Column(String)
+    payload_in = Column(JSONPayload)
+    result_payload = Column(JSONPayload)
+    error_code = Column(String, nullable=True)
+    error_msg = Column(String, nullable=True)
+    runner_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    idempotency_key = Column(String, nullable=True)
+    request_hash = Column(String(64), nullable=True)
+    client_id = Column(String, nullable=True)
+    priority = Column(SmallInteger, nullable=False, default=0, server_default=text("0"))
+    attempts = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    next_attempt_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=func.now())
+    
+    __table_args__ = (
+        Index("ix_transactions_archive_created_at_id", "created_at", "id"),
+        Index(
+            "ix_transactions_archive_client_idempotency_key",
+            "client_id",
+            "idempotency_key",
+        ),
+    )
+
+
+class TransactionCounter(Base):
+    """Contadores incrementales de transacciones por estado.
+    
+    Cada contador se reparte en varias filas (``shard``) para que escrituras
+    concurrentes no se bloqueen sobre la misma fila; el valor es la suma de
+    sus shards. ``nit`` vacío corresponde al total de todas las empresas.
+    """
+    __tablename__ = "transaction_counters"
+    
+    nit = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(BigInteger, nullable=False, default=0)
 
 
 class AuditLog(Base):
@@ -69,3 +210,18 @@ class AuditLog(Base):
     action = Column(String)
     detail = Column(Text)
     created_at = Column(DateTime, default=func.now())
+    
+    __table_args__ = (
+        # Historial de una entidad en orden cronológico
+        Index("ix_audit_logs_entity", "entity", "entity_id", "created_at"),
+    )
+
+
+class ApiKey(Base):
+    """Modelo de API Key temporal (almacén compartido entre procesos)."""
+    __tablename__ = "api_keys"
+    
+    key_hash = Column(String(64), primary_key=True)
+    username = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=func.now())
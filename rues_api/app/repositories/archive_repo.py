@@ -0,0 +1,85 @@
+"""Repositorio del archivo de transacciones finalizadas."""
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.models import Transaction, TransactionArchive, TransactionStatus
+from app.repositories.stats_repo import record_transitions
+
+# Estados que ya no cambian y pueden salir de la tabla caliente
+FINISHED_STATUSES = (
+    TransactionStatus.PROCESADO.value,
+    TransactionStatus.ERROR.value,
+    TransactionStatus.FALLIDO.value,
+)
+
+# Columnas copiadas tal cual de transactions a transactions_archive
+_COPIED_COLUMNS = [column.name for column in Transaction.__table__.columns]
+
+
+def archive_chunk(
+    session: Session,
+    cutoff: datetime,
+    chunk_size: int,
+    after: Optional[tuple[datetime, int]] = None
+) -> tuple[list[int], Optional[tuple[datetime, int]]]:
+    """Mueve al archivo un bloque de transacciones finalizadas antes de ``cutoff``.
+    
+    Toma hasta ``chunk_size`` filas posteriores a la pareja ``(updated_at,
+    id)`` de ``after`` (paginación por keyset sobre el índice parcial
+    ``ix_transactions_finished_updated_at``, que solo contiene finalizadas y
+    deja de leer al llegar a ``cutoff``), las copia con ``INSERT ... SELECT``
+    y las borra de ``transactions``. En PostgreSQL las filas se bloquean con
+    ``FOR UPDATE SKIP LOCKED``, así un archivado concurrente o un runner que
+    las esté tocando no se bloquean entre sí. Devuelve los ids movidos y la
+    posición desde la que sigue el siguiente bloque; una lista vacía indica
+    que no quedan filas.
+    """
+    query = (
+        select(Transaction.id, Transaction.nit, Transaction.status, Transaction.updated_at)
+        .where(
+            Transaction.status.in_(FINISHED_STATUSES),
+            Transaction.updated_at < cutoff
+        )
+        .order_by(Transaction.updated_at, Transaction.id)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True)
+    )
+    if after is not None:
+        query = query.where(tuple_(Transaction.updated_at, Transaction.id) > tuple_(*after))
+    rows = session.execute(query).all()
+    if not rows:
+        return [], after
+    ids = [row.id for row in rows]
+    
+    source = Transaction.__table__
+    session.execute(
+        insert(TransactionArchive.__table__).from_select(
+            _COPIED_COLUMNS,
+            select(*[source.c[name] for name in _COPIED_COLUMNS]).where(source.c.id.in_(ids))
+        )
+    )
+    session.execute(delete(source).where(source.c.id.in_(ids)))
+    record_transitions(session, [(row.nit, row.status, None) for row in rows])
+    return ids, (rows[-1].updated_at, rows[-1].id)
+
+
+def find_by_id(session: Session, transaction_id: int) -> Optional[TransactionArchive]:
+    """Busca una transacción archivada por su id original."""
+    return session.get(TransactionArchive, transaction_id)
+
+
+def find_by_idempotency_key(
+    session: Session,
+    client_id: Optional[str],
+    idempotency_key: str
+) -> Optional[TransactionArchive]:
+    """Busca la transacción archivada creada por un cliente con una Idempotency-Key."""
+    return session.scalars(
+        select(TransactionArchive).where(
+            TransactionArchive.client_id == client_id,
+            TransactionArchive.idempotency_key == idempotency_key
+        ).limit(1)
+    ).first()
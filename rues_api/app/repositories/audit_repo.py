@@ -0,0 +1,24 @@
+"""Repositorio de logs de auditoría."""
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models.models import AuditLog
+
+
+def insert_audit_logs(session: Session, rows: list[dict]) -> None:
+    """Inserta eventos de auditoría en bloque con un solo executemany.
+    
+    Cada elemento trae ``entity``, ``entity_id``, ``action``, ``detail`` y
+    ``created_at``.
+    """
+    if rows:
+        session.execute(insert(AuditLog), rows)
+
+
+def get_history(session: Session, entity: str, entity_id: int) -> list[AuditLog]:
+    """Devuelve los eventos de una entidad en orden cronológico."""
+    return session.scalars(
+        select(AuditLog)
+        .where(AuditLog.entity == entity, AuditLog.entity_id == entity_id)
+        .order_by(AuditLog.created_at, AuditLog.id)
+    ).all()
@@ -1,18 +1,111 @@
 """Repositorio de empresas."""
 from typing import Optional
 
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 
+from app.core.cache import TTLCache
+from app.core.config import Config
+from app.db.session import on_commit
 from app.models.models import Company
 
+# Caché NIT -> company_id compartida por las peticiones del proceso
+_company_ids = TTLCache(Config.COMPANY_CACHE_SIZE, Config.COMPANY_CACHE_TTL_SECONDS)
 
-def get_or_create_company(session: Session, nit: str, name: Optional[str] = None) -> Company:
-    """Obtiene o crea una empresa por NIT."""
-    company = session.query(Company).filter(Company.nit == nit).first()
+
+def _insert(session: Session):
+    """Devuelve el constructor INSERT del dialecto, con soporte de ON CONFLICT."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def _cache_after_commit(session: Session, company_ids: dict[str, int]) -> None:
+    """Difiere el cacheo de empresas recién insertadas hasta el commit."""
+    def publish():
+        for nit, company_id in company_ids.items():
+            _company_ids.set(nit, company_id)
+    
+    if company_ids:
+        on_commit(session, publish)
+
+
+def get_or_create_company_id(session: Session, nit: str, name: Optional[str] = None) -> int:
+    """Obtiene o crea una empresa por NIT y devuelve su id.
+    
+    Las empresas ya vistas se resuelven desde la caché sin consultar la base
+    de datos. La creación usa ``INSERT ... ON CONFLICT DO NOTHING RETURNING``
+    para que inserciones concurrentes del mismo NIT no violen el índice único.
+    """
+    company_id = _company_ids.get(nit)
+    if company_id is not None:
+        return company_id
+    
+    company_id = session.execute(
+        _insert(session)(Company)
+        .values(nit=nit, name=name)
+        .on_conflict_do_nothing(index_elements=[Company.nit])
+        .returning(Company.id)
+    ).scalar()
     
-    if company is None:
-        company = Company(nit=nit, name=name)
-        session.add(company)
-        session.flush()
+    if company_id is not None:
+        _cache_after_commit(session, {nit: company_id})
+        return company_id
     
-    return company
+    # La empresa ya existía o la creó otra transacción concurrente
+    company_id = session.execute(
+        select(Company.id).where(Company.nit == nit)
+    ).scalar_one()
+    _company_ids.set(nit, company_id)
+    return company_id
+
+
+def upsert_companies(session: Session, companies: dict[str, Optional[str]]) -> dict[str, int]:
+    """Crea en bloque las empresas que no existan y devuelve el mapa NIT -> id.
+    
+    Las empresas existentes no se modifican. Los NIT en caché no tocan la base
+    de datos; el resto usa un único INSERT multi-fila con
+    ``ON CONFLICT (nit) DO NOTHING`` y un SELECT para resolver los existentes.
+    """
+    company_ids = {}
+    missing = {}
+    for nit, name in companies.items():
+        company_id = _company_ids.get(nit)
+        if company_id is None:
+            missing[nit] = name
+        else:
+            company_ids[nit] = company_id
+    
+    if not missing:
+        return company_ids
+    
+    inserted = dict(session.execute(
+        _insert(session)(Company)
+        .on_conflict_do_nothing(index_elements=[Company.nit])
+        .returning(Company.nit, Company.id),
+        [{"nit": nit, "name": name} for nit, name in missing.items()]
+    ).all())
+    _cache_after_commit(session, inserted)
+    company_ids.update(inserted)
+    
+    existing = [nit for nit in missing if nit not in inserted]
+    if existing:
+        rows = session.execute(
+            select(Company.nit, Company.id).where(Company.nit.in_(existing))
+        )
+        for nit, company_id in rows:
+            _company_ids.set(nit, company_id)
+            company_ids[nit] = company_id
+    
+    return company_ids
+
+
+def company_cache_stats() -> dict:
+    """Devuelve los contadores de la caché NIT -> company_id."""
+    return _company_ids.stats()
+
+
+def clear_company_cache() -> None:
+    """Vacía la caché NIT -> company_id."""
+    _company_ids.clear()
@@ -0,0 +1,107 @@
+"""Repositorio de contadores de transacciones por estado."""
+import random
+from collections import Counter
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.core.config import Config
+from app.models.models import Transaction, TransactionCounter
+
+# Valor de ``TransactionCounter.nit`` para el total de todas las empresas
+ALL_NITS = ""
+
+# Shard reservado para las correcciones de la reconciliación: los cambios de
+# estado escriben en los shards 0..STATS_COUNTER_SHARDS-1 y nunca chocan con él
+RECONCILE_SHARD = -1
+
+
+def _insert(session: Session):
+    """Devuelve el constructor INSERT del dialecto, con soporte de ON CONFLICT."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def record_transitions(
+    session: Session,
+    transitions: Iterable[tuple[Optional[str], Optional[str], Optional[str]]]
+) -> None:
+    """Aplica cambios de estado a los contadores en la transacción actual.
+    
+    Cada transición es ``(nit, estado_anterior, estado_nuevo)``: el anterior
+    es None para una transacción nueva y el nuevo es None para una que sale
+    de la tabla (archivada). Todas se aplican con un solo
+    ``INSERT ... ON CONFLICT DO UPDATE`` sobre un shard elegido al azar. Con
+    ``STATS_PER_NIT`` también se actualizan los contadores de cada NIT.
+    """
+    deltas = Counter()
+    for nit, old_status, new_status in transitions:
+        if old_status == new_status:
+            continue
+        scopes = (ALL_NITS, nit) if Config.STATS_PER_NIT and nit else (ALL_NITS,)
+        for scope in scopes:
+            if old_status is not None:
+                deltas[(scope, old_status)] -= 1
+            if new_status is not None:
+                deltas[(scope, new_status)] += 1
+    
+    add_to_counters(session, deltas, random.randrange(Config.STATS_COUNTER_SHARDS))
+
+
+def add_to_counters(session: Session, deltas: dict[tuple[str, str], int], shard: int) -> None:
+    """Suma ``deltas`` (``(nit, estado) -> diferencia``) a los contadores de ``shard``."""
+    # Orden fijo de filas para que transacciones concurrentes las bloqueen
+    # en el mismo orden
+    rows = [
+        {"nit": scope, "status": status, "shard": shard, "count": delta}
+        for (scope, status), delta in sorted(deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+    
+    stmt = _insert(session)(TransactionCounter).values(rows)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["nit", "status", "shard"],
+        set_={"count": TransactionCounter.count + stmt.excluded.count}
+    ))
+
+
+def get_counters(session: Session, nit: str = ALL_NITS) -> dict[str, int]:
+    """Devuelve el valor de los contadores por estado, sumando sus shards."""
+    rows = session.execute(
+        select(TransactionCounter.status, func.sum(TransactionCounter.count))
+        .where(TransactionCounter.nit == nit)
+        .group_by(TransactionCounter.status)
+    ).all()
+    return {status: int(count) for status, count in rows}
+
+
+def get_all_counters(session: Session) -> dict[tuple[str, str], int]:
+    """Devuelve el valor de todos los contadores por ``(nit, estado)``, sumando sus shards."""
+    rows = session.execute(
+        select(TransactionCounter.nit, TransactionCounter.status, func.sum(TransactionCounter.count))
+        .group_by(TransactionCounter.nit, TransactionCounter.status)
+    ).all()
+    return {(nit, status): int(count) for nit, status, count in rows}
+
+
+def count_by_status(session: Session, nit: Optional[str] = None) -> dict[str, int]:
+    """Cuenta las transacciones por estado directamente sobre ``transactions``."""
+    query = select(Transaction.status, func.count()).group_by(Transaction.status)
+    if nit is not None:
+        query = query.where(Transaction.nit == nit)
+    return {status: count for status, count in session.execute(query).all()}
+
+
+def count_by_nit_and_status(session: Session) -> dict[tuple[str, str], int]:
+    """Cuenta las transacciones por NIT y estado directamente sobre ``transactions``."""
+    rows = session.execute(
+        select(Transaction.nit, Transaction.status, func.count())
+        .where(Transaction.nit.is_not(None))
+        .group_by(Transaction.nit, Transaction.status)
+    ).all()
+    return {(nit, status): count for nit, status, count in rows}
@@ -1,25 +1,199 @@
 """Repositorio de transacciones."""
-import json
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Callable, Optional
 
+from sqlalchemy import (
+    DateTime,
+    Integer,
+    String,
+    bindparam,
+    case,
+    cast,
+    column,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    text,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select, Update
 
-from app.models.models import Transaction, TransactionStatus
+from app.db.notifier import NOTIFY_CHANNEL
+from app.models.models import Transaction, TransactionArchive, TransactionStatus
+from app.repositories.stats_repo import record_transitions
 
 
-def create_transaction(session: Session, payload: dict, idempotency_key: Optional[str] = None) -> Transaction:
+# Política de reintentos: recibe los intentos ya hechos y devuelve la espera
+# hasta el siguiente, o None si se agotaron
+RetryDelay = Callable[[int], Optional[timedelta]]
+
+
+class LeaseConflictError(Exception):
+    """El runner ya no tiene la transacción: su lease expiró o la tomó otro runner."""
+
+
+def _lease_conflict(transaction, runner_id: Optional[str], now: datetime) -> Optional[str]:
+    """Devuelve por qué ``runner_id`` no puede actualizar la transacción, o None.
+    
+    Sin ``runner_id`` solo se rechaza una transacción PROCESANDO con el lease
+    vencido; con ``runner_id`` además debe ser el runner que la reclamó.
+    """
+    if runner_id is not None and transaction.runner_id != runner_id:
+        return "La transacción no está asignada a este runner"
+    if (
+        transaction.status == TransactionStatus.PROCESANDO.value
+        and transaction.lease_expires_at is not None
+        and transaction.lease_expires_at < now
+    ):
+        return "El lease de la transacción expiró"
+    return None
+
+
+def _lease_allows_update(table, runner_id, now: datetime):
+    """Condición SQL equivalente a ``_lease_conflict`` para actualizaciones en bloque."""
+    return (
+        or_(runner_id.is_(None), table.c.runner_id == runner_id)
+        & or_(
+            table.c.status != TransactionStatus.PROCESANDO.value,
+            table.c.lease_expires_at.is_(None),
+            table.c.lease_expires_at >= now
+        )
+    )
+
+
+def _retry_outcome(
+    status: str,
+    attempts: int,
+    retryable: Optional[bool],
+    retry_delay: Optional[RetryDelay],
+    now: datetime
+) -> tuple[str, Optional[datetime]]:
+    """Estado final de una actualización y, si se reintenta, cuándo.
+    
+    Un ERROR reintentable vuelve a PENDIENTE con ``next_attempt_at`` tras el
+    backoff, o pasa a FALLIDO si se agotaron los intentos. Sin política de
+    reintentos, o con ``retryable`` en False, el ERROR es definitivo.
+    """
+    if status != TransactionStatus.ERROR.value or retry_delay is None or retryable is False:
+        return status, None
+    delay = retry_delay(attempts)
+    if delay is None:
+        return TransactionStatus.FALLIDO.value, None
+    return TransactionStatus.PENDIENTE.value, now + delay
+
+
+def create_transaction(
+    session: Session,
+    payload: dict,
+    idempotency_key: Optional[str] = None,
+    client_id: Optional[str] = None,
+    company_id: Optional[int] = None,
+    request_hash: Optional[str] = None
+) -> Transaction:
     """Crea una nueva transacción."""
     transaction = Transaction(
+        company_id=company_id,
         nit=payload.get("nit"),
         status=TransactionStatus.PENDIENTE.value,
-        payload_in=json.dumps(payload),
-        idempotency_key=idempotency_key
+        payload_in=payload,
+        idempotency_key=idempotency_key,
+        request_hash=request_hash,
+        client_id=client_id,
+        priority=payload.get("priority", 0)
     )
     session.add(transaction)
     session.flush()
+    record_transitions(session, [(transaction.nit, None, transaction.status)])
+    notify_new_work(session)
     return transaction
 
 
+def find_by_idempotency_key(
+    session: Session,
+    client_id: Optional[str],
+    idempotency_key: str
+) -> Transaction | None:
+    """Busca la transacción creada por un cliente con una Idempotency-Key."""
+    return session.query(Transaction).filter(
+        Transaction.client_id == client_id,
+        Transaction.idempotency_key == idempotency_key
+    ).first()
+
+
+def find_version(session: Session, transaction_id: int):
+    """Devuelve ``(updated_at, lease_expires_at)`` de una transacción activa o archivada, o None.
+    
+    Es una búsqueda por clave primaria que solo lee esas dos columnas, para
+    responder peticiones condicionales sin cargar los payloads.
+    """
+    def version(table):
+        return select(table.c.updated_at, table.c.lease_expires_at).where(table.c.id == transaction_id)
+    
+    return session.execute(
+        union_all(version(Transaction.__table__), version(TransactionArchive.__table__)).limit(1)
+    ).first()
+
+
+def find_id_by_idempotency_key(
+    session: Session,
+    client_id: Optional[str],
+    idempotency_key: str
+) -> Optional[int]:
+    """Devuelve el id de la transacción (activa o archivada) creada por un cliente con una Idempotency-Key."""
+    def lookup(table):
+        return select(table.c.id).where(
+            table.c.client_id == client_id, table.c.idempotency_key == idempotency_key
+        )
+    
+    return session.scalars(
+        union_all(lookup(Transaction.__table__), lookup(TransactionArchive.__table__)).limit(1)
+    ).first()
+
+
+def create_transactions(session: Session, items: list[dict]) -> list[Transaction]:
+    """Crea transacciones en bloque con un INSERT multi-fila.
+    
+    Cada elemento trae ``payload``, ``company_id`` e ``idempotency_key``. Las
+    transacciones se devuelven en el mismo orden de ``items``.
+    """
+    if not items:
+        return []
+    
+    transactions = session.scalars(
+        insert(Transaction).returning(Transaction, sort_by_parameter_order=True),
+        [
+            {
+                "company_id": item["company_id"],
+                "nit": item["payload"].get("nit"),
+                "status": TransactionStatus.PENDIENTE.value,
+                "payload_in": item["payload"],
+                "idempotency_key": item.get("idempotency_key"),
+                "priority": item["payload"].get("priority", 0),
+            }
+            for item in items
+        ]
+    ).all()
+    record_transitions(session, [
+        (transaction.nit, None, transaction.status) for transaction in transactions
+    ])
+    notify_new_work(session)
+    return transactions
+
+
+def notify_new_work(session: Session) -> None:
+    """Publica un NOTIFY en PostgreSQL; se entrega al hacer commit."""
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(
+            text("SELECT pg_notify(:channel, '')"), {"channel": NOTIFY_CHANNEL}
+        )
+
+
 def update_status(
     session: Session,
     *,
@@ -28,10 +202,18 @@ def update_status(
     status: str,
     error_code: Optional[str] = None,
     error_msg: Optional[str] = None,
-    result_payload: Optional[dict] = None
+    result_payload: Optional[dict] = None,
+    runner_id: Optional[str] = None,
+    retryable: Optional[bool] = None,
+    retry_delay: Optional[RetryDelay] = None
 ) -> Transaction:
-    """Actualiza el estado de una transacción."""
-    query = session.query(Transaction)
+    """Actualiza el estado de una transacción y libera su lease.
+    
+    Con ``retry_delay`` un ERROR se reprograma o termina en FALLIDO (ver
+    ``_retry_outcome``). Lanza ``LeaseConflictError`` si el lease del runner
+    ya no es válido.
+    """
+    query = session.query(Transaction).with_for_update()
     
     if id is not None:
         query = query.filter(Transaction.id == id)
@@ -44,20 +226,507 @@ def update_status(
     if transaction is None:
         raise ValueError("Transacción no encontrada")
     
+    now = datetime.now()
+    conflict = _lease_conflict(transaction, runner_id, now)
+    if conflict:
+        raise LeaseConflictError(conflict)
+    
+    status, next_attempt_at = _retry_outcome(status, transaction.attempts, retryable, retry_delay, now)
+    record_transitions(session, [(transaction.nit, transaction.status, status)])
     transaction.status = status
+    transaction.lease_expires_at = None
+    if next_attempt_at is not None:
+        transaction.next_attempt_at = next_attempt_at
+        transaction.runner_id = None
     if error_code is not None:
         transaction.error_code = error_code
     if error_msg is not None:
         transaction.error_msg = error_msg
     if result_payload is not None:
-        transaction.result_payload = json.dumps(result_payload)
+        transaction.result_payload = result_payload
     
     session.flush()
     return transaction
 
 
-def fetch_next_pending(session: Session) -> Transaction | None:
-    """Obtiene la siguiente transacción pendiente."""
-    return session.query(Transaction).filter(
-        Transaction.status == TransactionStatus.PENDIENTE.value
-    ).first()
+# Un reintento libera al runner, igual que el reencolado por lease vencido
+def _runner_after_retry(table, next_attempt_at):
+    return case((next_attempt_at.is_not(None), None), else_=table.c.runner_id)
+
+
+def _batch_update_statement(rows: dict[int, dict], now: datetime) -> Update:
+    """``UPDATE ... FROM (VALUES ...)`` de ``update_status_batch`` en PostgreSQL.
+    
+    PostgreSQL deduce como ``text`` una columna de VALUES cuyas filas son
+    todas NULL, así que las columnas que se combinan con COALESCE se
+    convierten explícitamente al tipo de la tabla.
+    """
+    table = Transaction.__table__
+    # Autounión con las filas bloqueadas: RETURNING entrega el estado
+    # anterior a la actualización, necesario para los contadores
+    previous = (
+        select(table.c.id, table.c.nit, table.c.status)
+        .where(table.c.id.in_(list(rows)))
+        .with_for_update()
+        .subquery("previous")
+    )
+    batch = values(
+        column("id", Integer),
+        column("status", String),
+        column("error_code", String),
+        column("error_msg", String),
+        column("result_payload", table.c.result_payload.type),
+        column("runner_id", String),
+        column("next_attempt_at", DateTime),
+        name="batch"
+    ).data([
+        (
+            row["id"], row["status"], row["error_code"], row["error_msg"],
+            row["result_payload"], row["runner_id"], row["next_attempt_at"]
+        )
+        for row in rows.values()
+    ])
+    next_attempt_at = cast(batch.c.next_attempt_at, table.c.next_attempt_at.type)
+    return (
+        update(table)
+        .where(
+            table.c.id == batch.c.id,
+            table.c.id == previous.c.id,
+            _lease_allows_update(table, batch.c.runner_id, now)
+        )
+        .values(
+            status=batch.c.status,
+            lease_expires_at=None,
+            error_code=func.coalesce(batch.c.error_code, table.c.error_code),
+            error_msg=func.coalesce(batch.c.error_msg, table.c.error_msg),
+            result_payload=func.coalesce(
+                cast(batch.c.result_payload, table.c.result_payload.type), table.c.result_payload
+            ),
+            next_attempt_at=func.coalesce(next_attempt_at, table.c.next_attempt_at),
+            runner_id=_runner_after_retry(table, next_attempt_at),
+        )
+        .returning(table.c.id, previous.c.nit, previous.c.status)
+    )
+
+
+def update_status_batch(
+    session: Session,
+    items: list[dict],
+    retry_delay: Optional[RetryDelay] = None
+) -> dict[int, str]:
+    """Actualiza el estado de varias transacciones por id en una sola sentencia.
+    
+    Cada elemento trae ``id`` y ``status`` y opcionalmente ``error_code``,
+    ``error_msg``, ``result_payload``, ``runner_id`` y ``retryable``; los
+    campos ausentes o nulos conservan su valor actual, igual que en
+    ``update_status``. Si un id se repite gana el último elemento. Las
+    transacciones cuyo lease ya no es válido para el runner no se actualizan.
+    En PostgreSQL se usa ``UPDATE ... FROM (VALUES ...)`` con RETURNING; en
+    otros motores un UPDATE con executemany. Devuelve el estado final de cada
+    id actualizado, que difiere del pedido cuando un ERROR se reintenta.
+    """
+    rows = {}
+    retryable = {}
+    for item in items:
+        rows[item["id"]] = {
+            "id": item["id"],
+            "status": item["status"],
+            "error_code": item.get("error_code"),
+            "error_msg": item.get("error_msg"),
+            "result_payload": item.get("result_payload"),
+            "runner_id": item.get("runner_id"),
+            "next_attempt_at": None,
+        }
+        retryable[item["id"]] = item.get("retryable")
+    if not rows:
+        return {}
+    
+    table = Transaction.__table__
+    now = datetime.now()
+    
+    def apply_retries(attempts: dict[int, int]) -> None:
+        for transaction_id, count in attempts.items():
+            row = rows[transaction_id]
+            row["status"], row["next_attempt_at"] = _retry_outcome(
+                row["status"], count, retryable[transaction_id], retry_delay, now
+            )
+    
+    if session.get_bind().dialect.name == "postgresql":
+        errors = [
+            transaction_id for transaction_id, row in rows.items()
+            if row["status"] == TransactionStatus.ERROR.value
+        ]
+        if retry_delay is not None and errors:
+            apply_retries(dict(session.execute(
+                select(table.c.id, table.c.attempts).where(table.c.id.in_(errors))
+            ).all()))
+        
+        updated = session.execute(_batch_update_statement(rows, now)).all()
+        record_transitions(session, [
+            (nit, old_status, rows[transaction_id]["status"])
+            for transaction_id, nit, old_status in updated
+        ])
+        return {transaction_id: rows[transaction_id]["status"] for transaction_id, _, _ in updated}
+    
+    previous = [
+        row for row in session.execute(
+            select(
+                table.c.id, table.c.nit, table.c.status, table.c.runner_id,
+                table.c.lease_expires_at, table.c.attempts
+            ).where(table.c.id.in_(list(rows)))
+        ).all()
+        if _lease_conflict(row, rows[row.id]["runner_id"], now) is None
+    ]
+    existing = {row.id for row in previous}
+    if existing:
+        apply_retries({row.id: row.attempts for row in previous})
+        next_attempt_at = bindparam("b_next_attempt_at", type_=DateTime)
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                status=bindparam("b_status"),
+                lease_expires_at=None,
+                next_attempt_at=func.coalesce(next_attempt_at, table.c.next_attempt_at),
+                runner_id=_runner_after_retry(table, next_attempt_at),
+                error_code=func.coalesce(bindparam("b_error_code"), table.c.error_code),
+                error_msg=func.coalesce(bindparam("b_error_msg"), table.c.error_msg),
+                result_payload=func.coalesce(
+                    bindparam("b_result_payload", type_=table.c.result_payload.type),
+                    table.c.result_payload
+                ),
+            )
+        )
+        session.execute(stmt, [
+            {f"b_{key}": value for key, value in rows[transaction_id].items()}
+            for transaction_id in existing
+        ])
+        record_transitions(session, [
+            (row.nit, row.status, rows[row.id]["status"]) for row in previous
+        ])
+    return {transaction_id: rows[transaction_id]["status"] for transaction_id in existing}
+
+
+def find_existing_ids(session: Session, ids: list[int]) -> set[int]:
+    """Devuelve cuáles de ``ids`` existen en ``transactions``."""
+    if not ids:
+        return set()
+    return set(session.execute(
+        select(Transaction.id).where(Transaction.id.in_(ids))
+    ).scalars())
+
+
+# Órdenes de la cola de pendientes para ``fetch_next_pending``. ``next_attempt_at``
+# es la llegada de una transacción nueva o el vencimiento de su reintento
+CLAIM_ORDERS = {
+    # FIFO por (next_attempt_at, id): índice ix_transactions_pending_queue
+    "fifo": (Transaction.next_attempt_at, Transaction.id),
+    # Mayor prioridad primero y FIFO dentro de cada prioridad: ix_transactions_pending_priority
+    "priority": (Transaction.priority.desc(), Transaction.next_attempt_at, Transaction.id),
+}
+
+
+def _due(table, now: datetime):
+    """Condición de las pendientes que ya se pueden reclamar."""
+    return (table.c.status == TransactionStatus.PENDIENTE.value) & (table.c.next_attempt_at <= now)
+
+
+def _claim(session: Session, candidates: Select, runner_id: Optional[str], lease_seconds: float) -> list[Transaction]:
+    """Marca como PROCESANDO los candidatos que sigan pendientes, cuenta el intento y los devuelve."""
+    stmt = (
+        update(Transaction)
+        .where(
+            Transaction.id.in_(candidates.scalar_subquery()),
+            Transaction.status == TransactionStatus.PENDIENTE.value
+        )
+        .values(
+            status=TransactionStatus.PROCESANDO.value,
+            runner_id=runner_id,
+            lease_expires_at=datetime.now() + timedelta(seconds=lease_seconds),
+            attempts=Transaction.attempts + 1
+        )
+        .returning(Transaction)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    claimed = session.scalars(stmt).all()
+    record_transitions(session, [
+        (transaction.nit, TransactionStatus.PENDIENTE.value, transaction.status)
+        for transaction in claimed
+    ])
+    return claimed
+
+
+def fetch_next_pending(
+    session: Session,
+    runner_id: Optional[str] = None,
+    limit: int = 1,
+    lease_seconds: float = 300,
+    order: str = "fifo"
+) -> list[Transaction]:
+    """Reclama hasta ``limit`` transacciones pendientes y las marca como PROCESANDO.
+    
+    Cada transacción reclamada recibe un lease de ``lease_seconds``: si el
+    runner no la actualiza ni extiende el lease antes de que venza, el reaper
+    la devuelve a la cola.
+    
+    Solo se reclaman pendientes con ``next_attempt_at`` vencido, de modo que
+    un reintento espera su backoff. ``order`` es una clave de
+    ``CLAIM_ORDERS``; cada orden tiene un índice parcial que sirve el filtro
+    y el ORDER BY.
+    
+    Se ejecuta como un único ``UPDATE ... RETURNING`` cuyo subquery
+    selecciona los candidatos con ``FOR UPDATE SKIP LOCKED`` en PostgreSQL,
+    de modo que runners concurrentes toman filas distintas sin esperarse
+    entre sí. SQLite ignora la cláusula de bloqueo pero serializa las
+    escrituras; la condición sobre el estado en el UPDATE externo evita
+    entregar una fila dos veces. Devuelve las transacciones en el orden de
+    ``order``.
+    """
+    ordering = CLAIM_ORDERS[order]
+    candidates = (
+        select(Transaction.id)
+        .where(_due(Transaction.__table__, datetime.now()))
+        .order_by(*ordering)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = _claim(session, candidates, runner_id, lease_seconds)
+    if order == "priority":
+        return sorted(
+            claimed,
+            key=lambda transaction: (-transaction.priority, transaction.next_attempt_at, transaction.id)
+        )
+    return sorted(claimed, key=lambda transaction: (transaction.next_attempt_at, transaction.id))
+
+
+def _scan_pending_nits(session: Session, after_nit: str, max_nits: int, now: datetime) -> list:
+    """Recorre hasta ``max_nits`` NITs con pendientes vencidas posteriores a ``after_nit``.
+    
+    Es un recorrido por saltos sobre ``ix_transactions_pending_nit`` (CTE
+    recursivo, una búsqueda en el índice por NIT): el costo depende de los
+    NITs visitados y no de cuántas pendientes tenga cada uno. Devuelve
+    ``(nit, prioridad máxima pendiente, transacciones en curso)``.
+    """
+    table = Transaction.__table__
+    pending = _due(table, now)
+    
+    def next_nit(after):
+        return (
+            select(table.c.nit).where(pending, table.c.nit > after)
+            .order_by(table.c.nit).limit(1).scalar_subquery()
+        )
+    
+    nits = select(next_nit(after_nit).label("nit"), literal(1).label("depth")).cte("nits", recursive=True)
+    nits = nits.union_all(
+        select(next_nit(nits.c.nit), nits.c.depth + 1)
+        .where(nits.c.nit.is_not(None), nits.c.depth < max_nits)
+    )
+    
+    top_priority = (
+        select(func.max(table.c.priority)).where(pending, table.c.nit == nits.c.nit).scalar_subquery()
+    )
+    in_flight = (
+        select(func.count()).select_from(table)
+        .where(table.c.status == TransactionStatus.PROCESANDO.value, table.c.nit == nits.c.nit)
+        .scalar_subquery()
+    )
+    return session.execute(
+        select(nits.c.nit, top_priority.label("top_priority"), in_flight.label("in_flight")).where(nits.c.nit.is_not(None)).order_by(nits.c.depth)
+    ).all()
+
+
+def fetch_next_pending_fair(
+    session: Session,
+    runner_id: Optional[str] = None,
+    limit: int = 1,
+    lease_seconds: float = 300,
+    after_nit: str = "",
+    max_in_flight_per_nit: int = 0,
+    max_nits: int = 64
+) -> tuple[list[Transaction], str]:
+    """Reclama pendientes repartiendo por turnos entre NITs (round-robin ponderado).
+    
+    Visita en orden los NITs con pendientes a partir de ``after_nit`` (y da
+    la vuelta al llegar al final), hasta ``max_nits`` por llamada. En cada
+    ronda un NIT recibe hasta ``1 + prioridad`` transacciones, según la
+    mayor prioridad que tenga pendiente, sin superar
+    ``max_in_flight_per_nit`` transacciones en PROCESANDO (0 = sin límite).
+    Dentro de cada NIT se toma primero la mayor prioridad y luego la que
+    vence antes. Un NIT con miles de pendientes recibe así el mismo turno que
+    uno con una sola.
+    
+    El límite por NIT se evalúa antes del reclamo: runners concurrentes
+    pueden excederlo en, como mucho, una ronda cada uno. Devuelve las
+    transacciones reclamadas y el NIT desde el que debe continuar el
+    siguiente reclamo.
+    """
+    now = datetime.now()
+    scanned = _scan_pending_nits(session, after_nit, max_nits, now)
+    if len(scanned) < max_nits and after_nit:
+        seen = {row.nit for row in scanned}
+        scanned += [
+            row for row in _scan_pending_nits(session, "", max_nits - len(scanned), now)
+            if row.nit not in seen and row.nit <= after_nit
+        ]
+    if not scanned:
+        return [], after_nit
+    
+    # Reparto por rondas en el orden del recorrido
+    slots = {
+        row.nit: max_in_flight_per_nit - row.in_flight if max_in_flight_per_nit > 0 else limit
+        for row in scanned
+    }
+    allocation: dict[str, int] = {}
+    remaining = limit
+    next_after = scanned[-1].nit
+    while remaining > 0:
+        assigned = False
+        for row in scanned:
+            share = min(1 + max(row.top_priority or 0, 0), slots[row.nit], remaining)
+            if share <= 0:
+                continue
+            allocation[row.nit] = allocation.get(row.nit, 0) + share
+            slots[row.nit] -= share
+            remaining -= share
+            next_after = row.nit
+            assigned = True
+            if remaining == 0:
+                break
+        if not assigned:
+            break
+    if not allocation:
+        return [], next_after
+    
+    table = Transaction.__table__
+    heads = [
+        select(table.c.id)
+        .where(_due(table, now), table.c.nit == nit)
+        .order_by(table.c.priority.desc(), table.c.next_attempt_at, table.c.id)
+        .limit(count)
+        .with_for_update(skip_locked=True)
+        .subquery()
+        for nit, count in allocation.items()
+    ]
+    candidates = union_all(*[select(head.c.id) for head in heads]).subquery("candidates")
+    claimed = _claim(session, select(candidates.c.id), runner_id, lease_seconds)
+    order = {nit: position for position, nit in enumerate(allocation)}
+    return sorted(
+        claimed,
+        key=lambda transaction: (order[transaction.nit], -transaction.priority, transaction.next_attempt_at, transaction.id)
+    ), next_after
+
+
+def extend_lease(
+    session: Session,
+    transaction_id: int,
+    runner_id: Optional[str],
+    lease_seconds: float
+) -> Optional[datetime]:
+    """Extiende el lease vigente de una transacción PROCESANDO (heartbeat).
+    
+    Es un único UPDATE sin cargar la fila ni tocar ``updated_at``. Devuelve
+    la nueva expiración, o None si la transacción no está en PROCESANDO, su
+    lease ya venció o pertenece a otro runner.
+    """
+    now = datetime.now()
+    table = Transaction.__table__
+    return session.execute(
+        update(table)
+        .where(
+            table.c.id == transaction_id,
+            table.c.status == TransactionStatus.PROCESANDO.value,
+            _lease_allows_update(table, bindparam("b_runner_id", runner_id, type_=String), now)
+        )
+        .values(
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            updated_at=table.c.updated_at
+        )
+        .returning(table.c.lease_expires_at)
+    ).scalar()
+
+
+def requeue_expired_leases(
+    session: Session,
+    limit: int,
+    max_attempts: int = 0
+) -> list[tuple[int, str, str]]:
+    """Devuelve a PENDIENTE hasta ``limit`` transacciones PROCESANDO con el lease vencido.
+    
+    Un único ``UPDATE ... RETURNING`` servido por el índice parcial
+    ``ix_transactions_processing_lease``; los candidatos se toman con
+    ``FOR UPDATE SKIP LOCKED`` para no esperar a runners que estén
+    actualizando esas filas. Con ``max_attempts`` mayor que 0, las que ya
+    agotaron sus intentos (p. ej. las que tumban al runner) pasan a FALLIDO.
+    Devuelve ``(id, nit, estado)`` de las reencoladas.
+    """
+    now = datetime.now()
+    expired = (
+        Transaction.status == TransactionStatus.PROCESANDO.value,
+        Transaction.lease_expires_at < now
+    )
+    candidates = (
+        select(Transaction.id)
+        .where(*expired)
+        .order_by(Transaction.lease_expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    status = TransactionStatus.PENDIENTE.value
+    if max_attempts > 0:
+        status = case(
+            (Transaction.attempts >= max_attempts, TransactionStatus.FALLIDO.value),
+            else_=TransactionStatus.PENDIENTE.value
+        )
+    requeued = session.execute(
+        update(Transaction.__table__)
+        .where(Transaction.id.in_(candidates.scalar_subquery()), *expired)
+        .values(status=status, runner_id=None, lease_expires_at=None)
+        .returning(Transaction.id, Transaction.nit, Transaction.status)
+    ).all()
+    if requeued:
+        record_transitions(session, [
+            (nit, TransactionStatus.PROCESANDO.value, new_status)
+            for _, nit, new_status in requeued
+        ])
+        notify_new_work(session)
+    return requeued
+
+
+def listing_query(
+    *,
+    nit: Optional[str] = None,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    after: Optional[tuple[datetime, int]] = None,
+    include_archived: bool = False
+) -> Select:
+    """Construye el SELECT del listado de transacciones en orden ``(created_at, id)``.
+    
+    ``after`` es el cursor de la página anterior: solo se devuelven filas
+    posteriores a esa pareja ``(created_at, id)`` (paginación por keyset, sin
+    OFFSET). Con ``include_archived`` se incluye ``transactions_archive``
+    mediante UNION ALL. Devuelve filas con las columnas de ``transactions``.
+    """
+    def filtered(table):
+        query = select(*[table.c[name] for name in Transaction.__table__.c.keys()])
+        if nit is not None:
+            query = query.where(table.c.nit == nit)
+        if status is not None:
+            query = query.where(table.c.status == status)
+        if created_from is not None:
+            query = query.where(table.c.created_at >= created_from)
+        if created_to is not None:
+            query = query.where(table.c.created_at < created_to)
+        if after is not None:
+            query = query.where(tuple_(table.c.created_at, table.c.id) > tuple_(*after))
+        return query
+    
+    if not include_archived:
+        table = Transaction.__table__
+        return filtered(table).order_by(table.c.created_at, table.c.id)
+    
+    combined = union_all(
+        filtered(Transaction.__table__), filtered(TransactionArchive.__table__)
+    ).subquery("transactions_all")
+    return select(combined).order_by(combined.c.created_at, combined.c.id)
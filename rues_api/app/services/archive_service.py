@@ -0,0 +1,70 @@
+"""Archivado de transacciones finalizadas."""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from flask import Flask
+
+import app.db.session as db_session
+from app.core.config import Config
+from app.core.periodic import PeriodicTask
+from app.repositories import archive_repo
+
+logger = logging.getLogger(__name__)
+
+
+def archive_finished_transactions(
+    older_than: timedelta,
+    chunk_size: int,
+    max_chunks: Optional[int] = None,
+    pause_seconds: float = 0.0
+) -> int:
+    """Mueve a ``transactions_archive`` las transacciones finalizadas hace más de ``older_than``.
+    
+    Cada bloque de ``chunk_size`` filas se mueve y confirma en su propia
+    transacción corta, con una pausa opcional entre bloques para no
+    acaparar la base de datos. Devuelve cuántas transacciones archivó.
+    """
+    # updated_at sale del reloj de la aplicación: el corte se toma del mismo
+    cutoff = datetime.now() - older_than
+    moved = 0
+    after = None
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        session = db_session.SessionLocal()
+        try:
+            ids, after = archive_repo.archive_chunk(session, cutoff, chunk_size, after)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        
+        if not ids:
+            break
+        moved += len(ids)
+        chunks += 1
+        if pause_seconds > 0:
+            time.sleep(pause_seconds)
+    return moved
+
+
+def _archive_periodically() -> None:
+    moved = archive_finished_transactions(
+        timedelta(days=Config.ARCHIVE_AFTER_DAYS),
+        Config.ARCHIVE_CHUNK_SIZE,
+        pause_seconds=Config.ARCHIVE_CHUNK_PAUSE_SECONDS
+    )
+    if moved:
+        logger.info("%d transacciones archivadas", moved)
+
+
+_archiver = PeriodicTask("rues-archiver", Config.ARCHIVE_INTERVAL_SECONDS, _archive_periodically)
+
+
+def init_app(app: Flask) -> None:
+    """Arranca el archivado periódico con la primera petición si está habilitado."""
+    if Config.ARCHIVE_INTERVAL_SECONDS > 0:
+        app.before_request(_archiver.ensure_started)
@@ -0,0 +1,206 @@
+"""Log de auditoría de transacciones con escritura asíncrona por lotes."""
+import atexit
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import app.db.session as db_session
+from app.core.config import Config
+from app.db.session import on_commit
+from app.repositories.audit_repo import insert_audit_logs
+
+logger = logging.getLogger(__name__)
+
+# Valor de ``AuditLog.entity`` para los eventos de transacciones
+TRANSACTION_ENTITY = "transaction"
+
+
+class AuditWriter:
+    """Cola en memoria que vuelca eventos a ``audit_logs`` desde un hilo.
+    
+    Los eventos se insertan en bloque cuando se acumulan ``batch_size`` o cada
+    ``flush_interval_seconds``, con una sesión propia fuera de la petición. La
+    cola está acotada a ``max_queue`` eventos: si se llena, quien encola espera
+    hasta ``enqueue_timeout_seconds`` y después descarta el evento, que queda
+    contado en ``dropped``.
+    """
+    
+    def __init__(
+        self,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_queue: int,
+        enqueue_timeout_seconds: float
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.enqueue_timeout_seconds = enqueue_timeout_seconds
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+    
+    def record(self, events: list[dict]) -> None:
+        """Encola eventos para escribirlos en el siguiente lote.
+        
+        Con la cola llena espera una sola vez por llamada: tras el primer
+        descarte el resto de ``events`` se descarta sin esperar.
+        """
+        self._ensure_thread()
+        timeout = self.enqueue_timeout_seconds
+        dropped = 0
+        for event in events:
+            try:
+                self._queue.put(event, timeout=timeout)
+            except queue.Full:
+                if not dropped:
+                    self._wakeup.set()
+                dropped += 1
+                timeout = 0
+        
+        if dropped:
+            with self._lock:
+                self.dropped += dropped
+                total = self.dropped
+            logger.warning(
+                "Cola de auditoría llena: %d eventos descartados (%d en total)", dropped, total
+            )
+        
+        if self._stopped.is_set():
+            # Tras close() ya no hay hilo que vacíe la cola
+            self.flush()
+        elif self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+    
+    def flush(self) -> int:
+        """Escribe de inmediato los eventos encolados; devuelve cuántos escribió."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return written
+                written += self._write(batch)
+    
+    def close(self) -> None:
+        """Detiene el hilo y escribe lo pendiente; se llama al terminar el proceso."""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval_seconds + 5)
+        self.flush()
+    
+    def stats(self) -> dict:
+        """Devuelve el tamaño de la cola y los contadores de eventos."""
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+    
+    def _write(self, batch: list[dict]) -> int:
+        session = db_session.SessionLocal()
+        try:
+            insert_audit_logs(session, batch)
+            session.commit()
+        except Exception:
+            session.rollback()
+            with self._lock:
+                self.failed += len(batch)
+            logger.exception("Error escribiendo %d eventos de auditoría", len(batch))
+            return 0
+        finally:
+            session.close()
+        with self._lock:
+            self.written += len(batch)
+        return len(batch)
+    
+    def _ensure_thread(self) -> None:
+        # El hilo se inicia en el primer uso, después de cualquier fork
+        with self._lock:
+            if self._stopped.is_set():
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="rues-audit-writer", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error en el escritor de auditoría")
+
+
+_writer: Optional[AuditWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer() -> AuditWriter:
+    """Devuelve el escritor de auditoría del proceso, creándolo en el primer uso."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(
+                Config.AUDIT_BATCH_SIZE,
+                Config.AUDIT_FLUSH_INTERVAL_SECONDS,
+                Config.AUDIT_QUEUE_MAX,
+                Config.AUDIT_ENQUEUE_TIMEOUT_SECONDS
+            )
+        return _writer
+
+
+def shutdown_audit_writer() -> None:
+    """Escribe los eventos pendientes y descarta el escritor actual."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(shutdown_audit_writer)
+
+
+def transition_event(transaction_id: int, status: str, **detail) -> dict:
+    """Construye el evento de auditoría de un cambio de estado de una transacción.
+    
+    Los campos de ``detail`` con valor None se omiten.
+    """
+    detail = {key: value for key, value in detail.items() if value is not None}
+    return {
+        "entity": TRANSACTION_ENTITY,
+        "entity_id": transaction_id,
+        "action": status,
+        "detail": json.dumps(detail) if detail else None,
+        "created_at": datetime.now(),
+    }
+
+
+def record_on_commit(session: Session, events: list[dict]) -> None:
+    """Encola ``events`` solo si la transacción actual de ``session`` hace commit."""
+    if Config.AUDIT_ENABLED and events:
+        on_commit(session, lambda: get_audit_writer().record(events))
@@ -0,0 +1,62 @@
+"""Reaper de leases vencidos de transacciones PROCESANDO."""
+import logging
+
+from flask import Flask
+
+import app.db.session as db_session
+from app.core.config import Config
+from app.core.periodic import PeriodicTask
+from app.db.notifier import get_notifier
+from app.db.session import on_commit
+from app.repositories import transactions_repo
+from app.services.audit import record_on_commit, transition_event
+from app.services.transactions_service import invalidate_statuses
+
+logger = logging.getLogger(__name__)
+
+
+def reap_expired_leases() -> int:
+    """Devuelve a la cola las transacciones cuyo runner dejó vencer el lease.
+    
+    Trabaja por bloques de ``LEASE_REAPER_BATCH_SIZE``, cada uno en su propia
+    transacción corta. Devuelve cuántas transacciones reencoló.
+    """
+    requeued_total = 0
+    while True:
+        session = db_session.SessionLocal()
+        try:
+            requeued = transactions_repo.requeue_expired_leases(
+                session, Config.LEASE_REAPER_BATCH_SIZE, max_attempts=Config.RETRY_MAX_ATTEMPTS
+            )
+            if requeued:
+                on_commit(session, get_notifier().notify)
+                on_commit(session, lambda: invalidate_statuses(
+                    transaction_id for transaction_id, _, _ in requeued
+                ))
+                record_on_commit(session, [
+                    transition_event(transaction_id, status, reason="lease_expired")
+                    for transaction_id, _, status in requeued
+                ])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        
+        requeued_total += len(requeued)
+        if len(requeued) < Config.LEASE_REAPER_BATCH_SIZE:
+            break
+    
+    if requeued_total:
+        logger.warning("%d transacciones con lease vencido devueltas a la cola", requeued_total)
+    return requeued_total
+
+
+_reaper = PeriodicTask("rues-lease-reaper", Config.LEASE_REAPER_INTERVAL_SECONDS, reap_expired_leases)
+
+
+def init_app(app: Flask) -> None:
+    """Arranca el reaper periódico con la primera petición si está habilitado."""
+    if Config.LEASE_REAPER_INTERVAL_SECONDS > 0:
+        app.before_request(_reaper.ensure_started)
@@ -0,0 +1,109 @@
+"""Serialización de modelos a diccionarios JSON."""
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from app.db.payload_codec import payload_value
+from app.models.models import AuditLog, Transaction
+
+# Columnas de la exportación CSV, en orden
+EXPORT_CSV_COLUMNS = (
+    "id", "company_id", "nit", "status", "priority", "attempts", "next_attempt_at",
+    "error_code", "error_msg", "runner_id", "idempotency_key", "created_at", "updated_at",
+    "payload_in", "result_payload",
+)
+
+# Tamaño aproximado de cada fragmento de una respuesta en streaming
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def serialize_transaction(transaction: Transaction) -> dict:
+    """Convierte una transacción en el diccionario que devuelve la API.
+    
+    Solo lee atributos ya cargados: con ``expire_on_commit=False`` y
+    ``eager_defaults`` no dispara consultas adicionales.
+    """
+    return {
+        "id": transaction.id,
+        "company_id": transaction.company_id,
+        "nit": transaction.nit,
+        "status": transaction.status,
+        "priority": transaction.priority,
+        "attempts": transaction.attempts,
+        "next_attempt_at": transaction.next_attempt_at.isoformat() if transaction.next_attempt_at else None,
+        "payload_in": payload_value(transaction.payload_in),
+        "result_payload": payload_value(transaction.result_payload),
+        "error_code": transaction.error_code,
+        "error_msg": transaction.error_msg,
+        "runner_id": transaction.runner_id,
+        "lease_expires_at": transaction.lease_expires_at.isoformat() if transaction.lease_expires_at else None,
+        "idempotency_key": transaction.idempotency_key,
+        "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
+        "updated_at": transaction.updated_at.isoformat() if transaction.updated_at else None,
+    }
+
+
+def transaction_etag(
+    transaction_id: int,
+    updated_at: Optional[datetime],
+    lease_expires_at: Optional[datetime]
+) -> str:
+    """ETag de una transacción a partir de su versión.
+    
+    ``updated_at`` cambia con cada cambio de estado; se incluye el lease
+    porque el heartbeat lo extiende sin tocar ``updated_at``.
+    """
+    version = f"{transaction_id}|{updated_at.isoformat() if updated_at else ''}|{lease_expires_at.isoformat() if lease_expires_at else ''}"
+    return hashlib.blake2b(version.encode(), digest_size=8).hexdigest()
+
+
+def serialize_audit_log(audit_log: AuditLog) -> dict:
+    """Convierte un evento de auditoría en el diccionario que devuelve la API."""
+    return {
+        "id": audit_log.id,
+        "action": audit_log.action,
+        "detail": json.loads(audit_log.detail) if audit_log.detail else None,
+        "created_at": audit_log.created_at.isoformat() if audit_log.created_at else None,
+    }
+
+
+def ndjson_chunks(items: Iterable[dict]) -> Iterator[str]:
+    """Convierte diccionarios en fragmentos NDJSON (un objeto JSON por línea)."""
+    buffer = []
+    size = 0
+    for item in items:
+        line = json.dumps(item, ensure_ascii=False) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def csv_chunks(items: Iterable[dict]) -> Iterator[str]:
+    """Convierte transacciones serializadas en fragmentos CSV con encabezado.
+    
+    Los payloads se escriben como texto JSON.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for item in items:
+        writer.writerow([
+            json.dumps(item[column], ensure_ascii=False)
+            if column in ("payload_in", "result_payload") and item[column] is not None
+            else item[column]
+            for column in EXPORT_CSV_COLUMNS
+        ])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,108 @@
+"""Estadísticas de transacciones por estado."""
+import logging
+from typing import Optional
+
+from flask import Flask
+from sqlalchemy import text
+
+import app.db.session as db_session
+from app.core.config import Config
+from app.core.periodic import PeriodicTask
+from app.db.session import get_session
+from app.models.models import TransactionStatus
+from app.repositories import stats_repo
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock que evita reconciliaciones simultáneas en PostgreSQL
+RECONCILE_LOCK_KEY = 7_301_001
+
+
+def get_stats(nit: Optional[str] = None) -> dict:
+    """Devuelve el número de transacciones por estado, en total o de un NIT.
+    
+    Se lee de los contadores incrementales, con costo constante. El desglose
+    por NIT usa sus propios contadores con ``STATS_PER_NIT``; si no están
+    habilitados se cuenta con el índice de ``nit``.
+    """
+    session = get_session()
+    if nit is None:
+        counts = stats_repo.get_counters(session)
+    elif Config.STATS_PER_NIT:
+        counts = stats_repo.get_counters(session, nit)
+    else:
+        counts = stats_repo.count_by_status(session, nit)
+    
+    by_status = {status.value: counts.get(status.value, 0) for status in TransactionStatus}
+    return {"nit": nit, "counts": by_status, "total": sum(by_status.values())}
+
+
+def queue_depth() -> dict[str, int]:
+    """Devuelve los contadores por estado con una sesión propia (para ``/metrics``)."""
+    session = db_session.SessionLocal()
+    try:
+        counts = stats_repo.get_counters(session)
+    finally:
+        session.close()
+    return {status.value: counts.get(status.value, 0) for status in TransactionStatus}
+
+
+def reconcile_counters() -> dict[str, int]:
+    """Corrige los contadores contando ``transactions``; devuelve la corrección por estado.
+    
+    El conteo y la lectura de los contadores se hacen en la misma foto (en
+    PostgreSQL, una transacción REPEATABLE READ): cada cambio de estado
+    actualiza su fila y su contador en la misma transacción, así que ambos
+    corresponden al mismo instante sin bloquear a nadie. La diferencia se
+    suma como delta en el shard reservado a la reconciliación, que ningún
+    cambio de estado escribe; lo que se confirme después de la foto trae su
+    propio incremento. Si otra reconciliación está en curso no hace nada.
+    """
+    session = db_session.SessionLocal()
+    try:
+        if session.get_bind().dialect.name == "postgresql":
+            session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            acquired = session.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": RECONCILE_LOCK_KEY}
+            ).scalar()
+            if not acquired:
+                return {}
+        
+        counters = stats_repo.get_all_counters(session)
+        actual = {
+            (stats_repo.ALL_NITS, status): count
+            for status, count in stats_repo.count_by_status(session).items()
+        }
+        if Config.STATS_PER_NIT:
+            actual.update(stats_repo.count_by_nit_and_status(session))
+        else:
+            # Sin contadores por NIT solo se corrigen los totales
+            counters = {key: count for key, count in counters.items() if key[0] == stats_repo.ALL_NITS}
+        deltas = {
+            key: actual.get(key, 0) - counters.get(key, 0)
+            for key in set(actual) | set(counters)
+            if actual.get(key, 0) != counters.get(key, 0)
+        }
+        stats_repo.add_to_counters(session, deltas, stats_repo.RECONCILE_SHARD)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    
+    drift = {status: delta for (nit, status), delta in deltas.items() if nit == stats_repo.ALL_NITS}
+    if drift:
+        logger.warning("Contadores de transacciones corregidos: %s", drift)
+    return drift
+
+
+_reconciler = PeriodicTask(
+    "rues-stats-reconciler", Config.STATS_RECONCILE_INTERVAL_SECONDS, reconcile_counters
+)
+
+
+def init_app(app: Flask) -> None:
+    """Arranca la reconciliación periódica con la primera petición si está habilitada."""
+    if Config.STATS_RECONCILE_INTERVAL_SECONDS > 0:
+        app.before_request(_reconciler.ensure_started)
@@ -1,103 +1,477 @@
 """Servicio de transacciones."""
-from typing import Optional
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, Optional
 
-from app.db.session import SessionLocal
-from app.repositories import transactions_repo
-from app.repositories.companies_repo import get_or_create_company
+from sqlalchemy.exc import IntegrityError
+
+from app.core.cache import TTLCache
+from app.core.config import Config
+from app.core.metrics import registry as metrics
+import app.db.session as db_session
+from app.db.notifier import get_notifier
+from app.db.session import get_session, on_commit
+from app.models.models import Transaction
+from app.repositories import archive_repo, audit_repo, transactions_repo
+from app.repositories.companies_repo import get_or_create_company_id, upsert_companies
+from app.services.audit import (
+    TRANSACTION_ENTITY,
+    get_audit_writer,
+    record_on_commit,
+    transition_event,
+)
+from app.services.serializers import (
+    serialize_audit_log,
+    serialize_transaction,
+    transaction_etag,
+)
+
+# (hash del cuerpo, respuesta) recientes por (cliente, Idempotency-Key) para
+# reintentos en caliente
+_replays = TTLCache(Config.IDEMPOTENCY_CACHE_SIZE, Config.IDEMPOTENCY_CACHE_TTL_SECONDS)
+
+
+# NIT desde el que sigue el próximo reclamo en modo "fair"; cada proceso
+# lleva su propio turno. El lock solo cubre leer y avanzar el turno, nunca
+# la consulta: el reclamo guarda su siguiente NIT únicamente si nadie movió
+# el turno mientras tanto (compare-and-set)
+_fair_after_nit = ""
+_fair_cursor_lock = threading.Lock()
+
+# Peticiones de /next?wait esperando trabajo en este proceso. Cada una ocupa
+# un hilo del servidor; con NEXT_MAX_WAITERS las que exceden el límite no
+# esperan, para dejar hilos libres al resto de peticiones
+_waiters = 0
+_waiters_lock = threading.Lock()
+
+# (ETag, transacción serializada) por id para las consultas de estado
+_statuses = TTLCache(Config.STATUS_CACHE_SIZE, Config.STATUS_CACHE_TTL_SECONDS)
+
+
+class IdempotencyKeyMismatchError(Exception):
+    """La Idempotency-Key ya se usó con un cuerpo distinto."""
+
+
+def _start_waiting() -> bool:
+    """Reserva un lugar de long-polling; False si ya se alcanzó ``NEXT_MAX_WAITERS``."""
+    global _waiters
+    with _waiters_lock:
+        if 0 < Config.NEXT_MAX_WAITERS <= _waiters:
+            return False
+        _waiters += 1
+        return True
+
+
+def _stop_waiting() -> None:
+    global _waiters
+    with _waiters_lock:
+        _waiters -= 1
+
+
+def request_hash(payload: dict) -> str:
+    """SHA-256 del cuerpo de process-data, independiente del orden de las claves."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _check_replay(stored_hash: Optional[str], payload_hash: str) -> None:
+    # Las transacciones creadas antes de guardar el hash no se pueden comparar
+    if stored_hash is not None and stored_hash != payload_hash:
+        raise IdempotencyKeyMismatchError(
+            "La Idempotency-Key ya se usó con un cuerpo distinto"
+        )
+
+
+def retry_delay(attempts: int) -> Optional[timedelta]:
+    """Espera antes del siguiente intento tras ``attempts`` intentos, o None si se agotaron.
+    
+    Backoff exponencial desde ``RETRY_BACKOFF_BASE_SECONDS`` con tope en
+    ``RETRY_BACKOFF_MAX_SECONDS``; ``RETRY_JITTER`` recorta al azar hasta esa
+    fracción para que los fallos simultáneos no se reintenten a la vez.
+    """
+    if attempts >= Config.RETRY_MAX_ATTEMPTS:
+        return None
+    exponent = min(max(attempts - 1, 0), 32)
+    delay = min(Config.RETRY_BACKOFF_MAX_SECONDS, Config.RETRY_BACKOFF_BASE_SECONDS * 2 ** exponent)
+    return timedelta(seconds=delay * (1 - Config.RETRY_JITTER * random.random()))
+
+
+def _retry_policy() -> Optional[Callable[[int], Optional[timedelta]]]:
+    """Política de reintentos para el repositorio, o None si están desactivados."""
+    return retry_delay if Config.RETRY_MAX_ATTEMPTS > 0 else None
+
+
+def clear_replay_cache() -> None:
+    """Vacía la caché de respuestas idempotentes."""
+    _replays.clear()
+
+
+def clear_status_cache() -> None:
+    """Vacía la caché de consultas de estado."""
+    _statuses.clear()
+
+
+def invalidate_statuses(transaction_ids: Iterable[int]) -> None:
+    """Descarta de la caché de este proceso el estado de las transacciones modificadas."""
+    for transaction_id in transaction_ids:
+        _statuses.pop(transaction_id)
 
 
 class TransactionsService:
-    """Servicio para gestionar transacciones."""
+    """Servicio para gestionar transacciones.
+    
+    Trabaja sobre la sesión de la petición actual; el commit lo hace el
+    ciclo de vida de la petición (ver ``app.db.session``).
+    """
     
-    def create_transaction(self, payload: dict, idempotency_key: Optional[str] = None) -> dict:
-        """Crea una nueva transacción."""
-        session = SessionLocal()
+    def create_transaction(
+        self,
+        payload: dict,
+        idempotency_key: Optional[str] = None,
+        client_id: Optional[str] = None
+    ) -> tuple[dict, bool]:
+        """Crea una nueva transacción.
+        
+        Con ``idempotency_key`` un reintento del mismo cliente con el mismo
+        cuerpo no crea otra transacción: devuelve la original, aunque ya esté
+        archivada, y ``True`` como segundo valor. Si el cuerpo difiere lanza
+        ``IdempotencyKeyMismatchError``.
+        """
+        replay_key = (client_id, idempotency_key)
+        payload_hash = request_hash(payload) if idempotency_key is not None else None
+        if idempotency_key is not None:
+            cached = _replays.get(replay_key)
+            if cached is not None:
+                _check_replay(cached[0], payload_hash)
+                return cached[1], True
+        
+        session = get_session()
+        if idempotency_key is not None:
+            existing = transactions_repo.find_by_idempotency_key(
+                session, client_id, idempotency_key
+            ) or archive_repo.find_by_idempotency_key(session, client_id, idempotency_key)
+            if existing is not None:
+                _check_replay(existing.request_hash, payload_hash)
+                return self._remember_replay(replay_key, existing), True
+        
+        # Crear u obtener la empresa
+        company_id = get_or_create_company_id(
+            session, payload["nit"], payload.get("name")
+        )
+        
+        # Crear la transacción
         try:
-            # Crear o obtener la empresa
-            company = get_or_create_company(
-                session, payload["nit"], payload.get("name")
-            )
-            
-            # Crear la transacción
             transaction = transactions_repo.create_transaction(
-                session, payload, idempotency_key
+                session, payload, idempotency_key, client_id, company_id, payload_hash
             )
-            
-            # Asignar company_id
-            transaction.company_id = company.id
-            session.commit()
-            
-            return {
-                "id": transaction.id,
-                "company_id": transaction.company_id,
-                "nit": transaction.nit,
-                "status": transaction.status,
-                "payload_in": transaction.payload_in,
-                "result_payload": transaction.result_payload,
-                "error_code": transaction.error_code,
-                "error_msg": transaction.error_msg,
-                "runner_id": transaction.runner_id,
-                "idempotency_key": transaction.idempotency_key,
-                "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
-                "updated_at": transaction.updated_at.isoformat() if transaction.updated_at else None,
-            }
-        finally:
-            session.close()
+        except IntegrityError:
+            # Otra petición concurrente con la misma key ganó la carrera
+            if idempotency_key is None:
+                raise
+            session.rollback()
+            existing = transactions_repo.find_by_idempotency_key(
+                session, client_id, idempotency_key
+            )
+            if existing is None:
+                raise
+            _check_replay(existing.request_hash, payload_hash)
+            return self._remember_replay(replay_key, existing), True
+        
+        result = serialize_transaction(transaction)
+        
+        # Despertar a los runners en long-polling de este proceso
+        on_commit(session, get_notifier().notify)
+        on_commit(session, lambda: metrics.inc("rues_transactions_created_total"))
+        record_on_commit(session, [transition_event(transaction.id, transaction.status)])
+        if idempotency_key is not None:
+            on_commit(session, lambda: _replays.set(replay_key, (payload_hash, result)))
+        
+        return result, False
+    
+    def _remember_replay(self, replay_key: tuple, transaction) -> dict:
+        """Serializa la transacción original de un reintento y la guarda en caché."""
+        result = serialize_transaction(transaction)
+        _replays.set(replay_key, (transaction.request_hash, result))
+        return result
+    
+    def create_transactions_batch(self, payloads: list[dict]) -> list[dict]:
+        """Crea transacciones en bloque en la unidad de trabajo de la petición."""
+        session = get_session()
+        
+        # Una sola operación set-based para todas las empresas distintas
+        companies = {}
+        for payload in payloads:
+            if companies.get(payload["nit"]) is None:
+                companies[payload["nit"]] = payload.get("name")
+        company_ids = upsert_companies(session, companies)
+        
+        transactions = transactions_repo.create_transactions(
+            session,
+            [
+                {"payload": payload, "company_id": company_ids[payload["nit"]]}
+                for payload in payloads
+            ]
+        )
+        
+        if transactions:
+            on_commit(session, get_notifier().notify)
+            on_commit(session, lambda: metrics.inc("rues_transactions_created_total", amount=len(transactions)))
+            record_on_commit(session, [
+                transition_event(transaction.id, transaction.status)
+                for transaction in transactions
+            ])
+        return [serialize_transaction(transaction) for transaction in transactions]
     
     def update_status(self, selector: dict, data: dict) -> dict:
         """Actualiza el estado de una transacción."""
-        session = SessionLocal()
-        try:
-            transaction = transactions_repo.update_status(
+        session = get_session()
+        transaction = transactions_repo.update_status(
+            session,
+            id=selector.get("id"),
+            nit=selector.get("nit"),
+            status=data["status"],
+            error_code=data.get("error_code"),
+            error_msg=data.get("error_msg"),
+            result_payload=data.get("result_payload"),
+            runner_id=data.get("runner_id"),
+            retryable=data.get("retryable"),
+            retry_delay=_retry_policy()
+        )
+        record_on_commit(session, [transition_event(
+            transaction.id, transaction.status, error_code=data.get("error_code")
+        )])
+        on_commit(session, lambda: invalidate_statuses([transaction.id]))
+        self._notify_freed_slots(session)
+        return serialize_transaction(transaction)
+    
+    def update_status_batch(self, items: list[dict]) -> tuple[dict[int, str], set[int]]:
+        """Actualiza en bloque el estado de transacciones.
+        
+        Devuelve el estado final de cada id actualizado y los ids existentes
+        que se rechazaron porque el lease del runner ya no era válido.
+        """
+        session = get_session()
+        updated = transactions_repo.update_status_batch(session, items, retry_delay=_retry_policy())
+        rejected_ids = transactions_repo.find_existing_ids(
+            session, list({item["id"] for item in items} - updated.keys())
+        )
+        
+        # Si un id se repite gana el último elemento, igual que en el repositorio
+        latest = {item["id"]: item for item in items if item["id"] in updated}
+        record_on_commit(session, [
+            transition_event(item["id"], updated[item["id"]], error_code=item.get("error_code"))
+            for item in latest.values()
+        ])
+        on_commit(session, lambda: invalidate_statuses(updated))
+        if updated:
+            self._notify_freed_slots(session)
+        return updated, rejected_ids
+    
+    def _notify_freed_slots(self, session) -> None:
+        """Con límite por NIT, despierta a los runners en espera: terminar libera cupo."""
+        if Config.CLAIM_SCHEDULING == "fair" and Config.CLAIM_MAX_IN_FLIGHT_PER_NIT > 0:
+            transactions_repo.notify_new_work(session)
+            on_commit(session, get_notifier().notify)
+    
+    def _claim_pending(self, session, runner_id: Optional[str], limit: int) -> list[Transaction]:
+        """Reclama pendientes según ``CLAIM_SCHEDULING`` (fifo, priority o fair)."""
+        global _fair_after_nit
+        if Config.CLAIM_SCHEDULING == "fair":
+            with _fair_cursor_lock:
+                after_nit = _fair_after_nit
+            transactions, next_after = transactions_repo.fetch_next_pending_fair(
                 session,
-                id=selector.get("id"),
-                nit=selector.get("nit"),
-                status=data["status"],
-                error_code=data.get("error_code"),
-                error_msg=data.get("error_msg"),
-                result_payload=data.get("result_payload")
+                runner_id=runner_id,
+                limit=limit,
+                lease_seconds=Config.LEASE_SECONDS,
+                after_nit=after_nit,
+                max_in_flight_per_nit=Config.CLAIM_MAX_IN_FLIGHT_PER_NIT,
+                max_nits=Config.CLAIM_FAIR_MAX_NITS
             )
-            session.commit()
-            
-            return {
-                "id": transaction.id,
-                "company_id": transaction.company_id,
-                "nit": transaction.nit,
-                "status": transaction.status,
-                "payload_in": transaction.payload_in,
-                "result_payload": transaction.result_payload,
-                "error_code": transaction.error_code,
-                "error_msg": transaction.error_msg,
-                "runner_id": transaction.runner_id,
-                "idempotency_key": transaction.idempotency_key,
-                "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
-                "updated_at": transaction.updated_at.isoformat() if transaction.updated_at else None,
-            }
-        finally:
-            session.close()
+            # Si otro hilo ya avanzó el turno se conserva el suyo, más reciente
+            with _fair_cursor_lock:
+                if _fair_after_nit == after_nit:
+                    _fair_after_nit = next_after
+            return transactions
+        return transactions_repo.fetch_next_pending(
+            session,
+            runner_id=runner_id,
+            limit=limit,
+            lease_seconds=Config.LEASE_SECONDS,
+            order=Config.CLAIM_SCHEDULING
+        )
     
-    def fetch_next_pending(self) -> Optional[dict]:
-        """Obtiene la siguiente transacción pendiente."""
-        session = SessionLocal()
+    def fetch_next_pending(
+        self,
+        runner_id: Optional[str] = None,
+        limit: int = 1,
+        wait: float = 0.0
+    ) -> list[dict]:
+        """Reclama hasta ``limit`` transacciones pendientes para un runner.
+        
+        Si la cola está vacía y ``wait`` es positivo, espera hasta ``wait``
+        segundos a que llegue trabajo sin consultar la base de datos. Si ya
+        hay ``NEXT_MAX_WAITERS`` peticiones esperando en el proceso, responde
+        de inmediato como con ``wait=0``.
+        """
+        waiting = wait > 0 and _start_waiting()
+        if not waiting:
+            if wait > 0:
+                metrics.inc("rues_long_poll_rejected_total")
+            wait = 0.0
         try:
-            transaction = transactions_repo.fetch_next_pending(session)
-            
-            if transaction is None:
-                return None
+            return self._claim_or_wait(runner_id, limit, wait)
+        finally:
+            if waiting:
+                _stop_waiting()
+    
+    def _claim_or_wait(self, runner_id: Optional[str], limit: int, wait: float) -> list[dict]:
+        session = get_session()
+        notifier = get_notifier()
+        deadline = time.monotonic() + wait
+        while True:
+            generation = notifier.generation()
+            transactions = self._claim_pending(session, runner_id, limit)
+            remaining = deadline - time.monotonic()
+            if transactions or remaining <= 0:
+                if transactions:
+                    on_commit(session, lambda: metrics.inc(
+                        "rues_transactions_claimed_total", amount=len(transactions)
+                    ))
+                    on_commit(session, lambda: invalidate_statuses(
+                        transaction.id for transaction in transactions
+                    ))
+                record_on_commit(session, [
+                    transition_event(transaction.id, transaction.status, runner_id=runner_id)
+                    for transaction in transactions
+                ])
+                return [serialize_transaction(transaction) for transaction in transactions]
             
-            return {
-                "id": transaction.id,
-                "company_id": transaction.company_id,
-                "nit": transaction.nit,
-                "status": transaction.status,
-                "payload_in": transaction.payload_in,
-                "result_payload": transaction.result_payload,
-                "error_code": transaction.error_code,
-                "error_msg": transaction.error_msg,
-                "runner_id": transaction.runner_id,
-                "idempotency_key": transaction.idempotency_key,
-                "created_at": transaction.created_at.isoformat() if transaction.created_at else None,
-                "updated_at": transaction.updated_at.isoformat() if transaction.updated_at else None,
-            }
+            # Liberar la conexión al pool mientras se espera
+            session.rollback()
+            notifier.wait(generation, remaining)
+    
+    def heartbeat(self, transaction_id: int, runner_id: Optional[str]) -> Optional[dict]:
+        """Extiende el lease de una transacción reclamada; None si el runner ya no la tiene."""
+        session = get_session()
+        lease_expires_at = transactions_repo.extend_lease(
+            session, transaction_id, runner_id, Config.LEASE_SECONDS
+        )
+        if lease_expires_at is None:
+            return None
+        on_commit(session, lambda: invalidate_statuses([transaction_id]))
+        return {"id": transaction_id, "lease_expires_at": lease_expires_at.isoformat()}
+    
+    def get_transaction(
+        self,
+        transaction_id: int,
+        is_current: Optional[Callable[[str], bool]] = None
+    ) -> tuple[Optional[str], Optional[dict]]:
+        """Devuelve ``(etag, transacción)`` de una transacción activa o archivada.
+        
+        ``is_current`` indica si el cliente ya tiene la versión de un ETag
+        (``If-None-Match``); en ese caso se devuelve ``(etag, None)`` sin
+        cargar la fila, y si el estado está en caché sin consultar la base de
+        datos. Devuelve ``(None, None)`` si la transacción no existe.
+        """
+        cached = _statuses.get(transaction_id)
+        if cached is not None:
+            etag, result = cached
+            return etag, None if is_current is not None and is_current(etag) else result
+        
+        session = get_session()
+        if is_current is not None:
+            version = transactions_repo.find_version(session, transaction_id)
+            if version is None:
+                return None, None
+            etag = transaction_etag(transaction_id, *version)
+            if is_current(etag):
+                return etag, None
+        
+        transaction = session.get(Transaction, transaction_id) or archive_repo.find_by_id(
+            session, transaction_id
+        )
+        if transaction is None:
+            return None, None
+        result = serialize_transaction(transaction)
+        etag = transaction_etag(transaction.id, transaction.updated_at, transaction.lease_expires_at)
+        _statuses.set(transaction_id, (etag, result))
+        return etag, result
+    
+    def get_transaction_by_idempotency_key(
+        self,
+        client_id: Optional[str],
+        idempotency_key: str,
+        is_current: Optional[Callable[[str], bool]] = None
+    ) -> tuple[Optional[str], Optional[dict]]:
+        """Como ``get_transaction``, para la transacción creada por el cliente con esa Idempotency-Key."""
+        # La respuesta de creación en caché ya tiene el id, que nunca cambia
+        created = _replays.get((client_id, idempotency_key))
+        if created is not None:
+            transaction_id = created[1]["id"]
+        else:
+            transaction_id = transactions_repo.find_id_by_idempotency_key(
+                get_session(), client_id, idempotency_key
+            )
+            if transaction_id is None:
+                return None, None
+        return self.get_transaction(transaction_id, is_current)
+    
+    def get_history(self, transaction_id: int) -> Optional[list[dict]]:
+        """Devuelve los cambios de estado de una transacción, o None si no existe.
+        
+        Antes de consultar escribe los eventos aún encolados en este proceso;
+        los de otros procesos aparecen tras su siguiente lote.
+        """
+        if Config.AUDIT_ENABLED:
+            get_audit_writer().flush()
+        
+        session = get_session()
+        events = audit_repo.get_history(session, TRANSACTION_ENTITY, transaction_id)
+        if (
+            not events
+            and session.get(Transaction, transaction_id) is None
+            and archive_repo.find_by_id(session, transaction_id) is None
+        ):
+            return None
+        return [serialize_audit_log(event) for event in events]
+    
+    def list_transactions(
+        self,
+        filters: dict,
+        after: Optional[tuple[datetime, int]],
+        limit: int
+    ) -> tuple[list[dict], Optional[tuple[datetime, int]]]:
+        """Devuelve una página del listado y el cursor de la siguiente, o None si es la última."""
+        rows = get_session().execute(
+            transactions_repo.listing_query(**filters, after=after).limit(limit + 1)
+        ).all()
+        next_after = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_after = (rows[-1].created_at, rows[-1].id)
+        return [serialize_transaction(row) for row in rows], next_after
+    
+    def export_transactions(self, filters: dict) -> Iterator[dict]:
+        """Recorre todas las transacciones del filtro con memoria constante.
+        
+        Usa una sesión propia, porque la respuesta se sigue generando después
+        de que termina el ciclo de la petición, y lee por bloques de
+        ``EXPORT_FETCH_SIZE`` filas (cursor del lado del servidor en
+        PostgreSQL).
+        """
+        session = db_session.SessionLocal()
+        try:
+            result = session.execute(
+                transactions_repo.listing_query(**filters).execution_options(
+                    yield_per=Config.EXPORT_FETCH_SIZE
+                )
+            )
+            for row in result:
+                yield serialize_transaction(row)
         finally:
             session.close()
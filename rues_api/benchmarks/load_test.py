@@ -0,0 +1,396 @@
+"""Prueba de carga reproducible de ingesta, reclamo y actualización.
+
+Simula ``--producers`` hilos que crean transacciones con ``/process-data`` y
+``--runners`` hilos que las reclaman con ``/next`` y las cierran con
+``/update-status``. Mide throughput y latencias p50/p95/p99 por operación,
+detecta reclamos duplicados y guarda el resultado en JSON para comparar
+entre commits.
+
+Ejemplos (desde la raíz del proyecto)::
+    
+    # Cliente de test de Flask sobre un SQLite temporal
+    python -m benchmarks.load_test
+    
+    # HTTP real contra un servidor local levantado por el benchmark
+    python -m benchmarks.load_test --http --dsn postgresql://postgres@localhost:55432/rues_bench --reset
+    
+    # Servidor ya en marcha (por ejemplo gunicorn)
+    python -m benchmarks.load_test --url http://localhost:8000 --api-key "$API_KEY"
+    
+    # Comparar con un resultado anterior
+    python -m benchmarks.load_test --compare benchmarks/results/anterior.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+OPERATIONS = ("ingest", "claim", "update")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BENCHMARK_API_KEY = "benchmark-api-key"
+
+
+class InProcessClient:
+    """Cliente sobre ``app.test_client()``: mide la aplicación sin la pila HTTP."""
+    
+    def __init__(self, app, api_key: str) -> None:
+        self._client = app.test_client()
+        self._client.environ_base["HTTP_X_API_KEY"] = api_key
+    
+    def call(self, method: str, path: str, body=None) -> tuple[int, object]:
+        response = self._client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Cliente HTTP real (solo biblioteca estándar) con una conexión keep-alive por hilo."""
+    
+    def __init__(self, base_url: str, api_key: str) -> None:
+        parsed = urlsplit(base_url)
+        connection_class = HTTPSConnection if parsed.scheme == "https" else HTTPConnection
+        self._connect = lambda: connection_class(parsed.netloc, timeout=60)
+        self._prefix = parsed.path.rstrip("/")
+        self._headers = {"X-API-Key": api_key, "Content-Type": "application/json"}
+        self._connection = self._connect()
+    
+    def call(self, method: str, path: str, body=None) -> tuple[int, object]:
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self._connection.request(method, self._prefix + path, body=payload, headers=self._headers)
+            response = self._connection.getresponse()
+            raw = response.read()
+        except (OSError, HTTPException):
+            # El servidor cerró la conexión: se abre otra para la siguiente petición
+            self._connection.close()
+            self._connection = self._connect()
+            raise
+        try:
+            return response.status, json.loads(raw) if raw else None
+        except ValueError:
+            return response.status, None
+
+
+class _Recorder:
+    """Latencias y errores por operación, compartidos entre hilos."""
+    
+    def __init__(self) -> None:
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.errors = {operation: Counter() for operation in OPERATIONS}
+        self._lock = threading.Lock()
+    
+    def timed(self, operation: str, client, method: str, path: str, body=None) -> tuple[int, object]:
+        started = time.perf_counter()
+        try:
+            status, data = client.call(method, path, body)
+        except Exception as e:
+            status, data = type(e).__name__, None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[operation].append(elapsed)
+            if not isinstance(status, int) or status >= 400:
+                self.errors[operation][str(status)] += 1
+        return status, data
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Percentil por rango más cercano de una lista ordenada."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def _summarize(latencies: list[float], errors: Counter, wall_seconds: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "errors": sum(errors.values()),
+        "errors_by_status": dict(errors),
+        "per_second": round(len(ordered) / wall_seconds, 2) if wall_seconds else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def run_benchmark(
+    make_client: Callable[[], object],
+    producers: int = 4,
+    runners: int = 4,
+    transactions: int = 1000,
+    claim_limit: int = 1,
+    ingest_batch: int = 1,
+    timeout: float = 300.0
+) -> dict:
+    """Ejecuta la carga y devuelve las métricas (sin metadatos del entorno).
+    
+    ``make_client`` se llama una vez por hilo y debe devolver un objeto con
+    ``call(method, path, body) -> (status, json)``.
+    """
+    recorder = _Recorder()
+    lock = threading.Lock()
+    next_index = [0]
+    created_ids: set[int] = set()
+    processed_ids: set[int] = set()
+    claims: Counter = Counter()
+    empty_polls = [0]
+    producers_done = threading.Event()
+    deadline = time.monotonic() + timeout
+    
+    def take_indexes() -> range:
+        with lock:
+            start = next_index[0]
+            end = min(start + ingest_batch, transactions)
+            next_index[0] = end
+        return range(start, end)
+    
+    def produce() -> None:
+        client = make_client()
+        while time.monotonic() < deadline:
+            indexes = take_indexes()
+            if not indexes:
+                return
+            payloads = [{"nit": f"9{index:08d}", "name": f"Benchmark {index}"} for index in indexes]
+            if ingest_batch == 1:
+                status, data = recorder.timed("ingest", client, "POST", "/api/v1/process-data", payloads[0])
+                ids = [data["id"]] if status == 201 else []
+            else:
+                status, data = recorder.timed("ingest", client, "POST", "/api/v1/process-data/batch", payloads)
+                ids = [
+                    result["transaction"]["id"] for result in (data or {}).get("results", [])
+                    if result.get("status") == 201
+                ] if status == 200 else []
+            with lock:
+                created_ids.update(ids)
+    
+    def finished() -> bool:
+        with lock:
+            return producers_done.is_set() and processed_ids >= created_ids
+    
+    def run(runner_id: str) -> None:
+        client = make_client()
+        while time.monotonic() < deadline and not finished():
+            status, data = recorder.timed(
+                "claim", client, "GET", f"/api/v1/next?limit={claim_limit}&runner_id={runner_id}"
+            )
+            if status != 200:
+                with lock:
+                    empty_polls[0] += status == 204
+                time.sleep(0.005)
+                continue
+            
+            claimed = data if isinstance(data, list) else [data]
+            with lock:
+                claims.update(transaction["id"] for transaction in claimed)
+            for transaction in claimed:
+                status, _ = recorder.timed("update", client, "POST", "/api/v1/update-status", {
+                    "id": transaction["id"],
+                    "status": "PROCESADO",
+                    "runner_id": runner_id,
+                    "result_payload": {"benchmark": True},
+                })
+                if status == 200:
+                    with lock:
+                        processed_ids.add(transaction["id"])
+    
+    producer_threads = [
+        threading.Thread(target=produce, name=f"bench-producer-{index}") for index in range(producers)
+    ]
+    runner_threads = [
+        threading.Thread(target=run, args=(f"bench-runner-{index}",), name=f"bench-runner-{index}")
+        for index in range(runners)
+    ]
+    
+    started = time.perf_counter()
+    for thread in producer_threads + runner_threads:
+        thread.start()
+    for thread in producer_threads:
+        thread.join()
+    producers_done.set()
+    for thread in runner_threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "transactions_per_second": round(len(processed_ids) / wall_seconds, 2) if wall_seconds else 0.0,
+        "created": len(created_ids),
+        "processed": len(processed_ids),
+        "unprocessed": len(created_ids - processed_ids),
+        "claims": {
+            "claimed": sum(claims.values()),
+            "duplicates": sum(count - 1 for count in claims.values() if count > 1),
+            "empty_polls": empty_polls[0],
+        },
+        "operations": {
+            operation: _summarize(recorder.latencies[operation], recorder.errors[operation], wall_seconds)
+            for operation in OPERATIONS
+        },
+    }
+
+
+def _git_revision() -> dict:
+    def git(*args) -> str:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=False,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain"))}
+
+
+def _prepare_database(dsn: str, reset: bool) -> None:
+    """Crea el esquema en la base de benchmark; con ``reset`` lo vacía antes."""
+    from sqlalchemy import create_engine
+    
+    from app.models.models import Base
+    
+    engine = create_engine(dsn)
+    try:
+        if reset:
+            Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+    finally:
+        engine.dispose()
+
+
+def _start_http_server(app):
+    """Levanta la aplicación en un servidor HTTP multihilo en un puerto libre."""
+    from werkzeug.serving import make_server
+    
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def compare(baseline: dict, current: dict) -> str:
+    """Tabla de diferencias de throughput y latencias entre dos resultados."""
+    lines = [f"{'métrica':<28}{'base':>12}{'actual':>12}{'cambio':>10}"]
+    if baseline.get("params") != current.get("params") or baseline["meta"]["target"] != current["meta"]["target"]:
+        lines.insert(0, "Aviso: los parámetros o el destino difieren; la comparación no es directa")
+    
+    def row(label: str, old: float, new: float) -> None:
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        lines.append(f"{label:<28}{old:>12}{new:>12}{change:>10}")
+    
+    row("transacciones/s", baseline["transactions_per_second"], current["transactions_per_second"])
+    for operation in OPERATIONS:
+        old, new = baseline["operations"][operation], current["operations"][operation]
+        for key in ("per_second", "p50_ms", "p95_ms", "p99_ms"):
+            row(f"{operation}.{key}", old[key], new[key])
+    row("reclamos duplicados", baseline["claims"]["duplicates"], current["claims"]["duplicates"])
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--producers", type=int, default=4, help="Hilos que crean transacciones")
+    parser.add_argument("--runners", type=int, default=4, help="Hilos que reclaman y actualizan")
+    parser.add_argument("--transactions", type=int, default=1000, help="Transacciones a crear")
+    parser.add_argument("--claim-limit", type=int, default=1, help="Valor de limit en /next")
+    parser.add_argument("--ingest-batch", type=int, default=1, help="Tamaño de lote de ingesta (1 = /process-data)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Tiempo máximo de la carga en segundos")
+    parser.add_argument("--dsn", help="Base de datos en modo local (por defecto un SQLite temporal)")
+    parser.add_argument("--reset", action="store_true", help="Borra y recrea el esquema de --dsn antes de empezar")
+    parser.add_argument("--http", action="store_true", help="Usa HTTP real contra un servidor local en lugar del cliente de test")
+    parser.add_argument("--url", help="URL de un servidor ya en marcha; ignora --dsn")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY"), help="API Key para --url")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/)")
+    parser.add_argument("--compare", help="Resultado JSON anterior con el que comparar")
+    args = parser.parse_args(argv)
+    
+    if args.url:
+        if not args.api_key:
+            parser.error("--url requiere --api-key o la variable API_KEY")
+        target, database = "url", None
+        make_client = lambda: HttpClient(args.url, args.api_key)
+        server = None
+    else:
+        from app.core.config import Config
+        
+        temporary_dir = None
+        dsn = args.dsn
+        if dsn is None:
+            temporary_dir = tempfile.mkdtemp(prefix="rues-bench-")
+            dsn = f"sqlite:///{os.path.join(temporary_dir, 'bench.db')}"
+        _prepare_database(dsn, args.reset)
+        
+        # El engine se crea en el primer uso, así que basta con fijar el DSN antes
+        Config.DB_DSN = dsn
+        Config.API_KEY = BENCHMARK_API_KEY
+        Config.LEASE_SECONDS = max(Config.LEASE_SECONDS, args.timeout * 2)
+        
+        from app import create_app
+        
+        app = create_app()
+        database = dsn.split(":", 1)[0].split("+", 1)[0]
+        server = None
+        if args.http:
+            server, base_url = _start_http_server(app)
+            target = "http"
+            make_client = lambda: HttpClient(base_url, BENCHMARK_API_KEY)
+        else:
+            target = "inprocess"
+            make_client = lambda: InProcessClient(app, BENCHMARK_API_KEY)
+    
+    params = {
+        "producers": args.producers,
+        "runners": args.runners,
+        "transactions": args.transactions,
+        "claim_limit": args.claim_limit,
+        "ingest_batch": args.ingest_batch,
+    }
+    try:
+        results = run_benchmark(make_client, timeout=args.timeout, **params)
+    finally:
+        if server is not None:
+            server.shutdown()
+    
+    document = {
+        "meta": {
+            **_git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "target": target,
+            "database": database,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": params,
+        **results,
+    }
+    
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(
+            RESULTS_DIR, f"{stamp}-{document['meta']['commit'] or 'nogit'}-{target}-{database or 'remote'}.json"
+        )
+    with open(output, "w") as handle:
+        json.dump(document, handle, indent=2)
+    
+    print(json.dumps(document, indent=2))
+    print(f"\nResultado guardado en {output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as handle:
+            print("\n" + compare(json.load(handle), document))
+    
+    # Reclamos duplicados o transacciones sin procesar invalidan la corrida
+    return 1 if results["claims"]["duplicates"] or results["unprocessed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
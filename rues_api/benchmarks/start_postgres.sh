@@ -0,0 +1,21 @@
+#!/bin/bash
+# Levanta un PostgreSQL desechable para benchmarks sin Docker ni red.
+# Uso: benchmarks/start_postgres.sh [directorio] [puerto]
+# Detener: pg_ctl -D <directorio> stop
+set -e
+
+DATA_DIR="${1:-/tmp/rues-bench-pg}"
+PORT="${2:-55432}"
+
+# Los binarios de Debian/Ubuntu no están en el PATH
+PG_BIN="$(ls -d /usr/lib/postgresql/*/bin 2>/dev/null | sort -V | tail -n 1)"
+export PATH="${PG_BIN:+$PG_BIN:}$PATH"
+
+if [ ! -f "$DATA_DIR/PG_VERSION" ]; then
+    initdb -D "$DATA_DIR" -U postgres --auth=trust > /dev/null
+fi
+
+pg_ctl -D "$DATA_DIR" -o "-p $PORT -k /tmp" -l "$DATA_DIR/server.log" -w start
+createdb -h localhost -p "$PORT" -U postgres rues_bench 2>/dev/null || true
+
+echo "DSN: postgresql://postgres@localhost:$PORT/rues_bench"
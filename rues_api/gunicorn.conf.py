@@ -0,0 +1,64 @@
+"""Configuración de gunicorn para producción."""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Procesos y hilos: por defecto un worker por núcleo más uno
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+worker_class = "gthread"
+
+# Defaults de la aplicación para varios workers. Se fijan antes de importarla:
+# las API Keys temporales se comparten en la base de datos y el long-polling
+# de /next ocupa como máximo la mitad de los hilos de cada worker
+os.environ.setdefault("TOKEN_STORE", "database")
+os.environ.setdefault("NEXT_MAX_WAITERS", str(max(1, threads // 2)))
+
+# Cargar la aplicación una vez en el master y compartirla con los workers
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# El long-polling de /next mantiene peticiones abiertas hasta NEXT_MAX_WAIT_SECONDS
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Reciclar workers periódicamente para acotar fugas de memoria
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"
+
+
+def on_starting(server):
+    """Valida la configuración y descarta las métricas de una ejecución anterior."""
+    from app.core.config import Config
+    from app.core.metrics import clear_snapshots
+    
+    # Cada worker tendría sus propias keys y rechazaría las emitidas por otro
+    if Config.TOKEN_STORE == "memory" and server.cfg.workers > 1:
+        raise RuntimeError("TOKEN_STORE=memory no admite varios workers: use TOKEN_STORE=database")
+    if not 0 < Config.NEXT_MAX_WAITERS < server.cfg.threads:
+        server.log.warning(
+            "NEXT_MAX_WAITERS=%d con %d hilos: el long-polling de /next puede ocupar todos los hilos del worker",
+            Config.NEXT_MAX_WAITERS, server.cfg.threads
+        )
+    
+    clear_snapshots()
+
+
+def post_fork(server, worker):
+    """Cada worker descarta las conexiones heredadas del master."""
+    from app.db.session import dispose_engine
+    
+    dispose_engine()
+
+
+def worker_exit(server, worker):
+    """Escribe la auditoría pendiente y las métricas antes de que el worker termine."""
+    from app.core.metrics import write_snapshot
+    from app.services.audit import shutdown_audit_writer
+    
+    shutdown_audit_writer()
+    write_snapshot()
@@ -1,4 +1,8 @@
-"""Punto de entrada de la aplicación."""
+"""Punto de entrada de la aplicación (servidor de desarrollo)."""
+from dotenv import load_dotenv
+
+load_dotenv()
+
 from app import create_app
 
 if __name__ == "__main__":
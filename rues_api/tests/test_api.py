@@ -1,43 +1,76 @@
 """Tests de la API."""
 import json
+import os
+import runpy
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker
 
 from app import create_app
-from app.models.models import Base
-from app.db.session import SessionLocal
-from app.services.transactions_service import TransactionsService
+from app.core.auth import clear_auth_cache
+from app.core import metrics
+from app.core.config import Config
+from app.core.token_store import MemoryTokenStore, reset_token_store
+from app.models.models import Base, Transaction, TransactionArchive, TransactionCounter
+import app.db.session as db_session
+from app.db.payload_codec import MARKER_ZLIB, LazyPayload
+from app.db.pool import InstrumentedQueuePool, pool_status
+from app.repositories import archive_repo, stats_repo
+from app.repositories.companies_repo import clear_company_cache, company_cache_stats
+from app.repositories.transactions_repo import _batch_update_statement
+from app.services.archive_service import archive_finished_transactions
+from app.services.audit import AuditWriter, shutdown_audit_writer, transition_event
+from app.services.lease_service import reap_expired_leases
+from app.services.stats_service import reconcile_counters
+import app.services.transactions_service as transactions_service_module
+
+TEST_API_KEY = "test-api-key"
 
 
 @pytest.fixture
-def app():
+def app(tmp_path, monkeypatch):
     """Fixture de la aplicación Flask en modo testing."""
-    app = create_app()
-    app.config['TESTING'] = True
+    monkeypatch.setattr(Config, "API_KEY", TEST_API_KEY)
+    
+    flask_app = create_app()
+    flask_app.config['TESTING'] = True
     
-    # Configurar SQLite en memoria para tests
-    engine = create_engine('sqlite:///:memory:')
+    # SQLite en archivo temporal: cada sesión usa su propia conexión, como en
+    # producción, para poder probar accesos concurrentes
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
     Base.metadata.create_all(engine)
     
     # Reemplazar SessionLocal para usar la DB de test
-    test_session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    
-    # Monkey patch para usar la sesión de test
-    original_session = SessionLocal
-    import app.db.session
-    app.db.session.SessionLocal = test_session
+    test_session = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+    )
+    monkeypatch.setattr(db_session, "SessionLocal", test_session)
+    clear_company_cache()
+    transactions_service_module.clear_replay_cache()
+    transactions_service_module.clear_status_cache()
+    clear_auth_cache()
+    reset_token_store()
+    shutdown_audit_writer()
+    metrics.registry.clear()
     
-    yield app
+    yield flask_app
     
-    # Restaurar sesión original
-    app.db.session.SessionLocal = original_session
+    shutdown_audit_writer()
+    engine.dispose()
 
 
 @pytest.fixture
 def client(app):
-    """Fixture del cliente de test."""
-    return app.test_client()
+    """Fixture del cliente de test autenticado con la API Key estática."""
+    client = app.test_client()
+    client.environ_base['HTTP_X_API_KEY'] = TEST_API_KEY
+    return client
 
 
 def test_process_data_ok(client):
@@ -157,3 +190,1222 @@ def test_process_data_with_temp_key(client):
     data = response.get_json()
     assert data['nit'] == '900123456'
     assert data['status'] == 'PENDIENTE'
+
+
+def test_next_claims_with_runner_id(client):
+    """Test GET /api/v1/next marca PROCESANDO y registra el runner_id."""
+    create_response = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '800100200'}),
+        content_type='application/json'
+    )
+    transaction_id = create_response.get_json()['id']
+    
+    response = client.get('/api/v1/next?runner_id=runner-1')
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['id'] == transaction_id
+    assert data['status'] == 'PROCESANDO'
+    assert data['runner_id'] == 'runner-1'
+    
+    # La cola queda vacía
+    assert client.get('/api/v1/next').status_code == 204
+
+
+def test_next_concurrent_runners_no_duplicates(app):
+    """Test varios runners concurrentes nunca reciben la misma transacción."""
+    producer = app.test_client()
+    producer.environ_base['HTTP_X_API_KEY'] = TEST_API_KEY
+    for i in range(20):
+        producer.post(
+            '/api/v1/process-data',
+            data=json.dumps({'nit': f'90000{i:04d}'}),
+            content_type='application/json'
+        )
+    
+    claimed = []
+    lock = threading.Lock()
+    
+    def runner(runner_id):
+        runner_client = app.test_client()
+        runner_client.environ_base['HTTP_X_API_KEY'] = TEST_API_KEY
+        while True:
+            response = runner_client.get(f'/api/v1/next?runner_id={runner_id}')
+            if response.status_code == 204:
+                return
+            with lock:
+                claimed.append(response.get_json()['id'])
+    
+    threads = [threading.Thread(target=runner, args=(f'runner-{n}',)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(claimed) == 20
+    assert len(set(claimed)) == 20
+
+
+def test_next_batch_limit(client):
+    """Test GET /api/v1/next?limit=N reclama hasta N transacciones como arreglo."""
+    for nit in ('700000001', '700000002', '700000003'):
+        client.post(
+            '/api/v1/process-data',
+            data=json.dumps({'nit': nit}),
+            content_type='application/json'
+        )
+    
+    response = client.get('/api/v1/next?limit=2&runner_id=runner-batch')
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert isinstance(data, list)
+    assert len(data) == 2
+    assert all(item['status'] == 'PROCESANDO' for item in data)
+    assert all(item['runner_id'] == 'runner-batch' for item in data)
+    
+    rest = client.get('/api/v1/next?limit=2').get_json()
+    assert len(rest) == 1
+    assert rest[0]['id'] not in {item['id'] for item in data}
+    
+    assert client.get('/api/v1/next?limit=2').status_code == 204
+    assert client.get('/api/v1/next?limit=0').status_code == 422
+
+
+def test_next_long_poll_wakes_on_new_transaction(app, client):
+    """Test GET /api/v1/next?wait despierta al llegar una transacción nueva."""
+    result = {}
+    
+    def runner():
+        runner_client = app.test_client()
+        runner_client.environ_base['HTTP_X_API_KEY'] = TEST_API_KEY
+        started = time.monotonic()
+        response = runner_client.get('/api/v1/next?wait=10&runner_id=runner-lp')
+        result['elapsed'] = time.monotonic() - started
+        result['response'] = response
+    
+    thread = threading.Thread(target=runner)
+    thread.start()
+    time.sleep(0.2)
+    client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '600000001'}),
+        content_type='application/json'
+    )
+    thread.join(timeout=10)
+    
+    assert result['response'].status_code == 200
+    assert result['response'].get_json()['nit'] == '600000001'
+    assert result['elapsed'] < 5
+
+
+def test_next_long_poll_timeout(client):
+    """Test GET /api/v1/next?wait sin trabajo responde 204 al vencer la espera."""
+    started = time.monotonic()
+    response = client.get('/api/v1/next?wait=0.3')
+    
+    assert response.status_code == 204
+    assert time.monotonic() - started >= 0.3
+    assert client.get('/api/v1/next?wait=-1').status_code == 422
+
+
+def test_next_long_poll_limited_by_max_waiters(app, client, monkeypatch):
+    """Test con NEXT_MAX_WAITERS alcanzado /next?wait responde sin esperar y no ocupa otro hilo."""
+    monkeypatch.setattr(Config, "NEXT_MAX_WAITERS", 1)
+    result = {}
+    
+    def runner():
+        runner_client = app.test_client()
+        runner_client.environ_base['HTTP_X_API_KEY'] = TEST_API_KEY
+        result['response'] = runner_client.get('/api/v1/next?wait=10')
+    
+    thread = threading.Thread(target=runner)
+    thread.start()
+    time.sleep(0.2)
+    
+    started = time.monotonic()
+    assert client.get('/api/v1/next?wait=5').status_code == 204
+    assert time.monotonic() - started < 2
+    assert 'rues_long_poll_rejected_total 1' in client.get('/metrics').get_data(as_text=True)
+    
+    client.post('/api/v1/process-data', data=json.dumps({'nit': '600000002'}), content_type='application/json')
+    thread.join(timeout=10)
+    assert result['response'].status_code == 200
+    assert transactions_service_module._waiters == 0
+
+
+def test_gunicorn_config_defaults_and_token_store_check(monkeypatch):
+    """Test gunicorn.conf.py comparte las API Keys y acota el long-polling, y no arranca con TOKEN_STORE=memory."""
+    monkeypatch.setattr(os, "environ", {"GUNICORN_WORKERS": "4", "GUNICORN_THREADS": "8"})
+    config = runpy.run_path(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py'))
+    assert os.environ["TOKEN_STORE"] == "database"
+    assert os.environ["NEXT_MAX_WAITERS"] == "4"
+    
+    warnings = []
+    server = SimpleNamespace(
+        cfg=SimpleNamespace(workers=config['workers'], threads=config['threads']),
+        log=SimpleNamespace(warning=lambda *args: warnings.append(args))
+    )
+    monkeypatch.setattr(Config, "TOKEN_STORE", "database")
+    monkeypatch.setattr(Config, "NEXT_MAX_WAITERS", 4)
+    config['on_starting'](server)
+    assert warnings == []
+    
+    monkeypatch.setattr(Config, "NEXT_MAX_WAITERS", 0)
+    config['on_starting'](server)
+    assert len(warnings) == 1
+    
+    monkeypatch.setattr(Config, "TOKEN_STORE", "memory")
+    with pytest.raises(RuntimeError, match="TOKEN_STORE=memory"):
+        config['on_starting'](server)
+
+
+def test_process_data_batch(client):
+    """Test POST /api/v1/process-data/batch crea válidos y reporta errores por elemento."""
+    response = client.post(
+        '/api/v1/process-data/batch',
+        data=json.dumps([
+            {'nit': '500000001', 'name': 'Empresa Uno'},
+            {'other_field': 'value'},
+            {'nit': '500000001'},
+            {'nit': '123'},
+            {'nit': '500000002'},
+        ]),
+        content_type='application/json'
+    )
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['created'] == 3
+    assert data['failed'] == 2
+    statuses = [item['status'] for item in data['results']]
+    assert statuses == [201, 422, 201, 422, 201]
+    
+    first = data['results'][0]['transaction']
+    repeated = data['results'][2]['transaction']
+    assert first['status'] == 'PENDIENTE'
+    assert first['company_id'] == repeated['company_id']
+    assert data['results'][4]['transaction']['company_id'] != first['company_id']
+    
+    # Las transacciones quedan disponibles para los runners
+    claimed = client.get('/api/v1/next?limit=10').get_json()
+    assert len(claimed) == 3
+
+
+def test_process_data_batch_requires_array(client):
+    """Test POST /api/v1/process-data/batch sin arreglo -> 422."""
+    response = client.post(
+        '/api/v1/process-data/batch',
+        data=json.dumps({'nit': '500000001'}),
+        content_type='application/json'
+    )
+    
+    assert response.status_code == 422
+
+
+def test_process_data_reuses_cached_company(client):
+    """Test un NIT ya visto resuelve company_id desde la caché."""
+    first = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '400000001'}),
+        content_type='application/json'
+    ).get_json()
+    hits_before = company_cache_stats()['hits']
+    
+    second = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '400000001'}),
+        content_type='application/json'
+    ).get_json()
+    
+    assert second['company_id'] == first['company_id']
+    assert company_cache_stats()['hits'] == hits_before + 1
+
+
+def test_process_data_idempotency_key_replay(client):
+    """Test un reintento con la misma Idempotency-Key devuelve la transacción original."""
+    first = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '300000001'}),
+        content_type='application/json',
+        headers={'Idempotency-Key': 'retry-1'}
+    )
+    
+    # Sin caché en memoria la repetición se resuelve desde la base de datos
+    transactions_service_module.clear_replay_cache()
+    second = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '300000001'}),
+        content_type='application/json',
+        headers={'Idempotency-Key': 'retry-1'}
+    )
+    third = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '300000001'}),
+        content_type='application/json',
+        headers={'Idempotency-Key': 'retry-1'}
+    )
+    
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+    assert second.status_code == 201
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json()['id'] == first.get_json()['id']
+    assert third.get_json()['id'] == first.get_json()['id']
+    
+    # Solo existe una transacción en la cola
+    assert client.get('/api/v1/next?limit=10').get_json()[0]['id'] == first.get_json()['id']
+    assert client.get('/api/v1/next').status_code == 204
+
+
+def test_idempotency_key_is_scoped_per_client(client):
+    """Test la misma Idempotency-Key de otro cliente crea otra transacción."""
+    login_data = client.post(
+        '/api/v1/auth/login',
+        data=json.dumps({'username': 'admin', 'password': 'admin'}),
+        content_type='application/json'
+    ).get_json()
+    
+    static_response = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '300000002'}),
+        content_type='application/json',
+        headers={'Idempotency-Key': 'shared-key'}
+    )
+    admin_response = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '300000002'}),
+        content_type='application/json',
+        headers={'Idempotency-Key': 'shared-key', 'X-API-Key': login_data['api_key']}
+    )
+    
+    assert admin_response.status_code == 201
+    assert 'Idempotent-Replayed' not in admin_response.headers
+    assert admin_response.get_json()['id'] != static_response.get_json()['id']
+
+
+def test_idempotency_key_reused_with_different_body_is_rejected(client):
+    """Test la misma Idempotency-Key con otro cuerpo responde 422 en vez de repetir la original."""
+    def post(body):
+        return client.post(
+            '/api/v1/process-data',
+            data=json.dumps(body),
+            content_type='application/json',
+            headers={'Idempotency-Key': 'body-key'}
+        )
+    
+    original = post({'nit': '300000003', 'name': 'EMPRESA'})
+    # El orden de las claves no cambia el cuerpo
+    replay = post({'name': 'EMPRESA', 'nit': '300000003'})
+    assert replay.status_code == 201
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.get_json()['id'] == original.get_json()['id']
+    
+    assert post({'nit': '300000004', 'name': 'EMPRESA'}).status_code == 422
+    # También sin la caché en memoria, contra la fila guardada
+    transactions_service_module.clear_replay_cache()
+    assert post({'nit': '300000004', 'name': 'EMPRESA'}).status_code == 422
+    assert post({'nit': '300000003', 'name': 'EMPRESA'}).status_code == 201
+
+
+def test_update_status_batch(client):
+    """Test POST /api/v1/update-status/batch aplica varios cambios y reporta cada elemento."""
+    created = client.post(
+        '/api/v1/process-data/batch',
+        data=json.dumps([{'nit': '200000001'}, {'nit': '200000002'}]),
+        content_type='application/json'
+    ).get_json()['results']
+    first_id = created[0]['transaction']['id']
+    second_id = created[1]['transaction']['id']
+    
+    response = client.post(
+        '/api/v1/update-status/batch',
+        data=json.dumps([
+            {'id': first_id, 'status': 'PROCESADO', 'result_payload': {'ok': True}},
+            {'id': second_id, 'status': 'ERROR', 'error_code': 'RUES_TIMEOUT', 'error_msg': 'timeout'},
+            {'id': 999999, 'status': 'PROCESADO'},
+            {'id': first_id, 'status': 'INVALID'},
+        ]),
+        content_type='application/json'
+    )
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['updated'] == 2
+    assert [item['status'] for item in data['results']] == [200, 200, 404, 422]
+    
+    # Un update individual posterior conserva los campos del lote
+    second = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': second_id, 'status': 'ERROR'}),
+        content_type='application/json'
+    ).get_json()
+    assert second['error_code'] == 'RUES_TIMEOUT'
+    assert second['error_msg'] == 'timeout'
+
+
+def test_update_status_batch_rejects_duplicate_ids(client):
+    """Test update-status/batch aplica la primera aparición de un id y rechaza las repetidas con 422."""
+    transaction_id = client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '200000003'}), content_type='application/json'
+    ).get_json()['id']
+    
+    response = client.post(
+        '/api/v1/update-status/batch',
+        data=json.dumps([
+            {'id': transaction_id, 'status': 'PROCESADO'},
+            {'id': transaction_id, 'status': 'ERROR', 'error_code': 'RUES_TIMEOUT'},
+        ]),
+        content_type='application/json'
+    )
+    
+    data = response.get_json()
+    assert data['updated'] == 1
+    assert [item['status'] for item in data['results']] == [200, 422]
+    assert data['results'][0]['transaction_status'] == 'PROCESADO'
+    assert data['results'][1]['error'] == 'id duplicado en el lote'
+
+
+def test_next_claims_in_fifo_order(client):
+    """Test GET /api/v1/next?limit=N entrega las pendientes por (next_attempt_at, id) ascendente."""
+    ids = [
+        client.post(
+            '/api/v1/process-data', data=json.dumps({'nit': f'71000000{index}'}), content_type='application/json'
+        ).get_json()['id']
+        for index in range(4)
+    ]
+    # La última en crearse vence primero; las dos primeras empatan y las desempata el id
+    now = datetime.now()
+    session = db_session.SessionLocal()
+    for transaction_id, due in (
+        (ids[0], now - timedelta(minutes=10)),
+        (ids[1], now - timedelta(minutes=10)),
+        (ids[2], now - timedelta(minutes=5)),
+        (ids[3], now - timedelta(hours=1)),
+    ):
+        session.query(Transaction).filter(Transaction.id == transaction_id).update(
+            {Transaction.next_attempt_at: due}
+        )
+    session.commit()
+    session.close()
+    
+    claimed = client.get('/api/v1/next?limit=3').get_json()
+    assert [item['id'] for item in claimed] == [ids[3], ids[0], ids[1]]
+    assert [item['id'] for item in client.get('/api/v1/next?limit=3').get_json()] == [ids[2]]
+
+
+def test_update_status_batch_postgresql_casts_null_columns():
+    """Test el UPDATE ... FROM (VALUES ...) de PostgreSQL tipa las columnas que pueden venir todas NULL."""
+    rows = {1: {
+        'id': 1, 'status': 'PROCESADO', 'error_code': None, 'error_msg': None,
+        'result_payload': None, 'runner_id': None, 'next_attempt_at': None,
+    }}
+    sql = str(_batch_update_statement(rows, datetime.now()).compile(dialect=postgresql.dialect()))
+    assert 'coalesce(CAST(batch.result_payload AS JSONB), transactions.result_payload)' in sql
+    assert (
+        'coalesce(CAST(batch.next_attempt_at AS TIMESTAMP WITHOUT TIME ZONE), transactions.next_attempt_at)' in sql
+    )
+
+
+def test_payloads_are_returned_as_json(client):
+    """Test payload_in y result_payload se devuelven como JSON y no como strings."""
+    created = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '100000001', 'name': 'ACME'}),
+        content_type='application/json'
+    ).get_json()
+    assert created['payload_in'] == {'nit': '100000001', 'name': 'ACME'}
+    
+    updated = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({
+            'id': created['id'],
+            'status': 'PROCESADO',
+            'result_payload': {'rues_status': 'ACTIVA', 'employees_count': 150}
+        }),
+        content_type='application/json'
+    ).get_json()
+    assert updated['result_payload'] == {'rues_status': 'ACTIVA', 'employees_count': 150}
+
+
+def test_admin_pool_stats(client):
+    """Test GET /api/v1/admin/pool expone el estado del pool."""
+    response = client.get('/api/v1/admin/pool')
+    
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['pool_class'] == 'QueuePool'
+    assert 'checked_out' in data
+
+
+def test_instrumented_pool_counts_timeouts(tmp_path):
+    """Test el pool instrumentado registra checkouts y timeouts."""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1
+    )
+    connection = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    connection.close()
+    
+    status = pool_status(engine.pool)
+    assert status['checkouts'] == 1
+    assert status['timeouts'] == 1
+    assert status['wait_ms_max'] >= 100
+    assert status['max_overflow'] == 0
+    engine.dispose()
+
+
+def test_memory_token_store_sweep_and_cap():
+    """Test el almacén en memoria barre keys expiradas y respeta el tamaño máximo."""
+    store = MemoryTokenStore(max_keys=2, sweep_interval_seconds=0)
+    now = datetime.now()
+    store.issue('expired', 'admin', now - timedelta(seconds=1))
+    store.issue('first', 'admin', now + timedelta(minutes=5))
+    assert store.sweep() == 1
+    
+    store.issue('second', 'admin', now + timedelta(minutes=10))
+    store.issue('third', 'admin', now + timedelta(minutes=15))
+    
+    # Al llenarse se descarta la key más próxima a expirar
+    assert store.lookup('first') is None
+    assert store.lookup('second')[0] == 'admin'
+    assert store.lookup('third')[0] == 'admin'
+    
+    # Una key reemitida cuenta con su nueva expiración, no con la anterior
+    store.issue('second', 'admin', now + timedelta(minutes=20))
+    store.issue('fourth', 'admin', now + timedelta(minutes=25))
+    assert store.lookup('third') is None
+    assert store.lookup('second')[1] == now + timedelta(minutes=20)
+
+
+def test_database_token_store_shared_between_processes(client, monkeypatch):
+    """Test una key emitida con TOKEN_STORE=database es válida tras perder el estado local."""
+    monkeypatch.setattr(Config, "TOKEN_STORE", "database")
+    reset_token_store()
+    api_key = client.post(
+        '/api/v1/auth/login',
+        data=json.dumps({'username': 'admin', 'password': 'admin'}),
+        content_type='application/json'
+    ).get_json()['api_key']
+    
+    # Simular otro worker: sin caché local ni almacén en memoria
+    clear_auth_cache()
+    reset_token_store()
+    
+    response = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '910000001'}),
+        content_type='application/json',
+        headers={'X-API-Key': api_key}
+    )
+    assert response.status_code == 201
+    
+    unknown = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '910000001'}),
+        content_type='application/json',
+        headers={'X-API-Key': 'not-issued'}
+    )
+    assert unknown.status_code == 401
+
+
+def test_transaction_history_records_status_changes(client):
+    """Test GET /transactions/<id>/history devuelve cada cambio de estado en orden."""
+    transaction_id = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '920000001'}),
+        content_type='application/json'
+    ).get_json()['id']
+    client.get('/api/v1/next?runner_id=runner-a')
+    client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'ERROR', 'error_code': 'E1'}),
+        content_type='application/json'
+    )
+    
+    response = client.get(f'/api/v1/transactions/{transaction_id}/history')
+    assert response.status_code == 200
+    events = response.get_json()['events']
+    assert [event['action'] for event in events] == ['PENDIENTE', 'PROCESANDO', 'ERROR']
+    assert events[1]['detail'] == {'runner_id': 'runner-a'}
+    assert events[2]['detail'] == {'error_code': 'E1'}
+    
+    assert client.get('/api/v1/transactions/999999/history').status_code == 404
+
+
+def test_audit_writer_backpressure_and_flush(app):
+    """Test el escritor descarta eventos con la cola llena y escribe el resto en bloque."""
+    writer = AuditWriter(
+        batch_size=2, flush_interval_seconds=60, max_queue=3, enqueue_timeout_seconds=0.01
+    )
+    # Simular una base de datos lenta: el hilo no puede vaciar la cola
+    with writer._flush_lock:
+        writer.record([transition_event(transaction_id, 'PENDIENTE') for transaction_id in range(1, 6)])
+        stats = writer.stats()
+    assert stats['queued'] == 3
+    assert stats['dropped'] == 2
+    
+    writer.close()
+    stats = writer.stats()
+    assert stats['queued'] == 0
+    assert stats['written'] == 3
+
+
+def test_archive_moves_finished_transactions_in_chunks(client):
+    """Test el archivado mueve solo las finalizadas antiguas y siguen siendo consultables."""
+    ids = []
+    for index in range(4):
+        ids.append(client.post(
+            '/api/v1/process-data',
+            data=json.dumps({'nit': f'93000000{index}'}),
+            content_type='application/json',
+            headers={'Idempotency-Key': f'archive-{index}'}
+        ).get_json()['id'])
+    for transaction_id, status in zip(ids, ['PROCESADO', 'ERROR', 'PROCESADO']):
+        client.post(
+            '/api/v1/update-status',
+            data=json.dumps({'id': transaction_id, 'status': status}),
+            content_type='application/json'
+        )
+    
+    # Solo las dos primeras llevan más de un día finalizadas
+    session = db_session.SessionLocal()
+    session.query(Transaction).filter(Transaction.id.in_(ids[:2])).update(
+        {Transaction.updated_at: datetime.now() - timedelta(days=2)}
+    )
+    session.commit()
+    
+    assert archive_finished_transactions(timedelta(days=1), chunk_size=1) == 2
+    assert {row.id for row in session.query(TransactionArchive)} == set(ids[:2])
+    assert {row.id for row in session.query(Transaction)} == set(ids[2:])
+    session.close()
+    
+    assert client.get(f'/api/v1/transactions/{ids[0]}/history').status_code == 200
+    listed = client.get('/api/v1/transactions?include_archived=true').get_json()['items']
+    assert [item['id'] for item in listed] == ids
+    
+    transactions_service_module.clear_replay_cache()
+    replay = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '930000000'}),
+        content_type='application/json',
+        headers={'Idempotency-Key': 'archive-0'}
+    )
+    assert replay.headers.get('Idempotent-Replayed') == 'true'
+    assert replay.get_json()['id'] == ids[0]
+
+
+def test_archive_chunk_scans_finished_by_updated_at(client):
+    """Test el archivado recorre las finalizadas por (updated_at, id) y se detiene en el corte."""
+    ids = [
+        client.post(
+            '/api/v1/process-data', data=json.dumps({'nit': f'93100000{index}'}), content_type='application/json'
+        ).get_json()['id']
+        for index in range(3)
+    ]
+    client.post(
+        '/api/v1/update-status/batch',
+        data=json.dumps([{'id': transaction_id, 'status': 'PROCESADO'} for transaction_id in ids]),
+        content_type='application/json'
+    )
+    # La de menor id terminó recién; las otras dos, en orden inverso a su id
+    now = datetime.now()
+    session = db_session.SessionLocal()
+    for transaction_id, updated_at in zip(ids[1:], (now - timedelta(days=2), now - timedelta(days=3))):
+        session.query(Transaction).filter(Transaction.id == transaction_id).update(
+            {Transaction.updated_at: updated_at}
+        )
+    session.commit()
+    
+    cutoff = now - timedelta(days=1)
+    moved, after = archive_repo.archive_chunk(session, cutoff, chunk_size=1)
+    assert moved == [ids[2]]
+    assert after == (now - timedelta(days=3), ids[2])
+    moved, after = archive_repo.archive_chunk(session, cutoff, chunk_size=1, after=after)
+    assert moved == [ids[1]]
+    assert archive_repo.archive_chunk(session, cutoff, chunk_size=1, after=after) == ([], after)
+    session.commit()
+    session.close()
+
+
+def test_archive_cli_command(app, client):
+    """Test el comando flask archive-transactions."""
+    transaction_id = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '940000001'}),
+        content_type='application/json'
+    ).get_json()['id']
+    client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'PROCESADO'}),
+        content_type='application/json'
+    )
+    
+    result = app.test_cli_runner().invoke(
+        args=['archive-transactions', '--older-than-days', '0', '--chunk-size', '10']
+    )
+    assert result.exit_code == 0, result.output
+    assert '1 transacciones archivadas' in result.output
+
+
+def test_list_transactions_keyset_pagination(client):
+    """Test GET /transactions recorre todas las páginas sin repetir filas y filtra."""
+    ids = [
+        client.post(
+            '/api/v1/process-data',
+            data=json.dumps({'nit': f'95000000{index}'}),
+            content_type='application/json'
+        ).get_json()['id']
+        for index in range(5)
+    ]
+    client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': ids[0], 'status': 'PROCESADO'}),
+        content_type='application/json'
+    )
+    
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/v1/transactions?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        seen.extend(item['id'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == ids
+    
+    processed = client.get('/api/v1/transactions?status=PROCESADO').get_json()
+    assert [item['id'] for item in processed['items']] == [ids[0]]
+    
+    assert client.get('/api/v1/transactions?cursor=invalid').status_code == 422
+    assert client.get('/api/v1/transactions?created_from=yesterday').status_code == 422
+
+
+def test_export_transactions_streams_ndjson_and_csv(client):
+    """Test GET /transactions/export devuelve todas las filas en NDJSON y CSV."""
+    for index in range(3):
+        client.post(
+            '/api/v1/process-data',
+            data=json.dumps({'nit': f'96000000{index}', 'name': 'ACME, S.A.'}),
+            content_type='application/json'
+        )
+    
+    response = client.get('/api/v1/transactions/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row['nit'] for row in rows] == ['960000000', '960000001', '960000002']
+    
+    response = client.get('/api/v1/transactions/export?format=csv&nit=960000001')
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith('id,company_id,nit,status')
+    assert len(lines) == 2
+    assert '960000001' in lines[1]
+
+
+def test_stats_counters_follow_status_changes(client, monkeypatch):
+    """Test GET /stats refleja cada cambio de estado sin recontar la tabla."""
+    monkeypatch.setattr(Config, "STATS_PER_NIT", True)
+    client.post(
+        '/api/v1/process-data/batch',
+        data=json.dumps([{'nit': '970000001'}, {'nit': '970000001'}, {'nit': '970000002'}]),
+        content_type='application/json'
+    )
+    claimed = client.get('/api/v1/next?limit=2').get_json()
+    client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': claimed[0]['id'], 'status': 'PROCESADO'}),
+        content_type='application/json'
+    )
+    client.post(
+        '/api/v1/update-status/batch',
+        data=json.dumps([{'id': claimed[1]['id'], 'status': 'ERROR'}]),
+        content_type='application/json'
+    )
+    
+    stats = client.get('/api/v1/stats').get_json()
+    assert stats['counts'] == {'PENDIENTE': 1, 'PROCESANDO': 0, 'PROCESADO': 1, 'ERROR': 1, 'FALLIDO': 0}
+    assert stats['total'] == 3
+    
+    by_nit = client.get('/api/v1/stats?nit=970000001').get_json()
+    assert by_nit['counts']['PROCESADO'] == 1
+    assert by_nit['total'] == 2
+    
+    archive_finished_transactions(timedelta(days=-1), chunk_size=10)
+    assert client.get('/api/v1/stats').get_json()['total'] == 1
+    assert reconcile_counters() == {}
+
+
+def test_reconcile_counters_fixes_drift(client):
+    """Test la reconciliación recalcula contadores desalineados."""
+    client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '980000001'}),
+        content_type='application/json'
+    )
+    session = db_session.SessionLocal()
+    session.query(TransactionCounter).delete()
+    session.commit()
+    session.close()
+    assert client.get('/api/v1/stats').get_json()['total'] == 0
+    
+    assert reconcile_counters() == {'PENDIENTE': 1}
+    assert client.get('/api/v1/stats').get_json()['counts']['PENDIENTE'] == 1
+
+
+def test_reconcile_counters_adds_deltas_without_rewriting_shards(client):
+    """Test la reconciliación suma la corrección en su shard reservado sin reescribir los demás."""
+    for index in range(2):
+        client.post(
+            '/api/v1/process-data', data=json.dumps({'nit': f'98000001{index}'}), content_type='application/json'
+        )
+    session = db_session.SessionLocal()
+    session.add(TransactionCounter(nit='', status='ERROR', shard=999, count=3))
+    session.commit()
+    shards = {(row.status, row.shard): row.count for row in session.query(TransactionCounter)}
+    
+    assert reconcile_counters() == {'ERROR': -3}
+    assert {
+        (row.status, row.shard): row.count for row in session.query(TransactionCounter)
+    } == {**shards, ('ERROR', stats_repo.RECONCILE_SHARD): -3}
+    session.close()
+    assert client.get('/api/v1/stats').get_json()['counts'] == {
+        'PENDIENTE': 2, 'PROCESANDO': 0, 'PROCESADO': 0, 'ERROR': 0, 'FALLIDO': 0
+    }
+    assert reconcile_counters() == {}
+
+
+def _expire_lease(transaction_id):
+    """Vence el lease de una transacción reclamada."""
+    session = db_session.SessionLocal()
+    session.query(Transaction).filter(Transaction.id == transaction_id).update(
+        {Transaction.lease_expires_at: datetime.now() - timedelta(seconds=1)}
+    )
+    session.commit()
+    session.close()
+
+
+def test_lease_heartbeat_reaper_and_rejected_updates(client):
+    """Test un lease vencido se rechaza, el reaper reencola y solo el nuevo runner actualiza."""
+    transaction_id = client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '990000001'}),
+        content_type='application/json'
+    ).get_json()['id']
+    claimed = client.get('/api/v1/next?runner_id=runner-a').get_json()
+    assert claimed['lease_expires_at'] is not None
+    
+    heartbeat_url = f'/api/v1/transactions/{transaction_id}/heartbeat'
+    assert client.post(heartbeat_url, headers={'X-Runner-Id': 'runner-a'}).status_code == 200
+    assert client.post(heartbeat_url, headers={'X-Runner-Id': 'runner-b'}).status_code == 409
+    
+    _expire_lease(transaction_id)
+    assert client.post(heartbeat_url, headers={'X-Runner-Id': 'runner-a'}).status_code == 409
+    late_update = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'PROCESADO', 'runner_id': 'runner-a'}),
+        content_type='application/json'
+    )
+    assert late_update.status_code == 409
+    
+    assert reap_expired_leases() == 1
+    assert client.get('/api/v1/stats').get_json()['counts']['PENDIENTE'] == 1
+    assert client.get('/api/v1/next?runner_id=runner-b').get_json()['id'] == transaction_id
+    
+    stale = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'PROCESADO', 'runner_id': 'runner-a'}),
+        content_type='application/json'
+    )
+    assert stale.status_code == 409
+    done = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'PROCESADO', 'runner_id': 'runner-b'}),
+        content_type='application/json'
+    )
+    assert done.status_code == 200
+    assert done.get_json()['lease_expires_at'] is None
+
+
+def test_update_status_batch_rejects_expired_leases(client):
+    """Test update-status/batch responde 409 por elemento cuando el lease venció."""
+    ids = [
+        client.post(
+            '/api/v1/process-data',
+            data=json.dumps({'nit': f'99100000{index}'}),
+            content_type='application/json'
+        ).get_json()['id']
+        for index in range(2)
+    ]
+    client.get('/api/v1/next?limit=2&runner_id=runner-a')
+    _expire_lease(ids[1])
+    
+    response = client.post(
+        '/api/v1/update-status/batch',
+        data=json.dumps([{'id': ids[0], 'status': 'PROCESADO'}, {'id': ids[1], 'status': 'PROCESADO'}]),
+        content_type='application/json',
+        headers={'X-Runner-Id': 'runner-a'}
+    )
+    data = response.get_json()
+    assert data['updated'] == 1
+    assert [result['status'] for result in data['results']] == [200, 409]
+
+
+def test_metrics_endpoint_prometheus_format(client):
+    """Test /metrics expone latencia, contadores por código, consultas SQL y profundidad de cola."""
+    client.post(
+        '/api/v1/process-data',
+        data=json.dumps({'nit': '992000001'}),
+        content_type='application/json'
+    )
+    client.get('/api/v1/next')
+    client.post('/api/v1/process-data', data=json.dumps({}), content_type='application/json')
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'rues_http_requests_total{route="api_v1.process_data",method="POST",status="201"} 1' in body
+    assert 'rues_http_errors_total{route="api_v1.process_data",status="422"} 1' in body
+    assert 'rues_http_request_duration_seconds_bucket{route="api_v1.next_transaction",le="+Inf"} 1' in body
+    assert 'rues_db_queries_per_request_count{route="api_v1.process_data"} 2' in body
+    assert 'rues_transactions_created_total 1' in body
+    assert 'rues_transactions_claimed_total 1' in body
+    assert 'rues_queue_depth{status="PROCESANDO"} 1' in body
+
+
+def test_metrics_aggregate_worker_snapshots(client, tmp_path, monkeypatch):
+    """Test con METRICS_DIR /metrics suma las instantáneas de todos los workers."""
+    monkeypatch.setattr(Config, "METRICS_DIR", str(tmp_path / 'metrics'))
+    client.get('/api/v1/health')
+    
+    # Instantánea de otro worker
+    (tmp_path / 'metrics').mkdir()
+    other = metrics.MetricsRegistry()
+    other.inc('rues_http_requests_total', (('route', 'api_v1.health'), ('method', 'GET'), ('status', '200')), 2)
+    other.observe('rues_http_request_duration_seconds', 0.2, (('route', 'api_v1.health'),))
+    (tmp_path / 'metrics' / '999999.json').write_text(json.dumps(other.snapshot()))
+    
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'rues_http_requests_total{route="api_v1.health",method="GET",status="200"} 3' in body
+    assert 'rues_http_request_duration_seconds_count{route="api_v1.health"} 2' in body
+
+
+def test_load_test_benchmark_smoke(app):
+    """Test la prueba de carga procesa todo sin reclamos duplicados y reporta percentiles."""
+    from benchmarks.load_test import InProcessClient, percentile, run_benchmark
+    
+    results = run_benchmark(
+        lambda: InProcessClient(app, TEST_API_KEY),
+        producers=2, runners=2, transactions=20, claim_limit=3, timeout=60
+    )
+    
+    assert results["created"] == 20
+    assert results["processed"] == 20
+    assert results["claims"]["duplicates"] == 0
+    assert results["operations"]["ingest"]["count"] == 20
+    assert results["operations"]["update"]["errors"] == 0
+    assert results["operations"]["claim"]["p50_ms"] <= results["operations"]["claim"]["p99_ms"]
+    # Rango más cercano: p95 de 100 valores es el 95.º (índice 94)
+    assert percentile(list(range(100)), 0.95) == 94
+
+
+def test_query_profiling_header_logs_slow_queries_and_server_timing(client, monkeypatch, caplog):
+    """Test con PROFILE_QUERIES=header solo se perfila con la cabecera y se añade Server-Timing."""
+    monkeypatch.setattr(Config, "PROFILE_QUERIES", "header")
+    monkeypatch.setattr(Config, "PROFILE_SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(Config, "PROFILE_SERVER_TIMING", True)
+    payload = json.dumps({'nit': '123456789'})
+    
+    response = client.post('/api/v1/process-data', data=payload, content_type='application/json')
+    assert 'Server-Timing' not in response.headers
+    assert 'Consulta lenta' not in caplog.text
+    
+    with caplog.at_level('WARNING', logger='app.core.profiling'):
+        response = client.post(
+            '/api/v1/process-data', data=json.dumps({'nit': '987654321'}),
+            content_type='application/json', headers={'X-Profile-Queries': '1'}
+        )
+    assert response.status_code == 201
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;dur=') and 'total;dur=' in timing
+    assert 'transactions_repo.create_transaction' in timing
+    assert 'desde transactions_repo.create_transaction' in caplog.text
+    # Solo la forma de los parámetros, nunca sus valores
+    assert '987654321' not in caplog.text
+
+
+def test_query_profiling_flags_repeated_statements(app, monkeypatch, caplog):
+    """Test el perfilado avisa de sentencias idénticas repetidas en una petición (N+1)."""
+    from flask import Response
+    from sqlalchemy import select
+    
+    monkeypatch.setattr(Config, "PROFILE_QUERIES", "1")
+    monkeypatch.setattr(Config, "PROFILE_REPEAT_THRESHOLD", 3)
+    
+    with caplog.at_level('WARNING', logger='app.core.profiling'):
+        with app.test_request_context('/api/v1/health'):
+            app.preprocess_request()
+            session = db_session.get_session()
+            for transaction_id in (1, 2, 3):
+                session.execute(select(Transaction).where(Transaction.id == transaction_id)).first()
+            app.process_response(Response())
+    
+    assert 'Posible N+1 en api_v1.health: 3 ejecuciones' in caplog.text
+
+
+def test_get_transaction_etag_and_conditional_requests(client):
+    """Test GET /transactions/<id> devuelve ETag, 304 si no cambió y 200 tras update-status."""
+    created = client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '123456789'}),
+        content_type='application/json'
+    ).get_json()
+    
+    response = client.get(f"/api/v1/transactions/{created['id']}")
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'PENDIENTE'
+    etag = response.headers['ETag']
+    
+    response = client.get(f"/api/v1/transactions/{created['id']}", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    
+    client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': created['id'], 'status': 'PROCESADO'}),
+        content_type='application/json'
+    )
+    response = client.get(f"/api/v1/transactions/{created['id']}", headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'PROCESADO'
+    assert response.headers['ETag'] != etag
+    
+    # Sin caché, el 304 se resuelve leyendo solo la versión de la fila
+    transactions_service_module.clear_status_cache()
+    response = client.get(
+        f"/api/v1/transactions/{created['id']}", headers={'If-None-Match': response.headers['ETag']}
+    )
+    assert response.status_code == 304
+    
+    assert client.get('/api/v1/transactions/999999').status_code == 404
+
+
+def test_get_transaction_by_idempotency_key_cached_poll_skips_database(client):
+    """Test la consulta por Idempotency-Key y que un 304 en caché no consulta la base de datos."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    
+    client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '123456789'}),
+        content_type='application/json', headers={'Idempotency-Key': 'orden-1'}
+    )
+    response = client.get('/api/v1/transactions/by-idempotency-key/orden-1')
+    assert response.status_code == 200
+    assert response.get_json()['nit'] == '123456789'
+    etag = response.headers['ETag']
+    
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(Engine, 'before_cursor_execute', listener)
+    try:
+        response = client.get(
+            '/api/v1/transactions/by-idempotency-key/orden-1', headers={'If-None-Match': etag}
+        )
+    finally:
+        event.remove(Engine, 'before_cursor_execute', listener)
+    assert response.status_code == 304
+    assert statements == []
+    
+    assert client.get('/api/v1/transactions/by-idempotency-key/otra').status_code == 404
+
+
+def test_next_priority_scheduling(client, monkeypatch):
+    """Test con CLAIM_SCHEDULING=priority se reclama primero la mayor prioridad."""
+    monkeypatch.setattr(Config, "CLAIM_SCHEDULING", "priority")
+    for nit, priority in (('100000001', 0), ('100000002', 5), ('100000003', 0)):
+        client.post(
+            '/api/v1/process-data', data=json.dumps({'nit': nit, 'priority': priority}),
+            content_type='application/json'
+        )
+    
+    claimed = client.get('/api/v1/next?limit=3').get_json()
+    assert [item['nit'] for item in claimed] == ['100000002', '100000001', '100000003']
+    assert claimed[0]['priority'] == 5
+    
+    response = client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '100000004', 'priority': 99}),
+        content_type='application/json'
+    )
+    assert response.status_code == 422
+
+
+def test_next_fair_scheduling_caps_in_flight_per_nit(client, monkeypatch):
+    """Test en modo fair un NIT con backlog no acapara los reclamos y respeta el límite en curso."""
+    monkeypatch.setattr(Config, "CLAIM_SCHEDULING", "fair")
+    monkeypatch.setattr(Config, "CLAIM_MAX_IN_FLIGHT_PER_NIT", 2)
+    monkeypatch.setattr(transactions_service_module, "_fair_after_nit", "")
+    client.post(
+        '/api/v1/process-data/batch',
+        data=json.dumps([{'nit': '900000001'} for _ in range(10)]),
+        content_type='application/json'
+    )
+    client.post('/api/v1/process-data', data=json.dumps({'nit': '800000001'}), content_type='application/json')
+    
+    claimed = client.get('/api/v1/next?limit=5').get_json()
+    nits = [item['nit'] for item in claimed]
+    assert sorted(nits) == ['800000001', '900000001', '900000001']
+    
+    # El NIT con backlog ya tiene 2 en curso: no recibe más hasta liberar cupo
+    assert client.get('/api/v1/next?limit=5').status_code == 204
+    
+    first = next(item for item in claimed if item['nit'] == '900000001')
+    client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': first['id'], 'status': 'PROCESADO'}),
+        content_type='application/json'
+    )
+    claimed = client.get('/api/v1/next?limit=5').get_json()
+    assert [item['nit'] for item in claimed] == ['900000001']
+
+
+def test_error_retries_with_backoff_until_dead_letter(client, monkeypatch):
+    """Test un ERROR se reprograma con backoff, no se reclama antes de vencer y al agotar intentos queda FALLIDO."""
+    monkeypatch.setattr(Config, "RETRY_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(Config, "RETRY_BACKOFF_BASE_SECONDS", 3600)
+    monkeypatch.setattr(Config, "RETRY_JITTER", 0)
+    transaction_id = client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '920000001'}), content_type='application/json'
+    ).get_json()['id']
+    assert client.get('/api/v1/next').get_json()['attempts'] == 1
+    
+    retried = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'ERROR', 'error_code': 'RUES_TIMEOUT'}),
+        content_type='application/json'
+    ).get_json()
+    assert retried['status'] == 'PENDIENTE'
+    assert retried['error_code'] == 'RUES_TIMEOUT'
+    assert datetime.fromisoformat(retried['next_attempt_at']) > datetime.now() + timedelta(minutes=59)
+    assert client.get('/api/v1/next').status_code == 204
+    
+    session = db_session.SessionLocal()
+    session.query(Transaction).filter(Transaction.id == transaction_id).update(
+        {Transaction.next_attempt_at: datetime.now() - timedelta(seconds=1)}
+    )
+    session.commit()
+    session.close()
+    assert client.get('/api/v1/next').get_json()['attempts'] == 2
+    
+    response = client.post(
+        '/api/v1/update-status/batch',
+        data=json.dumps([{'id': transaction_id, 'status': 'ERROR'}]),
+        content_type='application/json'
+    ).get_json()
+    assert response['results'][0]['transaction_status'] == 'FALLIDO'
+    assert client.get('/api/v1/stats').get_json()['counts']['FALLIDO'] == 1
+
+
+def test_next_attempt_at_uses_application_clock(client):
+    """Test next_attempt_at de una transacción nueva sale del reloj de la aplicación, el mismo del claim."""
+    before = datetime.now()
+    created = client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '920000002'}), content_type='application/json'
+    ).get_json()
+    after = datetime.now()
+    
+    assert before <= datetime.fromisoformat(created['next_attempt_at']) <= after
+    assert client.get('/api/v1/next').get_json()['id'] == created['id']
+
+
+def test_non_retryable_error_and_reaper_dead_letter(client, monkeypatch):
+    """Test retryable=false deja el ERROR definitivo y el reaper manda a FALLIDO lo que agotó intentos."""
+    monkeypatch.setattr(Config, "RETRY_MAX_ATTEMPTS", 1)
+    ids = [
+        client.post(
+            '/api/v1/process-data', data=json.dumps({'nit': f'93000000{index}'}), content_type='application/json'
+        ).get_json()['id']
+        for index in range(2)
+    ]
+    client.get('/api/v1/next?limit=2')
+    
+    permanent = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': ids[0], 'status': 'ERROR', 'retryable': False}),
+        content_type='application/json'
+    )
+    assert permanent.get_json()['status'] == 'ERROR'
+    
+    _expire_lease(ids[1])
+    assert reap_expired_leases() == 1
+    assert client.get('/api/v1/stats').get_json()['counts']['FALLIDO'] == 1
+    assert client.get('/api/v1/next').status_code == 204
+
+
+def test_large_payloads_are_stored_compressed(client, monkeypatch):
+    """Test los payloads grandes se guardan comprimidos con marcador y la API los devuelve intactos."""
+    monkeypatch.setattr(Config, "PAYLOAD_COMPRESSION", "zlib")
+    result_payload = {'actividades': [
+        {'codigo': f'{index:04d}', 'descripcion': 'Comercio al por mayor'} for index in range(500)
+    ]}
+    transaction_id = client.post(
+        '/api/v1/process-data', data=json.dumps({'nit': '940000001'}), content_type='application/json'
+    ).get_json()['id']
+    client.get('/api/v1/next')
+    response = client.post(
+        '/api/v1/update-status',
+        data=json.dumps({'id': transaction_id, 'status': 'PROCESADO', 'result_payload': result_payload}),
+        content_type='application/json'
+    )
+    assert response.get_json()['result_payload'] == result_payload
+    
+    session = db_session.SessionLocal()
+    stored_result, stored_in = session.execute(text(
+        "SELECT result_payload, payload_in FROM transactions WHERE id = :id"
+    ), {'id': transaction_id}).one()
+    assert stored_result[:1] == MARKER_ZLIB
+    assert len(stored_result) < len(json.dumps(result_payload)) / 10
+    # Los payloads pequeños siguen siendo texto JSON, como las filas anteriores
+    assert json.loads(stored_in) == {'nit': '940000001'}
+    # Al cargar la fila el payload no se descomprime hasta serializarlo
+    loaded = session.get(Transaction, transaction_id).result_payload
+    assert isinstance(loaded, LazyPayload) and not loaded._loaded
+    assert loaded.load() == result_payload
+    session.execute(text(
+        "UPDATE transactions SET result_payload = :legacy WHERE id = :id"
+    ), {'legacy': json.dumps({'legacy': True}), 'id': transaction_id})
+    session.commit()
+    session.close()
+    
+    transactions_service_module.clear_status_cache()
+    assert client.get(f'/api/v1/transactions/{transaction_id}').get_json()['result_payload'] == {'legacy': True}
+
+
+def test_fair_cursor_is_not_locked_during_claims(monkeypatch):
+    """Test en modo fair el lock del turno no cubre la consulta y un reclamo lento no retrocede el turno."""
+    monkeypatch.setattr(Config, "CLAIM_SCHEDULING", "fair")
+    monkeypatch.setattr(transactions_service_module, "_fair_after_nit", "")
+    service = transactions_service_module.TransactionsService()
+    cursors = []
+    
+    def fake_fair_claim(session, *, after_nit, **kwargs):
+        cursors.append(after_nit)
+        if len(cursors) == 1:
+            # Otro reclamo entra mientras este sigue en la base de datos; con
+            # el lock tomado durante la consulta este llamado se bloquearía
+            service._claim_pending(None, None, 1)
+            return [], "000000001"
+        return [], f"{len(cursors):09d}"
+    
+    monkeypatch.setattr(transactions_service_module.transactions_repo, "fetch_next_pending_fair", fake_fair_claim)
+    service._claim_pending(None, None, 1)
+    assert transactions_service_module._fair_after_nit == "000000002"
+    
+    service._claim_pending(None, None, 1)
+    assert cursors == ["", "", "000000002"]
+    assert transactions_service_module._fair_after_nit == "000000003"
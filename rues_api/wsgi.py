@@ -0,0 +1,8 @@
+"""Punto de entrada WSGI para producción (gunicorn -c gunicorn.conf.py wsgi:app)."""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import create_app
+
+app = create_app()